@@ -4,6 +4,7 @@ from sqlalchemy.orm import Session
 from typing import List
 from app.core.database import get_db
 from app.models.addons import Addon
+from app.core.addon_gating import addon_states
 
 
 router = APIRouter()
@@ -40,6 +41,7 @@ def install_addon(payload: AddonAction, db: Session = Depends(get_db)):
     addon.mark_installed()
     db.commit()
     db.refresh(addon)
+    addon_states.update(addon.slug, addon.enabled)
     return addon
 
 
@@ -52,6 +54,7 @@ def enable_addon(payload: AddonAction, db: Session = Depends(get_db)):
     addon.mark_enabled(True)
     db.commit()
     db.refresh(addon)
+    addon_states.update(addon.slug, addon.enabled)
     return addon
 
 
@@ -64,6 +67,7 @@ def disable_addon(payload: AddonAction, db: Session = Depends(get_db)):
     addon.mark_enabled(False)
     db.commit()
     db.refresh(addon)
+    addon_states.update(addon.slug, addon.enabled)
     return addon
 
 
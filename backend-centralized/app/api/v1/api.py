@@ -4,7 +4,7 @@ Single API router for all applications
 """
 
 from fastapi import APIRouter, HTTPException, Depends, WebSocket, WebSocketDisconnect
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import json
 from datetime import datetime, timedelta
 import random
@@ -25,7 +25,7 @@ from .dvr import router as dvr_router
 from .camera_management import router as camera_management_router
 from .websocket import router as websocket_router
 from ...core.realtime import realtime_manager
-from fastapi import Request
+from fastapi import Request, Response
 from .hr import router as hr_router
 from .compliance import router as compliance_router
 from .support import router as support_router
@@ -58,12 +58,27 @@ api_router.include_router(billing_router, prefix="/billing", tags=["billing"])
 api_router.include_router(dvr_router, prefix="/dvr", tags=["dvr"])
 # Lightweight recent events endpoint for AdminPanel
 @api_router.get("/realtime/events")
-async def get_recent_realtime_events(request: Request, limit: int = 50):
+async def get_recent_realtime_events(request: Request, response: Response, limit: int = 50,
+                                     since: Optional[int] = None, epoch: Optional[str] = None):
+    """Latest `limit` events, or with `since=<seq>&epoch=<epoch>` only the events after that seq
+    
+    Every event carries its `seq` and `epoch`; X-Realtime-Last-Seq and
+    X-Realtime-Epoch describe this worker's history. X-Realtime-Truncated is
+    set when events after `since` were already overwritten or the position
+    belongs to another history (a restart or another worker), so a
+    reconnecting client knows to fall back to a full reload.
+    """
     try:
-        events = list(getattr(realtime_manager, 'event_history', []))
-        return events[-limit:]
+        history = realtime_manager.get_event_history(
+            since=since, limit=max(1, min(limit, 1000)), epoch=epoch
+        )
     except Exception:
         return []
+    response.headers["X-Realtime-Last-Seq"] = str(history["last_seq"])
+    response.headers["X-Realtime-Epoch"] = history["epoch"]
+    if history["truncated"]:
+        response.headers["X-Realtime-Truncated"] = "true"
+    return history["events"]
 api_router.include_router(hr_router, prefix="/hr", tags=["hr"])
 api_router.include_router(compliance_router, prefix="/compliance", tags=["compliance"])
 api_router.include_router(support_router, prefix="/support", tags=["support"])
@@ -296,9 +311,4 @@ async def websocket_endpoint(websocket: WebSocket, app_name: str):
 @api_router.get("/realtime/stats", operation_id="api_get_realtime_stats")
 async def get_realtime_stats():
     """Get real-time system statistics"""
-    return realtime_manager.get_stats()
-
-@api_router.get("/realtime/events", operation_id="api_get_realtime_events")
-async def get_event_history():
-    """Get recent real-time events"""
-    return realtime_manager.get_event_history()
+    return realtime_manager.get_connection_stats()
@@ -16,7 +16,8 @@ import logging
 audit_logger = logging.getLogger(__name__)
 from app.models.client_management import Client, ClientBilling, BillingCycle
 from app.services.client_management_service import ClientManagementService
-from app.core.database import get_db
+from sqlalchemy.orm import Session
+from app.core.database import get_db, session_scope
 
 router = APIRouter(prefix="/billing", tags=["Billing Integration"])
 
@@ -73,11 +74,11 @@ def get_stripe_customer_id(client_id: str) -> str:
 @router.post("/create-customer", operation_id="billing_create_customer")
 async def create_stripe_customer(
     client_id: str,
-    current_user: str = Depends(get_current_user)
+    current_user: str = Depends(get_current_user),
+    db: Session = Depends(get_db)
 ):
     """Create a Stripe customer for a client"""
     try:
-        db = next(get_db())
         client_service = ClientManagementService(db)
         client = client_service.get_client(client_id)
         
@@ -115,11 +116,11 @@ async def create_stripe_customer(
 @router.post("/create-subscription", operation_id="billing_create_subscription")
 async def create_subscription(
     subscription_data: CreateSubscription,
-    current_user: str = Depends(get_current_user)
+    current_user: str = Depends(get_current_user),
+    db: Session = Depends(get_db)
 ):
     """Create a subscription for a client"""
     try:
-        db = next(get_db())
         client_service = ClientManagementService(db)
         client = client_service.get_client(subscription_data.client_id)
         
@@ -178,11 +179,11 @@ async def create_subscription(
 @router.post("/create-invoice", operation_id="billing_create_invoice")
 async def create_invoice(
     invoice_data: CreateInvoice,
-    current_user: str = Depends(get_current_user)
+    current_user: str = Depends(get_current_user),
+    db: Session = Depends(get_db)
 ):
     """Create an invoice for a client"""
     try:
-        db = next(get_db())
         client_service = ClientManagementService(db)
         client = client_service.get_client(invoice_data.client_id)
         
@@ -367,17 +368,17 @@ async def handle_payment_succeeded(invoice_data: Dict[str, Any]):
     """Handle successful payment"""
     try:
         # Update billing record status
-        db = next(get_db())
-        billing_record = db.query(ClientBilling).filter(
-            ClientBilling.invoice_url.contains(invoice_data["id"])
-        ).first()
-        
-        if billing_record:
-            billing_record.status = "paid"
-            billing_record.paid_date = datetime.now()
-            db.commit()
-            
-            audit_logger.info(f"Payment succeeded for invoice {invoice_data['id']}")
+        with session_scope() as db:
+            billing_record = db.query(ClientBilling).filter(
+                ClientBilling.invoice_url.contains(invoice_data["id"])
+            ).first()
+
+            if billing_record:
+                billing_record.status = "paid"
+                billing_record.paid_date = datetime.now()
+                db.commit()
+
+                audit_logger.info(f"Payment succeeded for invoice {invoice_data['id']}")
             
     except Exception as e:
         audit_logger.error(f"Error handling payment success: {str(e)}")
@@ -386,16 +387,16 @@ async def handle_payment_failed(invoice_data: Dict[str, Any]):
     """Handle failed payment"""
     try:
         # Update billing record status
-        db = next(get_db())
-        billing_record = db.query(ClientBilling).filter(
-            ClientBilling.invoice_url.contains(invoice_data["id"])
-        ).first()
-        
-        if billing_record:
-            billing_record.status = "failed"
-            db.commit()
-            
-            audit_logger.warning(f"Payment failed for invoice {invoice_data['id']}")
+        with session_scope() as db:
+            billing_record = db.query(ClientBilling).filter(
+                ClientBilling.invoice_url.contains(invoice_data["id"])
+            ).first()
+
+            if billing_record:
+                billing_record.status = "failed"
+                db.commit()
+
+                audit_logger.warning(f"Payment failed for invoice {invoice_data['id']}")
             
     except Exception as e:
         audit_logger.error(f"Error handling payment failure: {str(e)}")
@@ -20,10 +20,11 @@ from ...core.security import (
     verify_permission
 )
 from ...services.camera_integration import CameraManager, CameraConfig, camera_manager
-from ...core.database import get_db
-from sqlalchemy.orm import Session
+from ...core.database import get_async_db
+from sqlalchemy.ext.asyncio import AsyncSession
 from ...models.surveillance import Recording as RecordingModel
 from ...core.realtime import realtime_manager, EventType
+from ...core import tracing
 from cryptography.fernet import Fernet
 import subprocess
 import tempfile
@@ -136,7 +137,8 @@ async def generate_hls(recording_id: str):
         fernet = Fernet(key.encode())
         with file_path.open('rb') as f:
             ciphertext = f.read()
-        plaintext = fernet.decrypt(ciphertext)
+        with tracing.span("recording.decrypt", **{"recording.id": recording_id, "recording.bytes": len(ciphertext)}):
+            plaintext = fernet.decrypt(ciphertext)
         tmp = tempfile.NamedTemporaryFile(delete=False, suffix='.mp4')
         tmp.write(plaintext)
         tmp.flush()
@@ -149,7 +151,9 @@ async def generate_hls(recording_id: str):
             '-codec:v', 'libx264', '-codec:a', 'aac', '-start_number', '0',
             '-hls_time', '4', '-hls_list_size', '0', '-f', 'hls', str(playlist)
         ]
-        subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        with tracing.span("subprocess.ffmpeg", tracing.SPAN_KIND_CLIENT,
+                          **{"process.command": "ffmpeg", "ffmpeg.output": "hls", "recording.id": recording_id}):
+            subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     except subprocess.CalledProcessError as e:
         if tmp_input:
             try: os.unlink(tmp_input)
@@ -218,7 +222,7 @@ async def add_camera(
     camera_data: Dict[str, Any],
     request: Request,
     current_user: str = Depends(get_current_user_dev_optional),
-    db = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Add a new camera to the system"""
     try:
@@ -275,7 +279,7 @@ async def add_camera(
 async def get_cameras(
     request: Request,
     current_user: str = Depends(get_current_user_dev_optional),
-    db = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get all cameras"""
     try:
@@ -302,7 +306,7 @@ async def get_camera(
     camera_id: str,
     request: Request,
     current_user: str = Depends(get_current_user_dev_optional),
-    db = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get specific camera details"""
     try:
@@ -331,7 +335,7 @@ async def start_recording(
     camera_id: str,
     request: Request,
     current_user: str = Depends(get_current_user_dev_optional),
-    db = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Start recording for a camera"""
     try:
@@ -369,7 +373,7 @@ async def stop_recording(
     camera_id: str,
     request: Request,
     current_user: str = Depends(get_current_user_dev_optional),
-    db = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Stop recording for a camera"""
     try:
@@ -413,7 +417,7 @@ async def upload_recording(
     format: Optional[str] = Form("webm"),
     filename: Optional[str] = Form(None),
     current_user: str = Depends(get_current_user_dev_optional),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Upload a recording file and persist metadata in database.
     Accepts multipart/form-data with a video file and metadata fields.
@@ -491,8 +495,8 @@ async def upload_recording(
             created_at=datetime.utcnow()
         )
         db.add(recording_row)
-        db.commit()
-        db.refresh(recording_row)
+        await db.commit()
+        await db.refresh(recording_row)
 
         # Audit log
         await security_manager.log_access(
@@ -557,7 +561,7 @@ async def get_recordings(
     sort_dir: str = "desc",        # asc | desc
     request: Request = None,
     current_user: str = Depends(get_current_user_dev_optional),
-    db = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get all recordings"""
     try:
@@ -660,7 +664,7 @@ async def get_recording(
     recording_id: str,
     request: Request,
     current_user: str = Depends(get_current_user_dev_optional),
-    db = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get specific recording details"""
     try:
@@ -712,7 +716,7 @@ async def download_recording(
     recording_id: str,
     request: Request,
     current_user: str = Depends(get_current_user_dev_optional),
-    db = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Download a recording file"""
     try:
@@ -809,7 +813,7 @@ async def delete_recording(
     recording_id: str,
     request: Request,
     current_user: str = Depends(get_current_user_dev_optional),
-    db = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Delete a recording"""
     try:
@@ -922,7 +926,7 @@ async def test_camera_connection(
     camera_data: Dict[str, Any],
     request: Request,
     current_user: str = Depends(get_current_user_dev_optional),
-    db = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Test camera connection without adding it"""
     try:
@@ -981,7 +985,7 @@ async def test_camera_connection(
 async def get_storage_status(
     request: Request,
     current_user: str = Depends(get_current_user_dev_optional),
-    db = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get storage status and usage"""
     try:
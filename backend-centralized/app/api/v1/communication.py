@@ -19,6 +19,7 @@ from ...core.security import (
     verify_permission
 )
 from ...core.database import get_db
+from ...core.pubsub import hub, topic_segment, user_topic
 from sqlalchemy.orm import Session
 from ...models.communication import Conference as ConferenceModel, Fax as FaxModel
 # Simple logging for development
@@ -193,16 +194,23 @@ DISCORD_DATA = [
     }
 ]
 
-# WebSocket connections for real-time communication
-active_connections: Dict[str, WebSocket] = {}
+# WebSocket connections for real-time communication live in the pub/sub hub
+COMMUNICATION_SCOPE = "communication"
+
+
+def call_topic(session_id: str, is_video: bool = False) -> str:
+    return f"call/{'video' if is_video else 'voice'}/{topic_segment(session_id)}"
+
+
+def messages_topic(user_id: str) -> str:
+    return f"{user_topic(user_id)}/messages"
 
 # ==================== VOIP ENDPOINTS ====================
 
 @router.websocket("/ws/voice/{call_id}")
 async def voice_call_endpoint(websocket: WebSocket, call_id: str):
     """Real-time voice call WebSocket endpoint"""
-    await websocket.accept()
-    active_connections[f"voice_{call_id}"] = websocket
+    subscriber = await hub.connect(websocket, scope=COMMUNICATION_SCOPE, topics=(call_topic(call_id),))
     
     try:
         while True:
@@ -220,22 +228,22 @@ async def voice_call_endpoint(websocket: WebSocket, call_id: str):
                 # Handle ICE candidate
                 await handle_ice_candidate(websocket, message, call_id)
             elif message.get("type") == "audio":
-                # Broadcast audio data to other participants
-                for conn_id, conn in active_connections.items():
-                    if conn_id != f"voice_{call_id}" and conn_id.startswith("voice_"):
-                        await conn.send_text(json.dumps(message))
+                # Broadcast audio data to other participants of this call
+                await hub.publish(call_topic(call_id), message, exclude=subscriber.connection_id)
             
             audit_logger.info(f"Voice call {call_id}: {message.get('type', 'unknown')}")
             
     except WebSocketDisconnect:
-        del active_connections[f"voice_{call_id}"]
         audit_logger.info(f"Voice call {call_id} disconnected")
+    finally:
+        hub.disconnect(subscriber.connection_id)
 
 @router.websocket("/ws/video/{meeting_id}")
 async def video_conference_endpoint(websocket: WebSocket, meeting_id: str):
     """Real-time video conference WebSocket endpoint"""
-    await websocket.accept()
-    active_connections[f"video_{meeting_id}"] = websocket
+    subscriber = await hub.connect(
+        websocket, scope=COMMUNICATION_SCOPE, topics=(call_topic(meeting_id, is_video=True),)
+    )
     
     try:
         while True:
@@ -256,22 +264,22 @@ async def video_conference_endpoint(websocket: WebSocket, meeting_id: str):
                 # Handle ICE candidate
                 await handle_ice_candidate(websocket, message, meeting_id, is_video=True)
             elif message.get("type") in ["video", "audio", "screen_share"]:
-                # Broadcast media data to other participants
-                for conn_id, conn in active_connections.items():
-                    if conn_id != f"video_{meeting_id}" and conn_id.startswith("video_"):
-                        await conn.send_text(json.dumps(message))
+                # Broadcast media data to other participants of this meeting
+                await hub.publish(
+                    call_topic(meeting_id, is_video=True), message, exclude=subscriber.connection_id
+                )
             
             audit_logger.info(f"Video conference {meeting_id}: {message.get('type', 'unknown')}")
             
     except WebSocketDisconnect:
-        del active_connections[f"video_{meeting_id}"]
         audit_logger.info(f"Video conference {meeting_id} disconnected")
+    finally:
+        hub.disconnect(subscriber.connection_id)
 
 @router.websocket("/ws/messages")
 async def messaging_endpoint(websocket: WebSocket):
     """Real-time messaging WebSocket endpoint"""
-    await websocket.accept()
-    user_id = None
+    subscriber = await hub.connect(websocket, scope=COMMUNICATION_SCOPE)
     
     try:
         while True:
@@ -280,7 +288,8 @@ async def messaging_endpoint(websocket: WebSocket):
             
             if message.get("type") == "connect":
                 user_id = message.get("userId")
-                active_connections[f"messages_{user_id}"] = websocket
+                subscriber.user_id = user_id
+                hub.subscribe(subscriber.connection_id, messages_topic(user_id))
                 audit_logger.info(f"User {user_id} connected to messaging")
                 
             elif message.get("type") == "message":
@@ -292,25 +301,32 @@ async def messaging_endpoint(websocket: WebSocket):
                 await handle_typing_indicator(websocket, message)
                 
     except WebSocketDisconnect:
-        if user_id:
-            del active_connections[f"messages_{user_id}"]
         audit_logger.info(f"Messaging connection disconnected")
+    finally:
+        hub.disconnect(subscriber.connection_id)
 
 # Helper functions for WebRTC handling
+async def _forward_to_call(websocket: WebSocket, session_id: str, is_video: bool, payload: dict) -> int:
+    """Publish to the other participants of a call"""
+    sender = hub.connection_for(websocket)
+    return await hub.publish(
+        call_topic(session_id, is_video), payload,
+        exclude=sender.connection_id if sender is not None else None,
+    )
+
 async def handle_webrtc_offer(websocket: WebSocket, message: dict, session_id: str, is_video: bool = False):
     """Handle WebRTC offer from client"""
     try:
         # Store the offer for the target participant
         target_participant = message.get("targetParticipant")
         if target_participant:
-            # Forward offer to target participant
-            target_conn_id = f"video_{session_id}" if is_video else f"voice_{session_id}"
-            if target_conn_id in active_connections:
-                await active_connections[target_conn_id].send_text(json.dumps({
-                    "type": "offer",
-                    "offer": message.get("offer"),
-                    "fromParticipant": message.get("fromParticipant", "unknown")
-                }))
+            # Forward offer to the other participants; clients match targetParticipant
+            await _forward_to_call(websocket, session_id, is_video, {
+                "type": "offer",
+                "offer": message.get("offer"),
+                "fromParticipant": message.get("fromParticipant", "unknown"),
+                "targetParticipant": target_participant
+            })
     except Exception as e:
         audit_logger.error(f"Error handling WebRTC offer: {str(e)}")
 
@@ -319,14 +335,13 @@ async def handle_webrtc_answer(websocket: WebSocket, message: dict, session_id:
     try:
         target_participant = message.get("targetParticipant")
         if target_participant:
-            # Forward answer to target participant
-            target_conn_id = f"video_{session_id}" if is_video else f"voice_{session_id}"
-            if target_conn_id in active_connections:
-                await active_connections[target_conn_id].send_text(json.dumps({
-                    "type": "answer",
-                    "answer": message.get("answer"),
-                    "fromParticipant": message.get("fromParticipant", "unknown")
-                }))
+            # Forward answer to the other participants; clients match targetParticipant
+            await _forward_to_call(websocket, session_id, is_video, {
+                "type": "answer",
+                "answer": message.get("answer"),
+                "fromParticipant": message.get("fromParticipant", "unknown"),
+                "targetParticipant": target_participant
+            })
     except Exception as e:
         audit_logger.error(f"Error handling WebRTC answer: {str(e)}")
 
@@ -335,14 +350,13 @@ async def handle_ice_candidate(websocket: WebSocket, message: dict, session_id:
     try:
         target_participant = message.get("targetParticipant")
         if target_participant:
-            # Forward ICE candidate to target participant
-            target_conn_id = f"video_{session_id}" if is_video else f"voice_{session_id}"
-            if target_conn_id in active_connections:
-                await active_connections[target_conn_id].send_text(json.dumps({
-                    "type": "ice_candidate",
-                    "candidate": message.get("candidate"),
-                    "fromParticipant": message.get("fromParticipant", "unknown")
-                }))
+            # Forward ICE candidate to the other participants; clients match targetParticipant
+            await _forward_to_call(websocket, session_id, is_video, {
+                "type": "ice_candidate",
+                "candidate": message.get("candidate"),
+                "fromParticipant": message.get("fromParticipant", "unknown"),
+                "targetParticipant": target_participant
+            })
     except Exception as e:
         audit_logger.error(f"Error handling ICE candidate: {str(e)}")
 
@@ -352,18 +366,18 @@ async def handle_participant_join(websocket: WebSocket, message: dict, meeting_i
         participant = message.get("participant", {})
         
         # Notify all other participants in the meeting
-        for conn_id, conn in active_connections.items():
-            if conn_id.startswith(f"video_{meeting_id}") and conn != websocket:
-                await conn.send_text(json.dumps({
-                    "type": "participant_joined",
-                    "participant": participant
-                }))
+        await _forward_to_call(websocket, meeting_id, True, {
+            "type": "participant_joined",
+            "participant": participant
+        })
         
         # Send confirmation to the joining participant
-        await websocket.send_text(json.dumps({
-            "type": "call_connected",
-            "meetingId": meeting_id
-        }))
+        sender = hub.connection_for(websocket)
+        if sender is not None:
+            hub.send(sender.connection_id, {
+                "type": "call_connected",
+                "meetingId": meeting_id
+            })
         
     except Exception as e:
         audit_logger.error(f"Error handling participant join: {str(e)}")
@@ -374,22 +388,22 @@ async def handle_new_message(websocket: WebSocket, message: dict):
         recipient = message.get("recipient")
         if recipient:
             # Forward message to recipient
-            recipient_conn_id = f"messages_{recipient}"
-            if recipient_conn_id in active_connections:
-                await active_connections[recipient_conn_id].send_text(json.dumps({
-                    "type": "message",
-                    "messageId": message.get("messageId"),
-                    "sender": message.get("sender", "unknown"),
-                    "content": message.get("content"),
-                    "messageType": message.get("messageType", "text"),
-                    "timestamp": message.get("timestamp")
-                }))
-                
-                # Send delivery confirmation back to sender
-                await websocket.send_text(json.dumps({
+            delivered = await hub.publish(messages_topic(recipient), {
+                "type": "message",
+                "messageId": message.get("messageId"),
+                "sender": message.get("sender", "unknown"),
+                "content": message.get("content"),
+                "messageType": message.get("messageType", "text"),
+                "timestamp": message.get("timestamp")
+            })
+            
+            # Send delivery confirmation back to sender
+            sender = hub.connection_for(websocket)
+            if delivered and sender is not None:
+                hub.send(sender.connection_id, {
                     "type": "message_delivered",
                     "messageId": message.get("messageId")
-                }))
+                })
     except Exception as e:
         audit_logger.error(f"Error handling new message: {str(e)}")
 
@@ -399,13 +413,11 @@ async def handle_typing_indicator(websocket: WebSocket, message: dict):
         recipient = message.get("recipient")
         if recipient:
             # Forward typing indicator to recipient
-            recipient_conn_id = f"messages_{recipient}"
-            if recipient_conn_id in active_connections:
-                await active_connections[recipient_conn_id].send_text(json.dumps({
-                    "type": "typing",
-                    "sender": message.get("sender", "unknown"),
-                    "timestamp": message.get("timestamp")
-                }))
+            await hub.publish(messages_topic(recipient), {
+                "type": "typing",
+                "sender": message.get("sender", "unknown"),
+                "timestamp": message.get("timestamp")
+            }, coalesce_key=f"typing:{message.get('sender', 'unknown')}")
     except Exception as e:
         audit_logger.error(f"Error handling typing indicator: {str(e)}")
 
@@ -432,7 +444,7 @@ async def get_communication_dashboard(
                 "total_emails": total_emails,
                 "total_sms": total_sms,
                 "total_whatsapp": total_whatsapp,
-                "active_connections": len(active_connections)
+                "active_connections": hub.count(COMMUNICATION_SCOPE)
             },
             "recent_activity": {
                 "calls": CALLS_DATA[:5],
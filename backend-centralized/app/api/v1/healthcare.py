@@ -15,14 +15,15 @@ from ...core.security import (
     get_current_user_dev_optional,
     verify_permission,
 )
-from ...core.database import get_db
+from ...core.database import get_async_db
 from ...models.healthcare import (
     Patient as PatientModel,
     Appointment as AppointmentModel,
     LabResult as LabResultModel,
     Prescription as PrescriptionModel,
 )
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter()
 
@@ -61,13 +62,15 @@ FORM_SUBMISSIONS: list = []
 async def get_patients(
     request: Request,
     current_user: str = Depends(get_current_user_dev_optional),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Get all patients"""
     try:
         patients = []
         try:
-            orm_patients = db.query(PatientModel).limit(200).all()
+            orm_patients = (
+                await db.execute(select(PatientModel).limit(200))
+            ).scalars().all()
             for p in orm_patients:
                 patients.append(
                     {
@@ -111,12 +114,14 @@ async def get_patient_profile(
 async def get_appointments(
     request: Request,
     current_user: str = Depends(get_current_user_dev_optional),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     try:
         items = []
         try:
-            orm_appts = db.query(AppointmentModel).limit(200).all()
+            orm_appts = (
+                await db.execute(select(AppointmentModel).limit(200))
+            ).scalars().all()
             for a in orm_appts:
                 items.append(
                     {
@@ -149,7 +154,7 @@ async def get_appointments(
 async def get_recent_appointments(
     request: Request,
     current_user: str = Depends(get_current_user_dev_optional),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Tab-specific summary for appointments"""
     try:
@@ -166,12 +171,14 @@ async def get_recent_appointments(
 async def get_test_results(
     request: Request,
     current_user: str = Depends(get_current_user_dev_optional),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     try:
         items = []
         try:
-            orm_results = db.query(LabResultModel).limit(200).all()
+            orm_results = (
+                await db.execute(select(LabResultModel).limit(200))
+            ).scalars().all()
             for r in orm_results:
                 items.append(
                     {
@@ -204,7 +211,7 @@ async def get_test_results(
 async def get_recent_test_results(
     request: Request,
     current_user: str = Depends(get_current_user_dev_optional),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Tab-specific summary for test results"""
     try:
@@ -221,12 +228,14 @@ async def get_recent_test_results(
 async def get_medications(
     request: Request,
     current_user: str = Depends(get_current_user_dev_optional),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     try:
         items = []
         try:
-            orm_rx = db.query(PrescriptionModel).limit(200).all()
+            orm_rx = (
+                await db.execute(select(PrescriptionModel).limit(200))
+            ).scalars().all()
             for rx in orm_rx:
                 items.append(
                     {
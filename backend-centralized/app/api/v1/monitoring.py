@@ -3,15 +3,19 @@ Monitoring API endpoints
 Provides system status, metrics, and health check endpoints
 """
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
 from typing import Dict, Any, List
 from datetime import datetime, timedelta
 
 from app.core.monitoring import (
     get_system_status, metrics_collector, health_checker,
-    get_cache_stats
+    get_cache_stats, get_database_pool_stats
 )
-from app.core.auth import get_current_user_dev_optional
+from app.core.auth import User, get_current_user_dev_optional, require_admin
+from app.core.profiling import PROFILER_DEFAULT_INTERVAL, PROFILER_MAX_DURATION, Profile, profiler
+from app.core.tracing import tracer
+from app.core.query_audit import query_auditor
 from app.core.cache import cache_manager
 
 router = APIRouter()
@@ -34,7 +38,17 @@ async def system_status():
 async def get_metrics(hours: int = 24):
     """Get system metrics for the last N hours"""
     try:
-        return metrics_collector.get_metrics_summary(hours)
+        summary = metrics_collector.get_metrics_summary(hours)
+        summary['database_pool'] = get_database_pool_stats()
+        return summary
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/metrics/history")
+async def get_metrics_history(hours: float = Query(24, gt=0, le=168)):
+    """Per-minute (up to 24h) or per-hour (up to 7d) request and error rollups"""
+    try:
+        return metrics_collector.rollups.timeline(hours * 3600)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -42,10 +56,10 @@ async def get_metrics(hours: int = 24):
 async def get_health_checks():
     """Get detailed health check results"""
     try:
-        checks = health_checker.perform_health_checks()
+        checks = health_checker.get_health_checks()
         return {
             "timestamp": datetime.now().isoformat(),
-            "overall_health": health_checker.get_overall_health(),
+            "overall_health": health_checker.overall_status(checks),
             "checks": [
                 {
                     "service": check.service,
@@ -60,11 +74,27 @@ async def get_health_checks():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/database/pool")
+async def database_pool_statistics(current_user: User = Depends(require_admin)):
+    """Get connection pool gauges, checkout wait times and long-held connections"""
+    try:
+        return get_database_pool_stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/database/queries")
+async def database_query_audit(current_user: User = Depends(require_admin)):
+    """Get slow queries (with parameter shapes) and N+1 patterns detected per request"""
+    try:
+        return query_auditor.snapshot()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/cache/stats")
 async def cache_statistics():
-    """Get cache statistics"""
+    """Get cache statistics with per-prefix counters and latency histograms"""
     try:
-        return get_cache_stats()
+        return await cache_manager.get_stats()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -72,7 +102,7 @@ async def cache_statistics():
 async def clear_cache(pattern: str = "*"):
     """Clear cache entries matching pattern"""
     try:
-        success = cache_manager.clear(pattern)
+        success = await cache_manager.clear(pattern)
         return {
             "success": success,
             "pattern": pattern,
@@ -81,6 +111,22 @@ async def clear_cache(pattern: str = "*"):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/cache/invalidate")
+async def invalidate_cache_tags(
+    tags: List[str] = Query(...),
+    current_user: User = Depends(require_admin)
+):
+    """Invalidate cache entries recorded under the given tags"""
+    try:
+        removed = await cache_manager.invalidate_tags(*tags)
+        return {
+            "success": True,
+            "tags": tags,
+            "removed": removed
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/performance")
 async def performance_metrics():
     """Get performance metrics"""
@@ -156,7 +202,7 @@ async def get_alerts():
                 })
         
         # Check health checks for alerts
-        health_checks = health_checker.perform_health_checks()
+        health_checks = health_checker.get_health_checks()
         for check in health_checks:
             if check.status == 'unhealthy':
                 alerts.append({
@@ -230,9 +276,73 @@ async def monitoring_dashboard():
             "summary": {
                 "overall_health": system_status.get("overall_health", "unknown"),
                 "active_alerts": alerts.get("alert_count", 0),
-                "cache_hit_rate": cache_stats.get("memory_cache_size", 0),
+                "cache_hit_rate": cache_stats.get("hit_rate", 0.0),
                 "uptime_hours": system_status.get("summary", {}).get("system_metrics", {}).get("uptime_hours", 0)
             }
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+def _render_profile(profile: Profile, output: str):
+    if output == "collapsed":
+        return PlainTextResponse(profile.to_collapsed())
+    if output == "speedscope":
+        return profile.to_speedscope()
+    return profile.summary()
+
+@router.post("/profile")
+async def run_profiler(
+    duration: float = Query(10.0, gt=0, le=PROFILER_MAX_DURATION),
+    interval_ms: float = Query(PROFILER_DEFAULT_INTERVAL * 1000, ge=1, le=100),
+    output: str = Query("collapsed", pattern="^(collapsed|speedscope|summary)$"),
+    all_threads: bool = False,
+    current_user: User = Depends(require_admin)
+):
+    """Sample this worker's stacks for `duration` seconds (admin only)"""
+    if profiler.busy:
+        raise HTTPException(status_code=409, detail="A profiling session is already running on this worker")
+    profile = await profiler.profile_for(duration, interval_ms / 1000, all_threads=all_threads)
+    return _render_profile(profile, output)
+
+@router.get("/profiles")
+async def list_request_profiles(current_user: User = Depends(require_admin)):
+    """Recent per-request profiles captured via the X-Profile header (admin only)"""
+    return {"profiles": profiler.store.list()}
+
+@router.get("/profiles/{profile_id}")
+async def get_request_profile(
+    profile_id: str,
+    output: str = Query("collapsed", pattern="^(collapsed|speedscope|summary)$"),
+    current_user: User = Depends(require_admin)
+):
+    """Fetch a per-request profile by the id from its X-Profile-Id header (admin only)"""
+    profile = profiler.store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return _render_profile(profile, output)
+
+@router.get("/traces")
+async def list_traces(
+    limit: int = Query(50, ge=1, le=500),
+    min_duration_ms: float = 0.0,
+    tenant_id: str = None,
+    current_user: User = Depends(require_admin)
+):
+    """Recent request traces on this worker, newest first (admin only)"""
+    return {
+        "enabled": tracer.enabled,
+        "sample_rate": tracer.sample_rate,
+        "traces": tracer.memory.recent(limit, min_duration_ms, tenant_id)
+    }
+
+@router.get("/traces/{trace_id}")
+async def get_trace(
+    trace_id: str,
+    output: str = Query("spans", pattern="^(spans|otlp)$"),
+    current_user: User = Depends(require_admin)
+):
+    """One trace with its DB, cache, message and subprocess spans (admin only)"""
+    trace = tracer.memory.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace.to_otlp() if output == "otlp" else trace.to_dict()
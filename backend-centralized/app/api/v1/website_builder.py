@@ -9,6 +9,7 @@ from datetime import datetime, timedelta
 import json
 import uuid
 import asyncio
+from ...core.pubsub import hub, topic_segment
 from ...core.security import (
     security_manager, 
     access_control, 
@@ -168,31 +169,27 @@ TEMPLATES = [
     }
 ]
 
-# Real-time collaboration connections
-active_connections = {}
+# Real-time collaboration connections live in the pub/sub hub under website/{id}
+def website_topic(website_id: str) -> str:
+    return f"website/{topic_segment(website_id)}"
 
 @router.websocket("/ws/{website_id}")
 async def websocket_endpoint(websocket: WebSocket, website_id: str):
     """Real-time collaboration for website editing"""
-    await websocket.accept()
-    
-    if website_id not in active_connections:
-        active_connections[website_id] = []
-    
-    active_connections[website_id].append(websocket)
+    subscriber = await hub.connect(websocket, scope="website_builder", topics=(website_topic(website_id),))
     
     try:
         while True:
             data = await websocket.receive_text()
             message = json.loads(data)
             
-            # Broadcast changes to all connected users
-            for connection in active_connections[website_id]:
-                if connection != websocket:
-                    await connection.send_text(json.dumps(message))
+            # Broadcast changes to all other connected users
+            await hub.publish(website_topic(website_id), message, exclude=subscriber.connection_id)
                     
     except WebSocketDisconnect:
-        active_connections[website_id].remove(websocket)
+        pass
+    finally:
+        hub.disconnect(subscriber.connection_id)
 
 @router.get("/dashboard")
 async def get_website_builder_dashboard(
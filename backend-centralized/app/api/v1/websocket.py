@@ -24,11 +24,16 @@ router = APIRouter()
 async def websocket_endpoint(
     websocket: WebSocket,
     user_id: str,
-    client_id: Optional[str] = None
+    client_id: Optional[str] = None,
+    token: Optional[str] = None
 ):
-    """Enhanced WebSocket endpoint for real-time communication"""
+    """Enhanced WebSocket endpoint for real-time communication
+    
+    Pass an access token as `?token=` to receive tenant- and role-restricted
+    broadcasts (e.g. admin-only events).
+    """
     try:
-        await handle_websocket_connection(websocket, user_id, client_id)
+        await handle_websocket_connection(websocket, user_id, client_id, token=token)
         log_user_activity(user_id, "websocket_connected", {"client_id": client_id})
     except Exception as e:
         audit_logger.error(f"WebSocket connection error for user {user_id}: {str(e)}")
@@ -36,11 +41,12 @@ async def websocket_endpoint(
 @router.websocket("/ws/client/{client_id}")
 async def client_websocket_endpoint(
     websocket: WebSocket,
-    client_id: str
+    client_id: str,
+    token: Optional[str] = None
 ):
     """Enhanced WebSocket endpoint for client-specific communication"""
     try:
-        await handle_websocket_connection(websocket, f"client_{client_id}", client_id)
+        await handle_websocket_connection(websocket, f"client_{client_id}", client_id, token=token)
         log_user_activity(f"client_{client_id}", "client_websocket_connected", {"client_id": client_id})
     except Exception as e:
         audit_logger.error(f"Client WebSocket connection error for client {client_id}: {str(e)}")
@@ -125,7 +131,7 @@ async def broadcast_message(
                 user_id=data.get("user_id", current_user)
             )
         else:
-            # Generic broadcast
+            # Generic broadcast; filtered connections receive it under the "other" type
             await manager.broadcast(WebSocketMessage.create_message(message_type, data))
         
         log_user_activity(current_user, "broadcast_message", {
@@ -0,0 +1,133 @@
+"""
+Add-on Gating
+In-process add-on state table used to hide routes of disabled add-ons
+
+The table is loaded at startup, refreshed in the background once it is
+older than ADDON_STATE_TTL, and updated immediately when the add-ons API
+changes an add-on in this worker. Other workers pick up changes on their
+next refresh. The request path only does dict lookups.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+ADDON_STATE_TTL = float(os.getenv("ADDON_STATE_TTL", "30"))  # seconds
+
+API_V1_PREFIX = "/api/v1/"
+
+# First path segment after /api/v1/ -> add-on slug
+ADDON_ROUTE_PREFIXES: Dict[str, str] = {
+    "ai-analytics": "ai-analytics-suite",
+    "cloud-storage": "cloud-storage-pro",
+    "inventory": "inventory-tracker",
+    "financial": "financial-manager",
+    "education": "education-platform",
+    "hr": "hr-manager-plus",
+    "compliance": "compliance-guardian",
+    "support": "support-desk",
+    "autism-care": "autism-care",
+    "website-builder": "website-builder",
+    "mobile-app": "mobile-app",
+}
+
+
+def addon_slug_for_path(path: str) -> Optional[str]:
+    """Return the add-on slug gating a request path, if any"""
+    if not path.startswith(API_V1_PREFIX):
+        return None
+    segment = path[len(API_V1_PREFIX):].partition("/")[0]
+    return ADDON_ROUTE_PREFIXES.get(segment)
+
+
+class AddonStateTable:
+    """Enabled flag per add-on slug, kept in process memory"""
+
+    def __init__(self, ttl: float = ADDON_STATE_TTL):
+        self.ttl = ttl
+        self._enabled: Dict[str, bool] = {}
+        self._loaded_at: Optional[float] = None
+        self._generation = 0
+        self._refreshing = False
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_at is not None
+
+    def is_enabled(self, slug: str) -> bool:
+        """Unknown add-ons are treated as disabled (fail closed)"""
+        return self._enabled.get(slug, False)
+
+    def load(self, db=None) -> bool:
+        """Reload the table from the database (blocking)"""
+        from sqlalchemy import select
+
+        from app.core.database import SessionLocal, get_engine
+        from app.models.addons import Addon
+
+        # Core select on the table: needs no ORM mapper configuration
+        addons = Addon.__table__
+
+        generation = self._generation
+        if db is None:
+            get_engine()
+        session = db or SessionLocal()
+        try:
+            rows = session.execute(select(addons.c.slug, addons.c.enabled))
+            states = {slug: bool(enabled) for slug, enabled in rows}
+        except Exception as e:
+            logger.error(f"Failed to load add-on states: {e}")
+            if self._loaded_at is not None:
+                # Keep serving the last known states until the next TTL
+                self._loaded_at = time.monotonic()
+            return False
+        finally:
+            if db is None:
+                session.close()
+
+        if generation != self._generation:
+            # An add-on changed while we were reading; retry on the next request
+            return False
+        self._enabled = states
+        self._loaded_at = time.monotonic()
+        return True
+
+    def update(self, slug: str, enabled: bool):
+        """Apply an add-on change made by this worker immediately"""
+        states = dict(self._enabled)
+        states[slug] = bool(enabled)
+        self._enabled = states
+        self._generation += 1
+
+    def invalidate(self):
+        """Force a reload on the next gated request"""
+        self._loaded_at = None
+
+    def refresh_if_stale(self):
+        """Reload in a worker thread when the table is older than the TTL"""
+        if self._refreshing:
+            return
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.load()
+            return
+
+        self._refreshing = True
+        future = loop.run_in_executor(None, self.load)
+        future.add_done_callback(self._refresh_done)
+
+    def _refresh_done(self, future):
+        self._refreshing = False
+        if future.exception() is not None:
+            logger.error(f"Add-on state refresh failed: {future.exception()}")
+
+
+# Global add-on state table
+addon_states = AddonStateTable()
@@ -1,230 +1,931 @@
 """
 Caching Layer for Performance Optimization
 Handles Redis caching and in-memory caching for improved performance
+
+The cache is tiered: a size-bounded, in-process LRU tier (L1) sits in front
+of a shared Redis tier (L2) reached through a pooled ``redis.asyncio``
+client, so cache round-trips never block the event loop.
+
+Entries are invalidated by tag rather than by key pattern: every write
+records its key under tag sets (tenant, user, client, resource type, ...)
+and ``invalidate_tags`` unlinks those members in pipelined batches. For
+whole namespaces a generation counter is folded into the key instead, so
+bumping it invalidates in O(1) without touching any keys. Each worker keeps
+its last known generation and re-reads it from Redis at most every
+CACHE_GENERATION_TTL seconds, which bounds how long another worker's bump
+takes to be seen.
+
+Sync callers (FastAPI runs sync endpoints in a threadpool) update the local
+tier right away and hand the Redis side to the event loop bound with
+``bind_loop``.
 """
 
-import json
+import os
+import time
+import asyncio
 import hashlib
-from typing import Any, Optional, Union, Dict, List
-from datetime import datetime, timedelta
+import concurrent.futures
+import fnmatch
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional, Union, Dict, List, Tuple, Callable, Iterable, Set
 import logging
 from functools import wraps
 
+from app.core.cache_codec import CacheSerializer
+from app.core.latency import LatencyHistogram
+from app.core.tracing import traced
+
 logger = logging.getLogger(__name__)
 
+# Cache configuration
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+CACHE_REDIS_MAX_CONNECTIONS = int(os.getenv("CACHE_REDIS_MAX_CONNECTIONS", "50"))
+CACHE_REDIS_TIMEOUT = float(os.getenv("CACHE_REDIS_TIMEOUT", "2"))
+CACHE_REDIS_RETRY_SECONDS = float(os.getenv("CACHE_REDIS_RETRY_SECONDS", "30"))
+CACHE_MEMORY_MAX_ENTRIES = int(os.getenv("CACHE_MEMORY_MAX_ENTRIES", "10000"))
+CACHE_MEMORY_MAX_BYTES = int(os.getenv("CACHE_MEMORY_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_MEMORY_MAX_TTL = int(os.getenv("CACHE_MEMORY_MAX_TTL", "60"))  # seconds
+CACHE_TAG_TTL = int(os.getenv("CACHE_TAG_TTL", "86400"))  # seconds
+CACHE_GENERATION_TTL = float(os.getenv("CACHE_GENERATION_TTL", "1"))  # seconds
+CACHE_UNLINK_BATCH = 500
+
+TAG_KEY_PREFIX = "cache:tag:"
+GENERATION_KEY_PREFIX = "cache:gen:"
+
+_MISSING = object()
+_SWR_MARKER = "__swr__"
+
+
+class LRUMemoryCache:
+    """Size-bounded in-process cache with LRU and TTL eviction"""
+
+    def __init__(self, max_entries: int = CACHE_MEMORY_MAX_ENTRIES,
+                 max_bytes: int = CACHE_MEMORY_MAX_BYTES,
+                 on_evict: Optional[Callable[[str], None]] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.evictions = 0
+        self.on_evict = on_evict
+        # key -> (value, expires_at (monotonic), size in bytes, tags)
+        self._entries: "OrderedDict[str, Tuple[Any, float, int, Tuple[str, ...]]]" = OrderedDict()
+        self._tags: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str, default: Any = _MISSING) -> Any:
+        """Get a live value and mark it as most recently used"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[1] <= time.monotonic():
+                self._remove(key)
+                return default
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key: str, value: Any, ttl: float, size: int,
+            tags: Iterable[str] = ()) -> bool:
+        """Store a value, evicting least recently used entries to make room"""
+        if ttl <= 0 or size > self.max_bytes:
+            self.delete(key)
+            return False
+
+        tags = tuple(tags)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + ttl, size, tags)
+            self.current_bytes += size
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            self._evict()
+        return True
+
+    def delete(self, key: str) -> bool:
+        """Remove a key, returning whether it was present"""
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._remove(key)
+            return True
+
+    def clear(self, pattern: str = "*") -> int:
+        """Remove entries whose key matches a glob pattern"""
+        with self._lock:
+            if pattern == "*":
+                removed = len(self._entries)
+                self._entries.clear()
+                self._tags.clear()
+                self.current_bytes = 0
+                return removed
+
+            keys_to_remove = [k for k in self._entries if fnmatch.fnmatchcase(k, pattern)]
+            for key in keys_to_remove:
+                self._remove(key)
+            return len(keys_to_remove)
+
+    def invalidate_tags(self, tags: Iterable[str]) -> int:
+        """Remove every entry recorded under any of the given tags"""
+        with self._lock:
+            keys: Set[str] = set()
+            for tag in tags:
+                keys.update(self._tags.pop(tag, ()))
+            for key in keys:
+                if key in self._entries:
+                    self._remove(key)
+            return len(keys)
+
+    def purge_expired(self) -> int:
+        """Drop every expired entry"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [k for k, entry in self._entries.items() if entry[1] <= now]
+            for key in expired:
+                self._remove(key)
+            return len(expired)
+
+    def _remove(self, key: str):
+        _, _, size, tags = self._entries.pop(key)
+        self.current_bytes -= size
+        self._untag(key, tags)
+
+    def _untag(self, key: str, tags: Tuple[str, ...]):
+        for tag in tags:
+            members = self._tags.get(tag)
+            if members is not None:
+                members.discard(key)
+                if not members:
+                    del self._tags[tag]
+
+    def _evict(self):
+        # Pop from the LRU end only, so a write at capacity stays O(1);
+        # expired entries are dropped when read or once they age out here
+        while self._entries and (
+            len(self._entries) > self.max_entries or self.current_bytes > self.max_bytes
+        ):
+            key, (_, _, size, tags) = self._entries.popitem(last=False)
+            self.current_bytes -= size
+            self._untag(key, tags)
+            self._record_eviction(key)
+
+    def _record_eviction(self, key: str):
+        self.evictions += 1
+        if self.on_evict is not None:
+            self.on_evict(key)
+
+
+class SingleFlight:
+    """Coalesces concurrent computations of the same key into one call"""
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._calls
+
+    @staticmethod
+    def _cancel_requested() -> bool:
+        """Whether the current task itself is being cancelled"""
+        task = asyncio.current_task()
+        cancelling = getattr(task, "cancelling", None)
+        return bool(cancelling and cancelling())
+
+    async def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Run ``fn`` once per key; returns (result, shared_with_another_caller)
+
+        If the leader is cancelled (e.g. its client disconnected), waiters
+        are not: they retry, and the first one to get there leads a new call.
+        """
+        while True:
+            future = self._calls.get(key)
+            if future is None:
+                break
+            try:
+                return await asyncio.shield(future), True
+            except asyncio.CancelledError:
+                if not future.cancelled() or self._cancel_requested():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark as retrieved so unawaited failures don't log on GC
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            self._calls.pop(key, None)
+
+
+@dataclass
+class CoalescingStats:
+    """Counters for request coalescing and stale-while-revalidate"""
+    coalesced_waits: int = 0
+    stale_serves: int = 0
+    refreshes: int = 0
+    refresh_failures: int = 0
+    refresh_time_total: float = 0.0
+    refresh_time_max: float = 0.0
+
+    def record_refresh(self, duration: float, success: bool = True):
+        self.refreshes += 1
+        if not success:
+            self.refresh_failures += 1
+        self.refresh_time_total += duration
+        self.refresh_time_max = max(self.refresh_time_max, duration)
+
+    def to_dict(self) -> Dict[str, Any]:
+        avg = self.refresh_time_total / self.refreshes if self.refreshes else 0.0
+        return {
+            'coalesced_waits': self.coalesced_waits,
+            'stale_serves': self.stale_serves,
+            'refreshes': self.refreshes,
+            'refresh_failures': self.refresh_failures,
+            'refresh_latency_avg_ms': round(avg * 1000, 2),
+            'refresh_latency_max_ms': round(self.refresh_time_max * 1000, 2),
+        }
+
+
+class PrefixStats:
+    """Counters for one key prefix"""
+
+    __slots__ = (
+        "memory_hits", "redis_hits", "misses", "sets", "deletes", "evictions",
+        "bytes_read", "bytes_written", "get_latency", "set_latency",
+    )
+
+    def __init__(self):
+        self.memory_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.deletes = 0
+        self.evictions = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.get_latency = LatencyHistogram()
+        self.set_latency = LatencyHistogram()
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.redis_hits
+
+    def to_dict(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'memory_hits': self.memory_hits,
+            'redis_hits': self.redis_hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'sets': self.sets,
+            'deletes': self.deletes,
+            'evictions': self.evictions,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'get_latency': self.get_latency.to_dict(),
+            'set_latency': self.set_latency.to_dict(),
+        }
+
+
+class CacheMetrics:
+    """Per-prefix cache counters
+
+    Counters are plain integer increments without a lock: exact on the
+    event loop, approximate when sync callers race from worker threads.
+    """
+
+    def __init__(self):
+        self.prefixes: Dict[str, PrefixStats] = {}
+
+    @staticmethod
+    def prefix_of(key: str) -> str:
+        return key.split(":", 1)[0]
+
+    def for_key(self, key: str) -> PrefixStats:
+        prefix = self.prefix_of(key)
+        stats = self.prefixes.get(prefix)
+        if stats is None:
+            stats = self.prefixes.setdefault(prefix, PrefixStats())
+        return stats
+
+    def record_eviction(self, key: str):
+        self.for_key(key).evictions += 1
+
+    def totals(self) -> Dict[str, int]:
+        prefixes = list(self.prefixes.values())
+        return {
+            'hits': sum(p.hits for p in prefixes),
+            'misses': sum(p.misses for p in prefixes),
+            'sets': sum(p.sets for p in prefixes),
+            'evictions': sum(p.evictions for p in prefixes),
+            'bytes_written': sum(p.bytes_written for p in prefixes),
+        }
+
+    def hit_rate(self) -> float:
+        totals = self.totals()
+        lookups = totals['hits'] + totals['misses']
+        return totals['hits'] / lookups if lookups else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        totals = self.totals()
+        return {
+            **totals,
+            'hit_rate': round(self.hit_rate(), 4),
+            'prefixes': {prefix: stats.to_dict() for prefix, stats in list(self.prefixes.items())},
+        }
+
+    def reset(self):
+        self.prefixes = {}
+
+
+def _key_attributes(self, key: str, *args, **kwargs) -> Dict[str, Any]:
+    """Span attributes for single-key cache calls"""
+    return {"cache.prefix": CacheMetrics.prefix_of(key)}
+
+
 class CacheManager:
     """Cache manager for handling both Redis and in-memory caching"""
-    
-    def __init__(self):
+
+    def __init__(self, redis_url: Optional[str] = REDIS_URL,
+                 max_entries: int = CACHE_MEMORY_MAX_ENTRIES,
+                 max_bytes: int = CACHE_MEMORY_MAX_BYTES,
+                 memory_ttl: int = CACHE_MEMORY_MAX_TTL,
+                 serializer: Optional[CacheSerializer] = None):
         self.redis_client = None
-        self.memory_cache: Dict[str, Dict[str, Any]] = {}
-        self._init_redis()
-    
-    def _init_redis(self):
-        """Initialize Redis connection"""
+        self.redis_pool = None
+        self.metrics = CacheMetrics()
+        self.memory = LRUMemoryCache(
+            max_entries=max_entries, max_bytes=max_bytes,
+            on_evict=self.metrics.record_eviction,
+        )
+        self.memory_ttl = memory_ttl
+        self.serializer = serializer or CacheSerializer()
+        self._redis_retry_at = 0.0
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._background_tasks: set = set()
+        # namespace -> last known generation, and when it was last read from Redis
+        self.generations: Dict[str, int] = {}
+        self._generation_checked: Dict[str, float] = {}
+        self.flights = SingleFlight()
+        self.coalescing = CoalescingStats()
+        self.refreshing: set = set()
+        if redis_url:
+            self._init_redis(redis_url)
+
+    def _init_redis(self, redis_url: str):
+        """Initialize the Redis connection pool (connections are opened lazily)"""
         try:
-            import redis
-            self.redis_client = redis.Redis(
-                host='localhost',
-                port=6379,
-                db=0,
-                decode_responses=True,
-                socket_connect_timeout=5,
-                socket_timeout=5
+            import redis.asyncio as aioredis
+            self.redis_pool = aioredis.ConnectionPool.from_url(
+                redis_url,
+                max_connections=CACHE_REDIS_MAX_CONNECTIONS,
+                socket_connect_timeout=CACHE_REDIS_TIMEOUT,
+                socket_timeout=CACHE_REDIS_TIMEOUT,
             )
-            # Test connection
-            self.redis_client.ping()
-            logger.info("Redis cache connected successfully")
+            self.redis_client = aioredis.Redis(connection_pool=self.redis_pool)
         except Exception as e:
             logger.warning(f"Redis not available, using in-memory cache: {e}")
             self.redis_client = None
-    
+            self.redis_pool = None
+
+    @property
+    def redis_available(self) -> bool:
+        """Whether the Redis tier should be tried right now"""
+        return self.redis_client is not None and time.monotonic() >= self._redis_retry_at
+
+    def _mark_redis_down(self, error: Exception):
+        """Skip the Redis tier for a while after a connection failure"""
+        if time.monotonic() >= self._redis_retry_at:
+            logger.warning(
+                f"Redis cache unavailable, using in-memory cache for "
+                f"{CACHE_REDIS_RETRY_SECONDS:.0f}s: {error}"
+            )
+        self._redis_retry_at = time.monotonic() + CACHE_REDIS_RETRY_SECONDS
+
     def _generate_key(self, prefix: str, *args, **kwargs) -> str:
-        """Generate cache key from prefix and arguments"""
+        """Generate cache key from prefix and arguments
+
+        The prefix is kept readable in front of the argument hash.
+        """
         key_parts = [prefix]
-        
+
         # Add args
         if args:
             key_parts.extend([str(arg) for arg in args])
-        
+
         # Add kwargs (sorted for consistency)
         if kwargs:
             sorted_kwargs = sorted(kwargs.items())
             key_parts.extend([f"{k}:{v}" for k, v in sorted_kwargs])
-        
+
         key_string = "|".join(key_parts)
-        return hashlib.md5(key_string.encode()).hexdigest()
-    
-    def get(self, key: str, default: Any = None) -> Any:
+        return f"{prefix}:{hashlib.md5(key_string.encode()).hexdigest()}"
+
+    def _encode(self, value: Any, tags: Iterable[str] = ()) -> bytes:
+        return self.serializer.dumps(value, tags)
+
+    def _decode(self, payload: bytes) -> Tuple[Any, Tuple[str, ...]]:
+        return self.serializer.loads_tagged(payload)
+
+    @traced("cache.get", attributes=_key_attributes)
+    async def get(self, key: str, default: Any = None) -> Any:
         """Get value from cache"""
+        stats = self.metrics.for_key(key)
+        started = time.perf_counter()
         try:
-            # Try Redis first
-            if self.redis_client:
-                value = self.redis_client.get(key)
-                if value:
-                    return json.loads(value)
-            
-            # Fallback to memory cache
-            if key in self.memory_cache:
-                cache_entry = self.memory_cache[key]
-                if cache_entry['expires_at'] > datetime.now():
-                    return cache_entry['value']
-                else:
-                    # Remove expired entry
-                    del self.memory_cache[key]
-            
+            value = self.memory.get(key)
+            if value is not _MISSING:
+                stats.memory_hits += 1
+                return value
+
+            if self.redis_available:
+                try:
+                    payload = await self.redis_client.get(key)
+                except Exception as e:
+                    self._mark_redis_down(e)
+                    payload = None
+                if payload is not None:
+                    # Keep the tags so tag invalidation reaches this copy too
+                    value, tags = self._decode(payload)
+                    self.memory.set(key, value, self.memory_ttl, len(payload), tags)
+                    stats.redis_hits += 1
+                    stats.bytes_read += len(payload)
+                    return value
+
+            stats.misses += 1
             return default
-            
+
         except Exception as e:
             logger.error(f"Cache get error for key {key}: {e}")
             return default
-    
-    def set(self, key: str, value: Any, ttl: int = 3600) -> bool:
-        """Set value in cache with TTL"""
+        finally:
+            stats.get_latency.record(time.perf_counter() - started)
+
+    @traced("cache.set", attributes=_key_attributes)
+    async def set(self, key: str, value: Any, ttl: int = 3600,
+                  tags: Iterable[str] = ()) -> bool:
+        """Set value in cache with TTL, recording the key under each tag"""
+        stats = self.metrics.for_key(key)
+        started = time.perf_counter()
         try:
-            # Try Redis first
-            if self.redis_client:
-                self.redis_client.setex(key, ttl, json.dumps(value))
-                return True
-            
-            # Fallback to memory cache
-            expires_at = datetime.now() + timedelta(seconds=ttl)
-            self.memory_cache[key] = {
-                'value': value,
-                'expires_at': expires_at
-            }
+            tags = tuple(tags)
+            payload = self._encode(value, tags)
+            stats.sets += 1
+            stats.bytes_written += len(payload)
+
+            if self.redis_available:
+                try:
+                    async with self.redis_client.pipeline(transaction=False) as pipe:
+                        pipe.set(key, payload, ex=ttl)
+                        for tag in tags:
+                            tag_key = TAG_KEY_PREFIX + tag
+                            pipe.sadd(tag_key, key)
+                            pipe.expire(tag_key, max(ttl, CACHE_TAG_TTL))
+                        await pipe.execute()
+                except Exception as e:
+                    self._mark_redis_down(e)
+
+            # With Redis reachable the memory tier only holds a short-lived copy
+            memory_ttl = min(ttl, self.memory_ttl) if self.redis_available else ttl
+            self.memory.set(key, value, memory_ttl, len(payload), tags)
             return True
-            
+
         except Exception as e:
             logger.error(f"Cache set error for key {key}: {e}")
             return False
-    
-    def delete(self, key: str) -> bool:
+        finally:
+            stats.set_latency.record(time.perf_counter() - started)
+
+    @traced("cache.delete", attributes=_key_attributes)
+    async def delete(self, key: str) -> bool:
         """Delete value from cache"""
         try:
-            # Try Redis first
-            if self.redis_client:
-                self.redis_client.delete(key)
-            
-            # Remove from memory cache
-            if key in self.memory_cache:
-                del self.memory_cache[key]
-            
+            self.metrics.for_key(key).deletes += 1
+            self.memory.delete(key)
+
+            if self.redis_available:
+                try:
+                    await self.redis_client.delete(key)
+                except Exception as e:
+                    self._mark_redis_down(e)
+
             return True
-            
+
         except Exception as e:
             logger.error(f"Cache delete error for key {key}: {e}")
             return False
-    
-    def clear(self, pattern: str = "*") -> bool:
-        """Clear cache entries matching pattern"""
+
+    @traced("cache.invalidate_tags", attributes=lambda self, *tags: {"cache.tags": ",".join(tags)})
+    async def invalidate_tags(self, *tags: str) -> int:
+        """Delete every entry recorded under any of the given tags"""
         try:
-            # Try Redis first
-            if self.redis_client:
-                keys = self.redis_client.keys(pattern)
-                if keys:
-                    self.redis_client.delete(*keys)
-            
-            # Clear memory cache if pattern is "*"
-            if pattern == "*":
-                self.memory_cache.clear()
-            else:
-                # Remove matching keys from memory cache
-                keys_to_remove = [k for k in self.memory_cache.keys() if pattern in k]
-                for key in keys_to_remove:
-                    del self.memory_cache[key]
-            
+            removed = self.memory.invalidate_tags(tags)
+
+            if self.redis_available and tags:
+                try:
+                    tag_keys = [TAG_KEY_PREFIX + tag for tag in tags]
+                    async with self.redis_client.pipeline(transaction=False) as pipe:
+                        for tag_key in tag_keys:
+                            pipe.smembers(tag_key)
+                        member_sets = await pipe.execute()
+
+                    keys = set().union(*member_sets) if member_sets else set()
+                    removed = max(removed, len(keys))
+                    await self._unlink([*keys, *tag_keys])
+                except Exception as e:
+                    self._mark_redis_down(e)
+
+            return removed
+
+        except Exception as e:
+            logger.error(f"Cache invalidation error for tags {tags}: {e}")
+            return 0
+
+    def generation_is_stale(self, namespace: str) -> bool:
+        """Whether the shared generation should be re-read from Redis"""
+        if not self.redis_available:
+            return False
+        checked = self._generation_checked.get(namespace)
+        return checked is None or time.monotonic() - checked >= CACHE_GENERATION_TTL
+
+    async def get_generation(self, namespace: str) -> int:
+        """Get the current generation of a namespace"""
+        if self.generation_is_stale(namespace):
+            try:
+                shared = await self.redis_client.get(GENERATION_KEY_PREFIX + namespace)
+                self.generations[namespace] = int(shared or 0)
+                self._generation_checked[namespace] = time.monotonic()
+            except Exception as e:
+                self._mark_redis_down(e)
+        return self.generations.get(namespace, 0)
+
+    def bump_generation_local(self, namespace: str) -> int:
+        """Move this worker to a new generation (safe from sync code)"""
+        generation = self.generations.get(namespace, 0) + 1
+        self.generations[namespace] = generation
+        return generation
+
+    async def bump_generation(self, namespace: str) -> int:
+        """Invalidate a whole namespace in O(1) by moving to a new generation"""
+        generation = self.bump_generation_local(namespace)
+        if self.redis_available:
+            try:
+                generation = int(await self.redis_client.incr(GENERATION_KEY_PREFIX + namespace))
+                self.generations[namespace] = generation
+                self._generation_checked[namespace] = time.monotonic()
+            except Exception as e:
+                self._mark_redis_down(e)
+        return generation
+
+    async def namespaced_key(self, namespace: str, key: str) -> str:
+        """Prefix a key with its namespace's current generation"""
+        return f"{namespace}:g{await self.get_generation(namespace)}:{key}"
+
+    @traced("cache.clear", attributes=lambda self, pattern="*": {"cache.pattern": pattern})
+    async def clear(self, pattern: str = "*") -> bool:
+        """Clear cache entries matching pattern
+
+        This walks the Redis keyspace with incremental SCAN, so it is meant
+        for admin use. Application code should use ``invalidate_tags`` or
+        ``bump_generation`` instead.
+        """
+        try:
+            self.memory.clear(pattern)
+
+            if self.redis_available:
+                try:
+                    batch = []
+                    async for key in self.redis_client.scan_iter(match=pattern, count=CACHE_UNLINK_BATCH):
+                        batch.append(key)
+                        if len(batch) >= CACHE_UNLINK_BATCH:
+                            await self._unlink(batch)
+                            batch = []
+                    await self._unlink(batch)
+                except Exception as e:
+                    self._mark_redis_down(e)
+
             return True
-            
+
         except Exception as e:
             logger.error(f"Cache clear error for pattern {pattern}: {e}")
             return False
-    
-    def exists(self, key: str) -> bool:
+
+    async def _unlink(self, keys: List[Any]):
+        """UNLINK keys in pipelined batches so Redis frees them off-thread"""
+        if not keys:
+            return
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for start in range(0, len(keys), CACHE_UNLINK_BATCH):
+                pipe.unlink(*keys[start:start + CACHE_UNLINK_BATCH])
+            await pipe.execute()
+
+    @traced("cache.exists", attributes=_key_attributes)
+    async def exists(self, key: str) -> bool:
         """Check if key exists in cache"""
         try:
-            # Try Redis first
-            if self.redis_client:
-                return bool(self.redis_client.exists(key))
-            
-            # Check memory cache
-            if key in self.memory_cache:
-                cache_entry = self.memory_cache[key]
-                if cache_entry['expires_at'] > datetime.now():
-                    return True
-                else:
-                    # Remove expired entry
-                    del self.memory_cache[key]
-            
+            if self.memory.get(key) is not _MISSING:
+                return True
+
+            if self.redis_available:
+                try:
+                    return bool(await self.redis_client.exists(key))
+                except Exception as e:
+                    self._mark_redis_down(e)
+
             return False
-            
+
         except Exception as e:
             logger.error(f"Cache exists error for key {key}: {e}")
             return False
-    
-    def get_stats(self) -> Dict[str, Any]:
+
+    def get_local(self, key: str, default: Any = None) -> Any:
+        """Get value from the in-process tier only (safe from sync code)"""
+        stats = self.metrics.for_key(key)
+        started = time.perf_counter()
+        value = self.memory.get(key)
+        stats.get_latency.record(time.perf_counter() - started)
+        if value is _MISSING:
+            stats.misses += 1
+            return default
+        stats.memory_hits += 1
+        return value
+
+    def set_local(self, key: str, value: Any, ttl: int = 3600,
+                  tags: Iterable[str] = ()) -> bool:
+        """Set value in the in-process tier only (safe from sync code)"""
+        stats = self.metrics.for_key(key)
+        started = time.perf_counter()
+        try:
+            size = len(self._encode(value))
+            stats.sets += 1
+            stats.bytes_written += size
+            return self.memory.set(key, value, ttl, size, tags)
+        except Exception as e:
+            logger.error(f"Cache set error for key {key}: {e}")
+            return False
+        finally:
+            stats.set_latency.record(time.perf_counter() - started)
+
+    def clear_local(self, pattern: str = "*") -> int:
+        """Clear matching entries from the in-process tier only"""
+        return self.memory.clear(pattern)
+
+    def invalidate_tags_local(self, *tags: str) -> int:
+        """Invalidate tagged entries in the in-process tier only"""
+        return self.memory.invalidate_tags(tags)
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        """Event loop that owns the Redis connections; work from other threads runs there"""
+        self.loop = loop
+
+    def schedule(self, coro) -> Optional[Union[asyncio.Task, concurrent.futures.Future]]:
+        """Run a cache coroutine in the background
+
+        On the event loop it becomes a task; from another thread it is
+        submitted to the bound loop. With no loop to run it, it is dropped
+        with a warning.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None:
+            if self.loop is not None and self.loop.is_running():
+                return asyncio.run_coroutine_threadsafe(coro, self.loop)
+            logger.warning(f"No event loop to run {coro.__qualname__}; Redis cache not updated")
+            coro.close()
+            return None
+        task = loop.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    def get_local_stats(self) -> Dict[str, Any]:
+        """Get cache statistics without touching Redis (safe from sync code)"""
+        return {
+            'redis_connected': self.redis_available,
+            'hit_rate': round(self.metrics.hit_rate(), 4),
+            'memory_cache_size': len(self.memory),
+            'memory_cache_bytes': self.memory.current_bytes,
+            'memory_cache_max_entries': self.memory.max_entries,
+            'memory_cache_max_bytes': self.memory.max_bytes,
+            'memory_cache_evictions': self.memory.evictions,
+            'coalescing': self.coalescing.to_dict(),
+            'metrics': self.metrics.snapshot(),
+        }
+
+    async def get_stats(self) -> Dict[str, Any]:
         """Get cache statistics"""
         try:
-            stats = {
-                'redis_connected': self.redis_client is not None,
-                'memory_cache_size': len(self.memory_cache),
-                'memory_cache_keys': list(self.memory_cache.keys())
-            }
-            
-            if self.redis_client:
+            stats = self.get_local_stats()
+
+            if self.redis_available:
                 try:
-                    info = self.redis_client.info()
+                    info = await self.redis_client.info()
                     stats['redis_info'] = {
                         'used_memory': info.get('used_memory_human'),
                         'connected_clients': info.get('connected_clients'),
                         'total_commands_processed': info.get('total_commands_processed')
                     }
                 except Exception as e:
+                    self._mark_redis_down(e)
                     stats['redis_info'] = {'error': str(e)}
-            
+
             return stats
-            
+
         except Exception as e:
             logger.error(f"Cache stats error: {e}")
             return {'error': str(e)}
 
+    async def close(self):
+        """Release pooled Redis connections"""
+        if self.redis_client is not None:
+            try:
+                await self.redis_client.aclose()
+            except Exception as e:
+                logger.warning(f"Error closing Redis cache connections: {e}")
+
 # Global cache manager instance
 cache_manager = CacheManager()
 
-def cached(prefix: str, ttl: int = 3600):
-    """Decorator for caching function results"""
+def _wrap_stale(value: Any, ttl: int, stale_ttl: int) -> Any:
+    """Wrap a value with its freshness deadline for stale-while-revalidate"""
+    if stale_ttl <= 0:
+        return value
+    return {_SWR_MARKER: True, 'value': value, 'fresh_until': time.time() + ttl}
+
+def _unwrap_stale(cached_value: Any) -> Tuple[Any, bool]:
+    """Return (value, is_fresh) for a value stored by ``_wrap_stale``"""
+    if isinstance(cached_value, dict) and cached_value.get(_SWR_MARKER):
+        return cached_value['value'], time.time() < cached_value['fresh_until']
+    return cached_value, True
+
+TagSpec = Union[Iterable[str], Callable[..., Iterable[str]], None]
+
+def _resolve_tags(prefix: Optional[str], tags: TagSpec, args: tuple, kwargs: dict) -> Tuple[str, ...]:
+    """Resolve a decorator's tag spec against the call arguments"""
+    resolved = [prefix] if prefix else []
+    if callable(tags):
+        resolved.extend(tags(*args, **kwargs) or ())
+    elif tags:
+        resolved.extend(tags)
+    return tuple(resolved)
+
+def cached(prefix: str, ttl: int = 3600, stale_ttl: int = 0,
+           tags: TagSpec = None, namespace: Optional[str] = None):
+    """Decorator for caching function results
+
+    Coroutine functions use both cache tiers, and concurrent misses on the
+    same key await a single in-flight computation. With ``stale_ttl`` set,
+    a value past its ``ttl`` keeps being served for up to ``stale_ttl``
+    more seconds while one background task refreshes it.
+
+    Every entry is tagged with ``prefix`` plus ``tags``, which may be a
+    list or a callable receiving the call arguments. With ``namespace``
+    set the key carries the namespace generation, see ``bump_generation``.
+
+    Plain functions can't await Redis, so they are cached in the
+    in-process tier only.
+    """
     def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            async def compute(cache_key: str, args: tuple, kwargs: dict):
+                result = await func(*args, **kwargs)
+                if result is not None:
+                    await cache_manager.set(
+                        cache_key, _wrap_stale(result, ttl, stale_ttl), ttl + stale_ttl,
+                        tags=_resolve_tags(prefix, tags, args, kwargs),
+                    )
+                return result
+
+            async def refresh(cache_key: str, args: tuple, kwargs: dict):
+                started = time.perf_counter()
+                try:
+                    await cache_manager.flights.do(
+                        cache_key, lambda: compute(cache_key, args, kwargs)
+                    )
+                    cache_manager.coalescing.record_refresh(time.perf_counter() - started)
+                except Exception as e:
+                    cache_manager.coalescing.record_refresh(
+                        time.perf_counter() - started, success=False
+                    )
+                    logger.warning(f"Background refresh failed for {func.__name__}: {e}")
+                finally:
+                    cache_manager.refreshing.discard(cache_key)
+
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                # Generate cache key
+                cache_key = cache_manager._generate_key(prefix, *args, **kwargs)
+                if namespace:
+                    cache_key = await cache_manager.namespaced_key(namespace, cache_key)
+
+                # Try to get from cache
+                cached_result = await cache_manager.get(cache_key)
+                if cached_result is not None:
+                    value, fresh = _unwrap_stale(cached_result)
+                    if fresh:
+                        logger.debug(f"Cache hit for {func.__name__}")
+                        return value
+                    # Serve stale and refresh once in the background
+                    cache_manager.coalescing.stale_serves += 1
+                    if cache_key not in cache_manager.refreshing:
+                        cache_manager.refreshing.add(cache_key)
+                        cache_manager.schedule(refresh(cache_key, args, kwargs))
+                    return value
+
+                # Execute function once per key and cache result
+                result, shared = await cache_manager.flights.do(
+                    cache_key, lambda: compute(cache_key, args, kwargs)
+                )
+                if shared:
+                    cache_manager.coalescing.coalesced_waits += 1
+                else:
+                    logger.debug(f"Cache miss for {func.__name__}, cached result")
+
+                return result
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            # Generate cache key
             cache_key = cache_manager._generate_key(prefix, *args, **kwargs)
-            
-            # Try to get from cache
-            cached_result = cache_manager.get(cache_key)
+            if namespace:
+                if cache_manager.generation_is_stale(namespace):
+                    cache_manager.schedule(cache_manager.get_generation(namespace))
+                generation = cache_manager.generations.get(namespace, 0)
+                cache_key = f"{namespace}:g{generation}:{cache_key}"
+
+            cached_result = cache_manager.get_local(cache_key)
             if cached_result is not None:
                 logger.debug(f"Cache hit for {func.__name__}")
                 return cached_result
-            
-            # Execute function and cache result
+
             result = func(*args, **kwargs)
-            cache_manager.set(cache_key, result, ttl)
+            cache_manager.set_local(
+                cache_key, result, ttl, tags=_resolve_tags(prefix, tags, args, kwargs)
+            )
             logger.debug(f"Cache miss for {func.__name__}, cached result")
-            
+
             return result
         return wrapper
     return decorator
 
-def invalidate_cache(prefix: str):
-    """Decorator for invalidating cache after function execution"""
+def invalidate_cache(prefix: Optional[str] = None, tags: TagSpec = None,
+                     namespace: Optional[str] = None):
+    """Decorator for invalidating cache after function execution
+
+    Drops entries tagged with ``prefix`` or ``tags`` (a list or a callable
+    receiving the call arguments) and bumps ``namespace`` if given.
+    """
     def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                result = await func(*args, **kwargs)
+
+                # Invalidate cache entries by tag and namespace
+                resolved = _resolve_tags(prefix, tags, args, kwargs)
+                if resolved:
+                    await cache_manager.invalidate_tags(*resolved)
+                if namespace:
+                    await cache_manager.bump_generation(namespace)
+                logger.debug(f"Invalidated cache for tags {resolved} namespace {namespace}")
+
+                return result
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             result = func(*args, **kwargs)
-            
-            # Invalidate cache entries with matching prefix
-            cache_manager.clear(f"{prefix}*")
-            logger.debug(f"Invalidated cache for prefix: {prefix}")
-            
+
+            # The local tier is updated now; Redis in the background on the event loop
+            resolved = _resolve_tags(prefix, tags, args, kwargs)
+            if resolved:
+                cache_manager.invalidate_tags_local(*resolved)
+            if namespace:
+                cache_manager.bump_generation_local(namespace)
+            if cache_manager.redis_available:
+                if resolved:
+                    cache_manager.schedule(cache_manager.invalidate_tags(*resolved))
+                if namespace:
+                    cache_manager.schedule(cache_manager.bump_generation(namespace))
+            logger.debug(f"Invalidated cache for tags {resolved} namespace {namespace}")
+
             return result
         return wrapper
     return decorator
@@ -232,74 +933,104 @@ def invalidate_cache(prefix: str):
 # Cache keys for different data types
 class CacheKeys:
     """Predefined cache keys for different data types"""
-    
+
     @staticmethod
     def user_profile(user_id: str) -> str:
         return f"user:profile:{user_id}"
-    
+
     @staticmethod
     def client_data(client_id: str) -> str:
         return f"client:data:{client_id}"
-    
+
     @staticmethod
     def analytics_data(time_range: str) -> str:
         return f"analytics:{time_range}"
-    
+
     @staticmethod
     def communication_stats(date: str) -> str:
         return f"communication:stats:{date}"
-    
+
     @staticmethod
     def system_status() -> str:
         return "system:status"
-    
+
     @staticmethod
     def api_response(endpoint: str, params: str) -> str:
         return f"api:response:{endpoint}:{params}"
 
+# Cache tags for invalidation
+class CacheTags:
+    """Predefined invalidation tags"""
+
+    @staticmethod
+    def tenant(tenant_id: str) -> str:
+        return f"tenant:{tenant_id}"
+
+    @staticmethod
+    def user(user_id: str) -> str:
+        return f"user:{user_id}"
+
+    @staticmethod
+    def client(client_id: str) -> str:
+        return f"client:{client_id}"
+
+    @staticmethod
+    def resource(resource_type: str) -> str:
+        return f"resource:{resource_type}"
+
 # Utility functions for common caching operations
-def cache_user_profile(user_id: str, profile_data: Dict[str, Any], ttl: int = 1800):
+async def cache_user_profile(user_id: str, profile_data: Dict[str, Any], ttl: int = 1800):
     """Cache user profile data"""
     key = CacheKeys.user_profile(user_id)
-    return cache_manager.set(key, profile_data, ttl)
+    return await cache_manager.set(
+        key, profile_data, ttl,
+        tags=[CacheTags.user(user_id), CacheTags.resource("user_profile")]
+    )
 
-def get_cached_user_profile(user_id: str) -> Optional[Dict[str, Any]]:
+async def get_cached_user_profile(user_id: str) -> Optional[Dict[str, Any]]:
     """Get cached user profile data"""
     key = CacheKeys.user_profile(user_id)
-    return cache_manager.get(key)
+    return await cache_manager.get(key)
 
-def cache_client_data(client_id: str, client_data: Dict[str, Any], ttl: int = 3600):
+async def cache_client_data(client_id: str, client_data: Dict[str, Any], ttl: int = 3600):
     """Cache client data"""
     key = CacheKeys.client_data(client_id)
-    return cache_manager.set(key, client_data, ttl)
+    return await cache_manager.set(
+        key, client_data, ttl,
+        tags=[CacheTags.client(client_id), CacheTags.resource("client_data")]
+    )
 
-def get_cached_client_data(client_id: str) -> Optional[Dict[str, Any]]:
+async def get_cached_client_data(client_id: str) -> Optional[Dict[str, Any]]:
     """Get cached client data"""
     key = CacheKeys.client_data(client_id)
-    return cache_manager.get(key)
+    return await cache_manager.get(key)
 
-def cache_analytics_data(time_range: str, analytics_data: Dict[str, Any], ttl: int = 1800):
+async def cache_analytics_data(time_range: str, analytics_data: Dict[str, Any], ttl: int = 1800):
     """Cache analytics data"""
-    key = CacheKeys.analytics_data(time_range)
-    return cache_manager.set(key, analytics_data, ttl)
+    key = await cache_manager.namespaced_key("analytics", CacheKeys.analytics_data(time_range))
+    return await cache_manager.set(key, analytics_data, ttl, tags=[CacheTags.resource("analytics")])
 
-def get_cached_analytics_data(time_range: str) -> Optional[Dict[str, Any]]:
+async def get_cached_analytics_data(time_range: str) -> Optional[Dict[str, Any]]:
     """Get cached analytics data"""
-    key = CacheKeys.analytics_data(time_range)
-    return cache_manager.get(key)
+    key = await cache_manager.namespaced_key("analytics", CacheKeys.analytics_data(time_range))
+    return await cache_manager.get(key)
 
-def invalidate_user_cache(user_id: str):
+async def invalidate_user_cache(user_id: str):
     """Invalidate all cache entries for a user"""
-    cache_manager.clear(f"user:*{user_id}*")
+    await cache_manager.invalidate_tags(CacheTags.user(user_id))
 
-def invalidate_client_cache(client_id: str):
+async def invalidate_client_cache(client_id: str):
     """Invalidate all cache entries for a client"""
-    cache_manager.clear(f"client:*{client_id}*")
+    await cache_manager.invalidate_tags(CacheTags.client(client_id))
+
+async def invalidate_tenant_cache(tenant_id: str):
+    """Invalidate all cache entries for a tenant"""
+    await cache_manager.invalidate_tags(CacheTags.tenant(tenant_id))
 
-def invalidate_analytics_cache():
+async def invalidate_analytics_cache():
     """Invalidate all analytics cache entries"""
-    cache_manager.clear("analytics:*")
+    await cache_manager.bump_generation("analytics")
 
-def get_cache_stats() -> Dict[str, Any]:
+async def get_cache_stats() -> Dict[str, Any]:
     """Get cache statistics"""
-    return cache_manager.get_stats()
+    return await cache_manager.get_stats()
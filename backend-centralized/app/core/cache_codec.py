@@ -0,0 +1,251 @@
+"""
+Cache Serialization Codecs
+Pluggable binary encoding for cache values with optional compression
+
+Encoded payloads start with a two-byte header: a magic byte that can never
+begin a JSON document, followed by a version byte holding the codec id
+(low nibble) and compression id (high nibble). Readers pick the codec from
+the header, so the writer codec can be switched without flushing the cache.
+Payloads without the header are read as legacy JSON.
+
+Tagged entries are wrapped in an envelope: a second magic byte, the length
+of the newline-joined tag block (2 bytes, big-endian), the tags, then the
+normal payload. Readers use the tags to index copies kept in memory.
+"""
+
+import os
+import abc
+import json
+import zlib
+import struct
+import uuid
+import logging
+from datetime import datetime, date
+from decimal import Decimal
+from enum import Enum
+from typing import Any, Dict, Iterable, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import msgpack
+
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+try:
+    import orjson
+
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import lz4.frame
+
+    LZ4_AVAILABLE = True
+except ImportError:
+    LZ4_AVAILABLE = False
+
+# Codec configuration
+CACHE_CODEC = os.getenv("CACHE_CODEC", "msgpack")
+CACHE_COMPRESSION = os.getenv("CACHE_COMPRESSION", "zlib")
+CACHE_COMPRESS_THRESHOLD = int(os.getenv("CACHE_COMPRESS_THRESHOLD", "4096"))  # bytes
+
+HEADER_MAGIC = 0xC1  # Never valid as the first byte of UTF-8 JSON
+TAGS_MAGIC = 0xC0  # Tag envelope; likewise never valid UTF-8
+
+# Header ids; never renumber, only append
+CODEC_IDS = {"json": 1, "msgpack": 2, "orjson": 3}
+COMPRESSION_IDS = {"none": 0, "zlib": 1, "lz4": 2}
+
+# msgpack extension type codes
+_EXT_DATETIME = 1
+_EXT_DATE = 2
+_EXT_DECIMAL = 3
+_EXT_UUID = 4
+
+
+def _json_default(value: Any) -> Any:
+    """Best-effort JSON conversion for types the stdlib can't encode"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (Decimal, uuid.UUID)):
+        return str(value)
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+
+class Codec(abc.ABC):
+    """Base class for cache value codecs"""
+
+    name = ""
+
+    @abc.abstractmethod
+    def encode(self, value: Any) -> bytes:
+        """Serialize a value to bytes"""
+
+    @abc.abstractmethod
+    def decode(self, payload: bytes) -> Any:
+        """Deserialize bytes produced by encode"""
+
+
+class JSONCodec(Codec):
+    """Standard library JSON; datetime and Decimal come back as strings"""
+
+    name = "json"
+
+    def encode(self, value: Any) -> bytes:
+        return json.dumps(value, default=_json_default, separators=(",", ":")).encode()
+
+    def decode(self, payload: bytes) -> Any:
+        return json.loads(payload)
+
+
+class OrjsonCodec(Codec):
+    """orjson; fastest, but datetime and Decimal come back as strings"""
+
+    name = "orjson"
+
+    def encode(self, value: Any) -> bytes:
+        return orjson.dumps(value, default=_json_default, option=orjson.OPT_NON_STR_KEYS)
+
+    def decode(self, payload: bytes) -> Any:
+        return orjson.loads(payload)
+
+
+class MsgpackCodec(Codec):
+    """msgpack with extension types preserving datetime, date, Decimal and UUID"""
+
+    name = "msgpack"
+
+    @staticmethod
+    def _default(value: Any) -> Any:
+        if isinstance(value, datetime):
+            return msgpack.ExtType(_EXT_DATETIME, value.isoformat().encode())
+        if isinstance(value, date):
+            return msgpack.ExtType(_EXT_DATE, value.isoformat().encode())
+        if isinstance(value, Decimal):
+            return msgpack.ExtType(_EXT_DECIMAL, str(value).encode())
+        if isinstance(value, uuid.UUID):
+            return msgpack.ExtType(_EXT_UUID, value.bytes)
+        if isinstance(value, Enum):
+            return value.value
+        if isinstance(value, (set, frozenset)):
+            return list(value)
+        raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+    @staticmethod
+    def _ext_hook(code: int, data: bytes) -> Any:
+        if code == _EXT_DATETIME:
+            return datetime.fromisoformat(data.decode())
+        if code == _EXT_DATE:
+            return date.fromisoformat(data.decode())
+        if code == _EXT_DECIMAL:
+            return Decimal(data.decode())
+        if code == _EXT_UUID:
+            return uuid.UUID(bytes=data)
+        return msgpack.ExtType(code, data)
+
+    def encode(self, value: Any) -> bytes:
+        return msgpack.packb(value, default=self._default, use_bin_type=True)
+
+    def decode(self, payload: bytes) -> Any:
+        return msgpack.unpackb(
+            payload, ext_hook=self._ext_hook, raw=False, strict_map_key=False
+        )
+
+
+def available_codecs() -> Dict[str, Codec]:
+    """Codecs whose dependencies are installed"""
+    codecs: Dict[str, Codec] = {"json": JSONCodec()}
+    if MSGPACK_AVAILABLE:
+        codecs["msgpack"] = MsgpackCodec()
+    if ORJSON_AVAILABLE:
+        codecs["orjson"] = OrjsonCodec()
+    return codecs
+
+
+def available_compressions() -> Dict[str, Any]:
+    """Compression schemes whose dependencies are installed"""
+    compressions = {"none": None, "zlib": zlib}
+    if LZ4_AVAILABLE:
+        compressions["lz4"] = lz4.frame
+    return compressions
+
+
+class CacheSerializer:
+    """Encodes cache values with a versioned header and optional compression"""
+
+    def __init__(self, codec: str = CACHE_CODEC, compression: str = CACHE_COMPRESSION,
+                 compress_threshold: int = CACHE_COMPRESS_THRESHOLD):
+        self.codecs = available_codecs()
+        self.compressions = available_compressions()
+
+        if codec not in self.codecs:
+            logger.warning(f"Cache codec '{codec}' not available, falling back to json")
+            codec = "json"
+        if compression not in self.compressions:
+            logger.warning(f"Cache compression '{compression}' not available, falling back to zlib")
+            compression = "zlib"
+
+        self.codec = self.codecs[codec]
+        self.compression = compression
+        self.compress_threshold = compress_threshold
+        self._codecs_by_id = {CODEC_IDS[name]: c for name, c in self.codecs.items()}
+        self._compressions_by_id = {
+            COMPRESSION_IDS[name]: module for name, module in self.compressions.items()
+        }
+
+    def dumps(self, value: Any, tags: Iterable[str] = ()) -> bytes:
+        """Encode a value (and its tags) into a self-describing payload"""
+        body = self.codec.encode(value)
+        compression = "none"
+        if self.compression != "none" and len(body) >= self.compress_threshold:
+            compressed = self.compressions[self.compression].compress(body)
+            if len(compressed) < len(body):
+                body = compressed
+                compression = self.compression
+
+        version = (COMPRESSION_IDS[compression] << 4) | CODEC_IDS[self.codec.name]
+        payload = bytes((HEADER_MAGIC, version)) + body
+        tags = tuple(tags)
+        if tags:
+            block = "\n".join(tags).encode()
+            payload = bytes((TAGS_MAGIC,)) + struct.pack(">H", len(block)) + block + payload
+        return payload
+
+    def loads_tagged(self, payload: bytes) -> Tuple[Any, Tuple[str, ...]]:
+        """Decode a payload and the tags it was written with"""
+        if payload and payload[0] == TAGS_MAGIC:
+            (length,) = struct.unpack_from(">H", payload, 1)
+            tags = tuple(payload[3:3 + length].decode().split("\n"))
+            return self.loads(payload[3 + length:]), tags
+        return self.loads(payload), ()
+
+    def loads(self, payload: bytes) -> Any:
+        """Decode a payload written by any known codec version"""
+        if payload and payload[0] == TAGS_MAGIC:
+            return self.loads_tagged(payload)[0]
+        if not payload or payload[0] != HEADER_MAGIC:
+            # Written before the codec header existed
+            return json.loads(payload)
+
+        version = payload[1]
+        codec = self._codecs_by_id.get(version & 0x0F)
+        if codec is None:
+            raise ValueError(f"Unknown cache codec id {version & 0x0F}")
+
+        body = payload[2:]
+        compression_id = version >> 4
+        if compression_id:
+            module = self._compressions_by_id.get(compression_id)
+            if module is None:
+                raise ValueError(f"Unknown cache compression id {compression_id}")
+            body = module.decompress(body)
+
+        return codec.decode(body)
@@ -0,0 +1,323 @@
+"""
+Realtime Event Bus
+Cross-worker fan-out for the pub/sub hub over a pluggable broker
+
+Each worker holds its own sockets, so a publish is delivered to local
+subscribers immediately and also handed to the bus, which ships it once
+to the broker. Every other worker receives it and fans it out to its own
+subscribers through the same topic index; a worker ignores its own
+envelopes. Only the encoded payload travels, never re-serialized per
+recipient.
+
+Small messages are batched: envelopes are buffered for up to
+REALTIME_BATCH_DELAY_MS, or until REALTIME_BATCH_MAX envelopes /
+REALTIME_BATCH_BYTES bytes, and sent as one broker message.
+
+REALTIME_BROKER selects the backend:
+  local          - in-process only (single worker, tests)
+  redis          - Redis PUBLISH/SUBSCRIBE on REALTIME_BROKER_CHANNEL
+  redis-streams  - Redis XADD/XREAD; a reader resumes from its last id
+                   after a reconnect, so short outages lose nothing
+If Redis is requested but the client library is missing, the bus falls
+back to the local broker with a warning.
+"""
+
+import os
+import abc
+import uuid
+import socket
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+try:
+    import orjson
+
+    ORJSON_AVAILABLE = True
+except ImportError:
+    import json
+
+    ORJSON_AVAILABLE = False
+
+try:
+    import redis.asyncio as aioredis
+
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+from app.core.pubsub import PubSubHub, Topics, hub
+
+logger = logging.getLogger(__name__)
+
+REALTIME_BROKER = os.getenv("REALTIME_BROKER", "local")  # local | redis | redis-streams
+REALTIME_BROKER_URL = os.getenv("REALTIME_BROKER_URL", os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+REALTIME_BROKER_CHANNEL = os.getenv("REALTIME_BROKER_CHANNEL", "healthguard:realtime")
+REALTIME_STREAM_MAXLEN = int(os.getenv("REALTIME_STREAM_MAXLEN", "10000"))
+REALTIME_BATCH_MAX = int(os.getenv("REALTIME_BATCH_MAX", "64"))
+REALTIME_BATCH_BYTES = int(os.getenv("REALTIME_BATCH_BYTES", str(64 * 1024)))
+REALTIME_BATCH_DELAY_MS = float(os.getenv("REALTIME_BATCH_DELAY_MS", "2"))
+REALTIME_RECONNECT_SECONDS = float(os.getenv("REALTIME_RECONNECT_SECONDS", "2"))
+
+BatchHandler = Callable[[bytes], None]
+
+
+def _dumps(value: Any) -> bytes:
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+def _loads(data: bytes) -> Any:
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class Broker(abc.ABC):
+    """Transport for encoded envelope batches between workers"""
+
+    name = "base"
+
+    @abc.abstractmethod
+    async def start(self, handler: BatchHandler):
+        """Connect and call `handler` with every batch received"""
+
+    @abc.abstractmethod
+    async def publish(self, data: bytes):
+        """Send one encoded batch to every worker"""
+
+    async def stop(self):
+        pass
+
+
+class LocalBroker(Broker):
+    """In-process broker; brokers sharing a `network` list behave like separate workers"""
+
+    name = "local"
+
+    def __init__(self, network: Optional[List["LocalBroker"]] = None):
+        self.network = network if network is not None else []
+        self.handler: Optional[BatchHandler] = None
+
+    async def start(self, handler: BatchHandler):
+        self.handler = handler
+        if self not in self.network:
+            self.network.append(self)
+
+    async def publish(self, data: bytes):
+        loop = asyncio.get_running_loop()
+        for broker in list(self.network):
+            if broker.handler is not None:
+                loop.call_soon(broker.handler, data)
+
+    async def stop(self):
+        if self in self.network:
+            self.network.remove(self)
+        self.handler = None
+
+
+class _RedisBroker(Broker):
+    """Shared connection handling and the reconnecting reader task"""
+
+    def __init__(self, url: str = REALTIME_BROKER_URL, channel: str = REALTIME_BROKER_CHANNEL):
+        self.url = url
+        self.channel = channel
+        self.client = None
+        self.handler: Optional[BatchHandler] = None
+        self._reader: Optional[asyncio.Task] = None
+
+    async def start(self, handler: BatchHandler):
+        self.handler = handler
+        self.client = aioredis.from_url(self.url)
+        self._reader = asyncio.get_running_loop().create_task(self._run_reader())
+
+    async def _run_reader(self):
+        while True:
+            try:
+                await self._read()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Realtime broker {self.name} read failed, retrying in "
+                               f"{REALTIME_RECONNECT_SECONDS:.0f}s: {e}")
+                await asyncio.sleep(REALTIME_RECONNECT_SECONDS)
+
+    @abc.abstractmethod
+    async def _read(self):
+        """Deliver incoming batches to the handler until the connection fails"""
+
+    async def stop(self):
+        reader, self._reader = self._reader, None
+        if reader is not None:
+            reader.cancel()
+            try:
+                await reader
+            except asyncio.CancelledError:
+                pass
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+
+class RedisPubSubBroker(_RedisBroker):
+    """Redis PUBLISH/SUBSCRIBE: lowest latency, at-most-once across reconnects"""
+
+    name = "redis"
+
+    async def publish(self, data: bytes):
+        await self.client.publish(self.channel, data)
+
+    async def _read(self):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(self.channel)
+            async for message in pubsub.listen():
+                if message.get("type") == "message":
+                    self.handler(message["data"])
+        finally:
+            await pubsub.aclose()
+
+
+class RedisStreamsBroker(_RedisBroker):
+    """Redis streams: capped log, readers resume from their last id after a reconnect"""
+
+    name = "redis-streams"
+
+    def __init__(self, url: str = REALTIME_BROKER_URL, channel: str = REALTIME_BROKER_CHANNEL,
+                 maxlen: int = REALTIME_STREAM_MAXLEN):
+        super().__init__(url, channel)
+        self.maxlen = maxlen
+        self.last_id = "$"
+
+    async def publish(self, data: bytes):
+        await self.client.xadd(self.channel, {"d": data}, maxlen=self.maxlen, approximate=True)
+
+    async def _read(self):
+        while True:
+            streams = await self.client.xread({self.channel: self.last_id}, count=100, block=5000)
+            for _, entries in streams or ():
+                for entry_id, fields in entries:
+                    self.last_id = entry_id
+                    data = fields.get(b"d")
+                    if data is not None:
+                        self.handler(data)
+
+
+def create_broker(kind: str = REALTIME_BROKER) -> Broker:
+    """Broker for REALTIME_BROKER, falling back to in-process"""
+    if kind in ("redis", "redis-streams"):
+        if REDIS_AVAILABLE:
+            return RedisStreamsBroker() if kind == "redis-streams" else RedisPubSubBroker()
+        logger.warning(f"REALTIME_BROKER={kind} but redis is not installed; realtime events stay in-process")
+    elif kind != "local":
+        logger.warning(f"Unknown REALTIME_BROKER '{kind}'; using the local broker")
+    return LocalBroker()
+
+
+class EventBus:
+    """Batches this worker's publishes onto a broker and fans remote ones out locally"""
+
+    def __init__(self, broker: Optional[Broker] = None, pubsub: Optional[PubSubHub] = None,
+                 batch_max: int = REALTIME_BATCH_MAX, batch_bytes: int = REALTIME_BATCH_BYTES,
+                 batch_delay_ms: float = REALTIME_BATCH_DELAY_MS):
+        self.broker = broker
+        self.hub = pubsub or hub
+        self.batch_max = batch_max
+        self.batch_bytes = batch_bytes
+        self.batch_delay = batch_delay_ms / 1000
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._buffer: List[Dict[str, Any]] = []
+        self._buffer_bytes = 0
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._pending: set = set()
+        self.running = False
+        self.sent = 0
+        self.batches = 0
+        self.received = 0
+        self.errors = 0
+
+    async def start(self):
+        """Connect the broker and route hub publishes through this bus"""
+        if self.running:
+            return
+        self.broker = self.broker or create_broker()
+        await self.broker.start(self._on_batch)
+        self.hub.bus = self
+        self.running = True
+        logger.info(f"Realtime event bus started on the {self.broker.name} broker as {self.worker_id}")
+
+    async def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        if self.hub.bus is self:
+            self.hub.bus = None
+        await self.flush()
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        await self.broker.stop()
+
+    def publish(self, topics: Topics, payload: str, coalesce_key: Optional[str] = None):
+        """Buffer an encoded message for the other workers"""
+        envelope = {"o": self.worker_id, "t": [topics] if isinstance(topics, str) else list(topics), "p": payload}
+        if coalesce_key is not None:
+            envelope["k"] = coalesce_key
+        self._buffer.append(envelope)
+        self._buffer_bytes += len(payload)
+        if len(self._buffer) >= self.batch_max or self._buffer_bytes >= self.batch_bytes:
+            self._schedule(self.flush())
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                self.batch_delay, lambda: self._schedule(self.flush())
+            )
+
+    def _schedule(self, coro: Awaitable):
+        task = asyncio.ensure_future(coro)
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def flush(self):
+        """Send everything buffered as one broker message"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._buffer:
+            return
+        batch, self._buffer, self._buffer_bytes = self._buffer, [], 0
+        try:
+            await self.broker.publish(_dumps(batch))
+            self.sent += len(batch)
+            self.batches += 1
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Failed to publish {len(batch)} realtime events to the {self.broker.name} broker: {e}")
+
+    def _on_batch(self, data: bytes):
+        try:
+            batch = _loads(data)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Dropping undecodable realtime batch: {e}")
+            return
+        for envelope in batch:
+            if envelope.get("o") == self.worker_id:
+                continue
+            self.received += 1
+            self.hub.deliver(envelope["t"], envelope["p"], envelope.get("k"))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "broker": self.broker.name if self.broker else None,
+            "worker_id": self.worker_id,
+            "running": self.running,
+            "sent": self.sent,
+            "batches": self.batches,
+            "received": self.received,
+            "errors": self.errors,
+            "buffered": len(self._buffer),
+        }
+
+
+# Global realtime event bus
+event_bus = EventBus()
@@ -0,0 +1,185 @@
+"""
+Event History
+Fixed-capacity ring buffer with monotonically increasing sequence numbers
+
+Appending overwrites the oldest slot in O(1). Every item gets the next
+sequence number, so a reconnecting client that remembers the last seq it
+saw can ask for `since(seq)` and receive only what it missed. The result is
+flagged as truncated when the ring has already wrapped past that point, or
+when the seq is newer than anything held, which happens if this history was
+reset or the seq came from another ring. Each ring also has a random `epoch`
+that clients send back with their seq, so a seq from another worker or from
+before a reset is recognised even when the numbers happen to line up.
+
+Optionally the ring is persisted to a JSON-lines file: `start()` reloads
+the tail (keeping its epoch and sequence numbers, so resume works across
+restarts) and then snapshots it every REALTIME_HISTORY_FLUSH_INTERVAL
+seconds off the event loop; `stop()` writes a final snapshot. The file
+belongs to one worker; give each worker its own REALTIME_HISTORY_FILE.
+"""
+
+import os
+import json
+import uuid
+import asyncio
+import logging
+from typing import Any, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+REALTIME_HISTORY_SIZE = int(os.getenv("REALTIME_HISTORY_SIZE", "1000"))
+REALTIME_HISTORY_FILE = os.getenv("REALTIME_HISTORY_FILE", "")
+REALTIME_HISTORY_FLUSH_INTERVAL = float(os.getenv("REALTIME_HISTORY_FLUSH_INTERVAL", "30"))  # seconds
+
+
+class EventRing:
+    """Bounded history addressed by sequence number (first item is seq 1)"""
+
+    def __init__(self, capacity: int = REALTIME_HISTORY_SIZE, path: str = "",
+                 flush_interval: float = REALTIME_HISTORY_FLUSH_INTERVAL):
+        if capacity <= 0:
+            raise ValueError("EventRing capacity must be positive")
+        self.capacity = capacity
+        self.path = path
+        self.flush_interval = flush_interval
+        self._slots: List[Any] = [None] * capacity
+        self.epoch = uuid.uuid4().hex[:12]
+        self.next_seq = 1
+        self._saved_seq = 0
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @property
+    def last_seq(self) -> int:
+        """Sequence number of the newest item (0 when empty)"""
+        return self.next_seq - 1
+
+    @property
+    def first_seq(self) -> int:
+        """Sequence number of the oldest item still held"""
+        return max(1, self.next_seq - self.capacity)
+
+    def __len__(self) -> int:
+        return min(self.next_seq - 1, self.capacity)
+
+    def append(self, item: Any) -> int:
+        seq = self.next_seq
+        self._slots[seq % self.capacity] = item
+        self.next_seq = seq + 1
+        return seq
+
+    def get(self, seq: int) -> Any:
+        if not self.first_seq <= seq <= self.last_seq:
+            raise KeyError(seq)
+        return self._slots[seq % self.capacity]
+
+    def entries(self, since: int = 0, limit: Optional[int] = None,
+                epoch: Optional[str] = None) -> Tuple[List[Tuple[int, Any]], bool]:
+        """(seq, item) pairs with seq > since, oldest first, and whether some may have been missed
+
+        A `since` beyond the newest item, or an `epoch` other than this
+        ring's, means the client's position is not from this history: all
+        held items are returned and flagged as truncated. With a limit, the
+        *oldest* `limit` items are returned so a client can page forward by
+        passing the last seq it received.
+        """
+        if since > self.last_seq or (epoch is not None and epoch != self.epoch):
+            since, reset = 0, since > 0
+        else:
+            reset = False
+        start = max(since + 1, self.first_seq)
+        truncated = reset or (since + 1 < self.first_seq and self.last_seq > 0)
+        end = self.last_seq if limit is None else min(self.last_seq, start + limit - 1)
+        slots, capacity = self._slots, self.capacity
+        return [(seq, slots[seq % capacity]) for seq in range(start, end + 1)], truncated
+
+    def since(self, seq: int, limit: Optional[int] = None) -> List[Any]:
+        return [item for _, item in self.entries(seq, limit)[0]]
+
+    def latest(self, n: int) -> List[Any]:
+        """The newest n items, oldest first"""
+        return self.since(max(0, self.last_seq - max(n, 0)))
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.since(0))
+
+    # --- Persistence -----------------------------------------------------------------
+
+    def save(self, entries: Optional[List[Tuple[int, Any]]] = None):
+        """Write the tail to `path` atomically (blocking)"""
+        if not self.path:
+            return
+        entries = self.entries(0)[0] if entries is None else entries
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"epoch": self.epoch}))
+            f.write("\n")
+            for seq, item in entries:
+                f.write(json.dumps([seq, item], default=str))
+                f.write("\n")
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> int:
+        """Restore a saved tail and continue its epoch and sequence; returns items loaded"""
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        loaded = 0
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if isinstance(record, dict):
+                        if self.next_seq == 1:
+                            self.epoch = record.get("epoch", self.epoch)
+                        continue
+                    seq, item = record
+                    if seq >= self.next_seq:
+                        self._slots[seq % self.capacity] = item
+                        self.next_seq = seq + 1
+                        loaded += 1
+        except Exception as e:
+            logger.error(f"Failed to load event history from {self.path}: {e}")
+        self._saved_seq = self.last_seq
+        return loaded
+
+    async def flush(self):
+        """Snapshot on the loop, write in a worker thread; skipped when nothing changed"""
+        if not self.path or self.last_seq == self._saved_seq:
+            return
+        entries = self.entries(0)[0]
+        await asyncio.get_running_loop().run_in_executor(None, self.save, entries)
+        self._saved_seq = entries[-1][0] if entries else 0
+
+    async def _run_flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error persisting event history: {e}")
+
+    async def start(self):
+        """Reload the persisted tail and keep saving it (no-op without a path)"""
+        if not self.path:
+            return
+        loaded = await asyncio.get_running_loop().run_in_executor(None, self.load)
+        logger.info(f"Loaded {loaded} realtime events from {self.path} (last seq {self.last_seq})")
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._run_flusher())
+
+    async def stop(self):
+        task, self._flush_task = self._flush_task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self.path:
+            await self.flush()
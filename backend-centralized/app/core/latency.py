@@ -0,0 +1,350 @@
+"""
+Streaming Latency Sketches
+Mergeable log-linear histograms with rolling time windows
+
+LatencySketch buckets latencies HDR-style: values are kept in microseconds
+with 5 significant bits, so every bucket spans at most ~3% of its value and
+a sketch covering 1µs..1h never has more than ~470 buckets. Buckets are
+stored sparsely, recording is O(1) and sketches merge by adding counts.
+
+RollingLatency keeps one ring of sketches per window (1m, 5m, 1h by
+default), so a window query merges at most a dozen sketches.
+
+LatencyHistogram is the cheaper fixed-bucket variant used for cache and
+connection pool timings.
+"""
+
+import os
+import time
+import bisect
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+SUB_BUCKET_BITS = 5
+_SUB_BUCKET_HALF = 1 << (SUB_BUCKET_BITS - 1)
+_LINEAR_LIMIT = 1 << SUB_BUCKET_BITS
+
+# (window seconds, slots); each window rotates in slot-sized steps
+LATENCY_WINDOWS: Tuple[Tuple[int, int], ...] = ((60, 6), (300, 10), (3600, 12))
+LATENCY_MAX_SERIES = int(os.getenv("LATENCY_MAX_SERIES", "500"))
+LATENCY_MAX_TENANTS = int(os.getenv("LATENCY_MAX_TENANTS", "200"))
+OVERFLOW_ROUTE = "__other__"
+
+DEFAULT_QUANTILES = (0.5, 0.9, 0.95, 0.99, 0.999)
+
+
+def bucket_index(micros: int) -> int:
+    """Log-linear bucket index for a non-negative integer value"""
+    if micros < _LINEAR_LIMIT:
+        return micros
+    shift = micros.bit_length() - SUB_BUCKET_BITS
+    return shift * _SUB_BUCKET_HALF + (micros >> shift)
+
+
+def bucket_bounds(index: int) -> Tuple[int, int]:
+    """Inclusive [lower, upper] value range of a bucket"""
+    if index < _LINEAR_LIMIT:
+        return index, index
+    shift = index // _SUB_BUCKET_HALF - 1
+    mantissa = index - shift * _SUB_BUCKET_HALF
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+def cumulative_buckets(counts: Iterable[Tuple[int, int]],
+                       bounds: Iterable[float]) -> List[Tuple[float, int]]:
+    """Fold (bucket index, count) pairs into cumulative counts at fixed upper bounds (seconds)"""
+    bounds = sorted(bounds)
+    cumulative = [0] * len(bounds)
+    for index, n in counts:
+        lower, upper = bucket_bounds(index)
+        value = (lower + upper) / 2 / 1_000_000
+        position = bisect.bisect_left(bounds, value)
+        if position < len(bounds):
+            cumulative[position] += n
+    running = 0
+    result = []
+    for bound, n in zip(bounds, cumulative):
+        running += n
+        result.append((bound, running))
+    return result
+
+
+def status_class(status_code: int) -> str:
+    """Collapse a status code into 2xx/3xx/4xx/5xx"""
+    return f"{status_code // 100}xx"
+
+
+# Latency histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram; recording is a bisect and an increment"""
+
+    __slots__ = ("counts", "count", "total")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q: float) -> float:
+        """Approximate quantile as the upper bound of the matching bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return LATENCY_BUCKETS[min(index, len(LATENCY_BUCKETS) - 1)]
+        return LATENCY_BUCKETS[-1]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            'p50_ms': round(self.quantile(0.50) * 1000, 3),
+            'p95_ms': round(self.quantile(0.95) * 1000, 3),
+            'p99_ms': round(self.quantile(0.99) * 1000, 3),
+            'buckets': {
+                **{f"le_{bound}": n for bound, n in zip(LATENCY_BUCKETS, self.counts)},
+                'le_inf': self.counts[-1],
+            },
+        }
+
+
+class LatencySketch:
+    """Sparse log-linear latency histogram; record O(1), quantile O(buckets)"""
+
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        self.add(bucket_index(int(seconds * 1_000_000)) if seconds > 0 else 0, seconds)
+
+    def add(self, index: int, seconds: float):
+        """Record a value whose bucket index is already known"""
+        counts = self.counts
+        counts[index] = counts.get(index, 0) + 1
+        if not self.count or seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.count += 1
+        self.total += seconds
+
+    def merge(self, other: "LatencySketch") -> "LatencySketch":
+        """Add another sketch's counts into this one"""
+        if not other.count:
+            return self
+        counts = self.counts
+        for index, n in other.counts.items():
+            counts[index] = counts.get(index, 0) + n
+        if not self.count or other.min < self.min:
+            self.min = other.min
+        if other.max > self.max:
+            self.max = other.max
+        self.count += other.count
+        self.total += other.total
+        return self
+
+    @classmethod
+    def merged(cls, sketches: Iterable["LatencySketch"]) -> "LatencySketch":
+        result = cls()
+        for sketch in sketches:
+            result.merge(sketch)
+        return result
+
+    def quantiles(self, qs: Iterable[float] = DEFAULT_QUANTILES) -> Dict[float, float]:
+        """Several quantiles (seconds) in one pass over the sorted buckets"""
+        wanted = sorted(qs)
+        result = {q: 0.0 for q in wanted}
+        if not self.count:
+            return result
+
+        seen = 0
+        pending = list(wanted)
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            while pending and seen >= pending[0] * self.count:
+                lower, upper = bucket_bounds(index)
+                value = (lower + upper) / 2 / 1_000_000
+                result[pending.pop(0)] = min(max(value, self.min), self.max)
+            if not pending:
+                break
+        for q in pending:
+            result[q] = self.max
+        return result
+
+    def quantile(self, q: float) -> float:
+        return self.quantiles((q,))[q]
+
+    def cumulative_buckets(self, bounds: Iterable[float]) -> List[Tuple[float, int]]:
+        """Cumulative counts at fixed upper bounds (seconds), Prometheus-style"""
+        return cumulative_buckets(self.counts.items(), bounds)
+
+    def to_state(self) -> Dict[str, Any]:
+        """Compact JSON-safe form for persistence"""
+        return {'c': [[index, n] for index, n in self.counts.items()], 'n': self.count,
+                's': self.total, 'lo': self.min, 'hi': self.max}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "LatencySketch":
+        sketch = cls()
+        sketch.counts = {int(index): int(n) for index, n in state.get('c', [])}
+        sketch.count = state.get('n', 0)
+        sketch.total = state.get('s', 0.0)
+        sketch.min = state.get('lo', 0.0)
+        sketch.max = state.get('hi', 0.0)
+        return sketch
+
+    def to_dict(self, qs: Iterable[float] = DEFAULT_QUANTILES) -> Dict[str, Any]:
+        summary: Dict[str, Any] = {
+            'count': self.count,
+            'avg_ms': round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            'min_ms': round(self.min * 1000, 3),
+            'max_ms': round(self.max * 1000, 3),
+        }
+        for q, value in self.quantiles(qs).items():
+            summary[f"p{q * 100:g}_ms"] = round(value * 1000, 3)
+        return summary
+
+
+class _WindowRing:
+    """Fixed ring of per-slot sketches covering one rolling window"""
+
+    __slots__ = ("window", "slot_width", "slot_ids", "sketches")
+
+    def __init__(self, window: int, slots: int):
+        self.window = window
+        self.slot_width = window / slots
+        self.slot_ids: List[int] = [-1] * slots
+        self.sketches: List[Optional[LatencySketch]] = [None] * slots
+
+    def record(self, index: int, seconds: float, now: float):
+        slot_id = int(now // self.slot_width)
+        position = slot_id % len(self.slot_ids)
+        sketch = self.sketches[position]
+        if self.slot_ids[position] != slot_id or sketch is None:
+            sketch = LatencySketch()
+            self.sketches[position] = sketch
+            self.slot_ids[position] = slot_id
+        sketch.add(index, seconds)
+
+    def snapshot(self, now: float) -> LatencySketch:
+        oldest = int(now // self.slot_width) - len(self.slot_ids)
+        return LatencySketch.merged(
+            sketch for slot_id, sketch in zip(self.slot_ids, self.sketches)
+            if sketch is not None and slot_id > oldest
+        )
+
+
+class RollingLatency:
+    """Latency sketch over several rolling time windows plus a since-start total"""
+
+    __slots__ = ("rings", "cumulative")
+
+    def __init__(self, windows: Tuple[Tuple[int, int], ...] = LATENCY_WINDOWS):
+        self.rings = {window: _WindowRing(window, slots) for window, slots in windows}
+        self.cumulative = LatencySketch()
+
+    def record(self, seconds: float, now: Optional[float] = None, index: Optional[int] = None):
+        now = time.time() if now is None else now
+        if index is None:
+            index = bucket_index(int(seconds * 1_000_000)) if seconds > 0 else 0
+        for ring in self.rings.values():
+            ring.record(index, seconds, now)
+        self.cumulative.add(index, seconds)
+
+    def window(self, window: int, now: Optional[float] = None) -> LatencySketch:
+        """Merged sketch for the given window length in seconds"""
+        now = time.time() if now is None else now
+        return self.rings[window].snapshot(now)
+
+
+class RouteLatencyRecorder:
+    """Rolling latency per (method, route, status class) and per (tenant, status class)"""
+
+    def __init__(self, windows: Tuple[Tuple[int, int], ...] = LATENCY_WINDOWS,
+                 max_series: int = LATENCY_MAX_SERIES,
+                 max_tenants: int = LATENCY_MAX_TENANTS):
+        self.windows = windows
+        self.max_series = max_series
+        self.max_tenants = max_tenants
+        self.overall = RollingLatency(windows)
+        self.series: Dict[Tuple[str, str, str], RollingLatency] = {}
+        self.tenants: Dict[Tuple[str, str], RollingLatency] = {}
+        self.lock = threading.Lock()
+
+    @property
+    def window_lengths(self) -> List[int]:
+        return [window for window, _ in self.windows]
+
+    def _series(self, table: Dict[tuple, RollingLatency], key: tuple, limit: int) -> RollingLatency:
+        series = table.get(key)
+        if series is None:
+            with self.lock:
+                if len(table) >= limit and key not in table:
+                    # Bound cardinality; new labels beyond the limit share one series
+                    key = (OVERFLOW_ROUTE,) * (len(key) - 1) + key[-1:]
+                series = table.get(key)
+                if series is None:
+                    series = table[key] = RollingLatency(self.windows)
+        return series
+
+    def record(self, route: str, status_code: int, seconds: float, now: Optional[float] = None,
+               method: str = "*", tenant: Optional[str] = None):
+        now = time.time() if now is None else now
+        klass = status_class(status_code)
+        index = bucket_index(int(seconds * 1_000_000)) if seconds > 0 else 0
+        self._series(self.series, (method, route, klass), self.max_series).record(seconds, now, index)
+        if tenant is not None:
+            self._series(self.tenants, (tenant, klass), self.max_tenants).record(seconds, now, index)
+        self.overall.record(seconds, now, index)
+
+    def window(self, window: int, now: Optional[float] = None) -> LatencySketch:
+        """All-routes sketch for one window"""
+        return self.overall.window(window, now)
+
+    def by_status_class(self, window: int, now: Optional[float] = None) -> Dict[str, LatencySketch]:
+        now = time.time() if now is None else now
+        classes: Dict[str, LatencySketch] = {}
+        for (_, _, klass), series in list(self.series.items()):
+            classes.setdefault(klass, LatencySketch()).merge(series.window(window, now))
+        return classes
+
+    def summary(self, window: int, now: Optional[float] = None) -> Dict[str, Any]:
+        """Quantiles per route, per tenant and per status class for one window"""
+        now = time.time() if now is None else now
+        routes: Dict[str, Dict[str, Any]] = {}
+        for (method, route, klass), series in sorted(list(self.series.items())):
+            sketch = series.window(window, now)
+            if sketch.count:
+                label = route if method == "*" else f"{method} {route}"
+                routes.setdefault(label, {})[klass] = sketch.to_dict()
+        tenants: Dict[str, Dict[str, Any]] = {}
+        for (tenant, klass), series in sorted(list(self.tenants.items())):
+            sketch = series.window(window, now)
+            if sketch.count:
+                tenants.setdefault(tenant, {})[klass] = sketch.to_dict()
+        return {
+            'window_seconds': window,
+            'overall': self.overall.window(window, now).to_dict(),
+            'routes': routes,
+            'tenants': tenants,
+        }
@@ -1,42 +1,296 @@
 """
 Logging configuration for the application
+
+setup_logging() routes every record through a bounded queue: callers
+build a LogRecord and enqueue it, while a QueueListener thread formats
+(JSON lines by default, via orjson when installed) and writes to stdout and
+an optional size- or time-rotated file, flushing once per batch. Before
+enqueueing, the caller renders the %-style message and snapshots dict/list
+extras such as the log_* helpers' fields, so a record shows the values at
+call time and no __repr__ runs on the listener thread.
+
+High-volume categories (api, websocket) are sampled below WARNING according
+to LOG_SAMPLE_RATES, e.g. "api:0.1,websocket:0.05". Nothing is configured
+at import; the application calls setup_logging() once at startup.
 """
 
-import logging
+import os
 import sys
-from datetime import datetime
-from typing import Optional
-
-# Configure logging
-def setup_logging(level: str = "INFO", log_file: Optional[str] = None):
-    """Setup logging configuration"""
-    
-    # Create formatter
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from app.core.tracing import current_span
+
+try:
+    import orjson
+
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json | text
+LOG_FILE = os.getenv("LOG_FILE", "")
+LOG_ROTATION = os.getenv("LOG_ROTATION", "size")  # size | time
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "10"))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "midnight")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "256"))
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "api:0.1,websocket:0.1")
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+TEXT_DATEFMT = '%Y-%m-%d %H:%M:%S'
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+def _parse_sample_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for item in spec.split(","):
+        name, _, rate = item.partition(":")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+def _dumps(payload: Dict[str, Any]) -> str:
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(payload, default=str).decode()
+    return json.dumps(payload, default=str)
+
+
+def _snapshot(value: Any) -> Any:
+    """JSON-safe deep copy, so later mutation by the caller doesn't show up in the log"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(orjson.dumps(value, default=str))
+    return json.loads(json.dumps(value, default=str))
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the record's structured fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exc"] = record.exc_text
+        if record.stack_info:
+            payload["stack"] = self.formatStack(record.stack_info)
+        return _dumps(payload)
+
+
+class TextFormatter(logging.Formatter):
+    """The classic text format, with structured fields appended"""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT, datefmt=TEXT_DATEFMT)
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = getattr(record, "fields", None)
+        return f"{text} {_dumps(fields)}" if fields else text
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of records below WARNING; helpers that already sampled pass through"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or getattr(record, "sampled", False):
+            return True
+        return self.rate >= 1.0 or random.random() < self.rate
+
+
+class ContextFilter(logging.Filter):
+    """Tag records with the current trace and tenant while still on the caller's context"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        span = current_span()
+        if span is not None:
+            record.trace_id = span.trace.trace_id
+            tenant = span.trace.tenant
+            if tenant is not None:
+                record.tenant_id = tenant
+        return True
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue call-time snapshots of records and drop (counting) when the queue is full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Render the message and copy mutable extras now; the listener only encodes and writes
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and isinstance(value, (dict, list)):
+                record.__dict__[key] = _snapshot(value)
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _BatchFlushMixin:
+    """Skip per-record flushes while the listener is writing a batch"""
+
+    batching = False
+
+    def flush(self):
+        if not self.batching:
+            super().flush()
+
+
+class BatchStreamHandler(_BatchFlushMixin, logging.StreamHandler):
+    pass
+
+
+class BatchRotatingFileHandler(_BatchFlushMixin, logging.handlers.RotatingFileHandler):
+    pass
+
+
+class BatchTimedRotatingFileHandler(_BatchFlushMixin, logging.handlers.TimedRotatingFileHandler):
+    pass
+
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """Drains up to batch_size records per wakeup and flushes handlers once per batch"""
+
+    def __init__(self, log_queue: queue.Queue, *handlers, batch_size: int = LOG_BATCH_SIZE):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+
+    def _monitor(self):
+        q = self.queue
+        while True:
+            record = q.get()
+            if record is self._sentinel:
+                break
+            batch = [record]
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    record = q.get_nowait()
+                except queue.Empty:
+                    break
+                if record is self._sentinel:
+                    stop = True
+                    break
+                batch.append(record)
+
+            for handler in self.handlers:
+                handler.batching = True
+            try:
+                for record in batch:
+                    self.handle(record)
+            finally:
+                for handler in self.handlers:
+                    handler.batching = False
+                    handler.flush()
+            if stop:
+                break
+
+
+_listener: Optional[BatchingQueueListener] = None
+_queue_handler: Optional[LazyQueueHandler] = None
+_sample_rates: Dict[str, float] = {}
+
+
+def _file_handler(log_file: str, rotation: str) -> logging.Handler:
+    directory = os.path.dirname(log_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if rotation == "time":
+        return BatchTimedRotatingFileHandler(
+            log_file, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+    return BatchRotatingFileHandler(
+        log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
     )
-    
-    # Create handlers
-    handlers = []
-    
-    # Console handler
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(formatter)
-    handlers.append(console_handler)
-    
-    # File handler (if specified)
+
+
+def setup_logging(level: Optional[str] = None, log_file: Optional[str] = None,
+                  fmt: Optional[str] = None, rotation: Optional[str] = None,
+                  sample_rates: Optional[str] = None, stream=None) -> BatchingQueueListener:
+    """Install the queue-based pipeline on the root logger; safe to call again"""
+    global _listener, _queue_handler, _sample_rates
+
+    shutdown_logging()
+    level = (level or LOG_LEVEL).upper()
+    log_file = LOG_FILE if log_file is None else log_file
+    formatter = TextFormatter() if (fmt or LOG_FORMAT) == "text" else JsonFormatter()
+
+    handlers = [BatchStreamHandler(stream or sys.stdout)]
     if log_file:
-        file_handler = logging.FileHandler(log_file)
-        file_handler.setFormatter(formatter)
-        handlers.append(file_handler)
-    
-    # Configure root logger
-    logging.basicConfig(
-        level=getattr(logging, level.upper()),
-        handlers=handlers,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
+        handlers.append(_file_handler(log_file, rotation or LOG_ROTATION))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _queue_handler = LazyQueueHandler(log_queue)
+    _queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(getattr(logging, level))
+
+    _sample_rates = _parse_sample_rates(LOG_SAMPLE_RATES if sample_rates is None else sample_rates)
+    for name, rate in _sample_rates.items():
+        category = logging.getLogger(name)
+        for existing in [f for f in category.filters if isinstance(f, SamplingFilter)]:
+            category.removeFilter(existing)
+        category.addFilter(SamplingFilter(rate))
+
+    _listener = BatchingQueueListener(log_queue, *handlers)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
+def dropped_records() -> int:
+    """Records dropped because the log queue was full"""
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+atexit.register(shutdown_logging)
 
 # Create audit logger
 audit_logger = logging.getLogger("audit")
@@ -74,70 +328,87 @@ billing_logger.setLevel(logging.INFO)
 client_logger = logging.getLogger("client_management")
 client_logger.setLevel(logging.INFO)
 
+
+def _sampled(logger: logging.Logger, level: int) -> bool:
+    """Level and sampling check done before any log data is built"""
+    if not logger.isEnabledFor(level):
+        return False
+    rate = _sample_rates.get(logger.name, 1.0)
+    return level >= logging.WARNING or rate >= 1.0 or random.random() < rate
+
+
 # Logging utilities
 def log_user_activity(user_id: str, action: str, details: dict = None, ip_address: str = None):
     """Log user activity"""
-    log_data = {
+    if not _sampled(audit_logger, logging.INFO):
+        return
+    audit_logger.info("User Activity", extra={"sampled": True, "fields": {
         "user_id": user_id,
         "action": action,
-        "timestamp": datetime.now().isoformat(),
         "details": details or {},
         "ip_address": ip_address
-    }
-    audit_logger.info(f"User Activity: {log_data}")
+    }})
 
 def log_security_event(event_type: str, details: dict = None, severity: str = "INFO"):
     """Log security events"""
-    log_data = {
+    if not _sampled(security_logger, logging.WARNING):
+        return
+    security_logger.warning("Security Event", extra={"sampled": True, "fields": {
         "event_type": event_type,
-        "timestamp": datetime.now().isoformat(),
         "details": details or {},
         "severity": severity
-    }
-    security_logger.warning(f"Security Event: {log_data}")
+    }})
 
 def log_api_request(method: str, path: str, status_code: int, user_id: str = None, duration: float = None):
     """Log API requests"""
-    log_data = {
+    level = logging.WARNING if status_code >= 500 else logging.INFO
+    if not _sampled(api_logger, level):
+        return
+    api_logger.log(level, "API Request", extra={"sampled": True, "fields": {
         "method": method,
         "path": path,
         "status_code": status_code,
         "user_id": user_id,
-        "duration": duration,
-        "timestamp": datetime.now().isoformat()
-    }
-    api_logger.info(f"API Request: {log_data}")
+        "duration": duration
+    }})
 
 def log_database_operation(operation: str, table: str, details: dict = None):
     """Log database operations"""
-    log_data = {
+    if not _sampled(db_logger, logging.INFO):
+        return
+    db_logger.info("Database Operation", extra={"sampled": True, "fields": {
         "operation": operation,
         "table": table,
-        "timestamp": datetime.now().isoformat(),
         "details": details or {}
-    }
-    db_logger.info(f"Database Operation: {log_data}")
+    }})
 
 def log_billing_event(event_type: str, client_id: str, amount: float = None, details: dict = None):
     """Log billing events"""
-    log_data = {
+    if not _sampled(billing_logger, logging.INFO):
+        return
+    billing_logger.info("Billing Event", extra={"sampled": True, "fields": {
         "event_type": event_type,
         "client_id": client_id,
         "amount": amount,
-        "timestamp": datetime.now().isoformat(),
         "details": details or {}
-    }
-    billing_logger.info(f"Billing Event: {log_data}")
+    }})
 
 def log_client_management_event(event_type: str, client_id: str, details: dict = None):
     """Log client management events"""
-    log_data = {
+    if not _sampled(client_logger, logging.INFO):
+        return
+    client_logger.info("Client Management Event", extra={"sampled": True, "fields": {
         "event_type": event_type,
         "client_id": client_id,
-        "timestamp": datetime.now().isoformat(),
         "details": details or {}
-    }
-    client_logger.info(f"Client Management Event: {log_data}")
+    }})
 
-# Initialize logging
-setup_logging()
+def log_websocket_event(event_type: str, connection_id: str = None, details: dict = None):
+    """Log websocket events"""
+    if not _sampled(websocket_logger, logging.INFO):
+        return
+    websocket_logger.info("WebSocket Event", extra={"sampled": True, "fields": {
+        "event_type": event_type,
+        "connection_id": connection_id,
+        "details": details or {}
+    }})
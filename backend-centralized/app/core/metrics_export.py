@@ -0,0 +1,470 @@
+"""
+Prometheus / OpenMetrics Exposition
+Renders request, cache, database pool, WebSocket and camera metrics as text
+
+Metrics are read from the in-process state the rest of the app already
+keeps (latency sketches, cache counters, pool monitor, connection managers),
+so nothing extra runs on the request path. A scrape snapshots that state on
+the event loop, which only copies counters (latency sketches are copied as
+raw bucket counts), then folds histogram buckets, merges and formats it in a
+worker thread.
+
+With several uvicorn/gunicorn workers, set METRICS_MULTIPROC_DIR (or
+PROMETHEUS_MULTIPROC_DIR) to a shared directory. Each worker publishes its
+snapshot there every METRICS_PUBLISH_INTERVAL seconds and any worker's
+/metrics merges all live snapshots: counters and histograms are summed,
+gauges are summed or maxed per family.
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    from prometheus_client.core import (
+        CounterMetricFamily,
+        GaugeMetricFamily,
+        HistogramMetricFamily,
+    )
+    from prometheus_client.exposition import generate_latest as generate_text
+    from prometheus_client.exposition import CONTENT_TYPE_LATEST as TEXT_CONTENT_TYPE
+    from prometheus_client.openmetrics.exposition import generate_latest as generate_openmetrics
+    from prometheus_client.openmetrics.exposition import CONTENT_TYPE_LATEST as OPENMETRICS_CONTENT_TYPE
+
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR") or os.getenv("PROMETHEUS_MULTIPROC_DIR")
+METRICS_PUBLISH_INTERVAL = float(os.getenv("METRICS_PUBLISH_INTERVAL", "5"))  # seconds
+METRICS_RENDER_TTL = float(os.getenv("METRICS_RENDER_TTL", "1"))  # seconds
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "healthguard")
+
+# Prometheus-style histogram bounds (seconds)
+HTTP_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+SNAPSHOT_PREFIX = "metrics_"
+
+
+def _family(name: str, kind: str, documentation: str, agg: str = "sum") -> Dict[str, Any]:
+    return {"name": f"{METRICS_NAMESPACE}_{name}", "type": kind, "help": documentation,
+            "agg": agg, "samples": []}
+
+
+def _sample(family: Dict[str, Any], labels: Dict[str, str], value: float):
+    family["samples"].append({"labels": labels, "value": value})
+
+
+def _histogram_sample(family: Dict[str, Any], labels: Dict[str, str],
+                      buckets: Iterable[Tuple[float, int]], count: int, total: float):
+    family["samples"].append({
+        "labels": labels,
+        "buckets": [[bound, n] for bound, n in buckets] + [["+Inf", count]],
+        "sum": total,
+    })
+
+
+def _sketch_sample(family: Dict[str, Any], labels: Dict[str, str], sketch):
+    """Histogram sample holding the sketch's raw counts; see fold_sketches"""
+    family["samples"].append({
+        "labels": labels,
+        "sketch": list(sketch.counts.items()),
+        "count": sketch.count,
+        "sum": sketch.total,
+    })
+
+
+def fold_sketches(families: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Turn raw sketch samples into cumulative buckets in place; runs in a worker thread"""
+    from app.core.latency import cumulative_buckets
+
+    for family in families:
+        for sample in family["samples"]:
+            counts = sample.pop("sketch", None)
+            if counts is not None:
+                buckets = cumulative_buckets(counts, HTTP_DURATION_BUCKETS)
+                sample["buckets"] = [[bound, n] for bound, n in buckets] + [["+Inf", sample.pop("count")]]
+    return families
+
+
+# --- Collection from in-process state ------------------------------------------------
+
+def _request_families() -> List[Dict[str, Any]]:
+    from app.core.monitoring import metrics_collector
+
+    recorder = metrics_collector.latency
+    duration = _family("http_request_duration_seconds", "histogram",
+                       "HTTP request latency by route template, method and status class")
+    for (method, route, klass), series in list(recorder.series.items()):
+        _sketch_sample(duration, {"method": method, "route": route, "status_class": klass},
+                       series.cumulative)
+
+    tenants = _family("http_tenant_request_duration_seconds", "histogram",
+                      "HTTP request latency by tenant and status class")
+    for (tenant, klass), series in list(recorder.tenants.items()):
+        _sketch_sample(tenants, {"tenant": tenant, "status_class": klass}, series.cumulative)
+
+    errors = _family("application_errors", "counter", "Unhandled errors recorded by the application")
+    _sample(errors, {}, metrics_collector.errors_total)
+
+    families = [duration, tenants, errors]
+    system = metrics_collector.latest_system_metrics
+    if system is not None:
+        for name, value, documentation in (
+            ("system_cpu_percent", system.cpu_percent, "Host CPU utilisation"),
+            ("system_memory_percent", system.memory_percent, "Host memory utilisation"),
+            ("system_disk_usage_percent", system.disk_usage_percent, "Root filesystem utilisation"),
+        ):
+            family = _family(name, "gauge", documentation, agg="max")
+            _sample(family, {}, value)
+            families.append(family)
+    return families
+
+
+def _cache_families() -> List[Dict[str, Any]]:
+    from app.core.cache import cache_manager
+    from app.core.latency import LATENCY_BUCKETS
+
+    hits = _family("cache_hits", "counter", "Cache hits by key prefix and tier")
+    misses = _family("cache_misses", "counter", "Cache misses by key prefix")
+    sets = _family("cache_sets", "counter", "Cache writes by key prefix")
+    evictions = _family("cache_evictions", "counter", "In-process cache evictions by key prefix")
+    bytes_read = _family("cache_read_bytes", "counter", "Bytes read from Redis by key prefix")
+    bytes_written = _family("cache_written_bytes", "counter", "Bytes written to Redis by key prefix")
+    get_latency = _family("cache_get_duration_seconds", "histogram", "Cache get latency by key prefix")
+
+    for prefix, stats in list(cache_manager.metrics.prefixes.items()):
+        labels = {"prefix": prefix}
+        _sample(hits, {**labels, "tier": "memory"}, stats.memory_hits)
+        _sample(hits, {**labels, "tier": "redis"}, stats.redis_hits)
+        _sample(misses, labels, stats.misses)
+        _sample(sets, labels, stats.sets)
+        _sample(evictions, labels, stats.evictions)
+        _sample(bytes_read, labels, stats.bytes_read)
+        _sample(bytes_written, labels, stats.bytes_written)
+        histogram = stats.get_latency
+        running, buckets = 0, []
+        for bound, n in zip(LATENCY_BUCKETS, histogram.counts):
+            running += n
+            buckets.append((bound, running))
+        _histogram_sample(get_latency, labels, buckets, histogram.count, histogram.total)
+
+    entries = _family("cache_memory_entries", "gauge", "Entries in the in-process cache tier")
+    _sample(entries, {}, len(cache_manager.memory))
+    memory_bytes = _family("cache_memory_bytes", "gauge", "Bytes held by the in-process cache tier")
+    _sample(memory_bytes, {}, cache_manager.memory.current_bytes)
+    redis_up = _family("cache_redis_up", "gauge", "Whether Redis is reachable (1) or not (0)", agg="min")
+    _sample(redis_up, {}, 1 if cache_manager.redis_available else 0)
+    return [hits, misses, sets, evictions, bytes_read, bytes_written, get_latency,
+            entries, memory_bytes, redis_up]
+
+
+def _database_families() -> List[Dict[str, Any]]:
+    from app.core.latency import LATENCY_BUCKETS
+    from app.core.pool_metrics import pool_monitor
+
+    checked_out = _family("db_pool_checked_out", "gauge", "Connections currently checked out")
+    size = _family("db_pool_size", "gauge", "Configured pool size")
+    overflow = _family("db_pool_overflow", "gauge", "Connections open beyond the pool size")
+    checkouts = _family("db_pool_checkouts", "counter", "Connection checkouts")
+    long_held = _family("db_pool_long_held", "counter", "Connections held past the leak threshold")
+    wait = _family("db_pool_checkout_wait_seconds", "histogram", "Time spent waiting for a pooled connection")
+
+    for name, stats in list(pool_monitor.engines.items()):
+        labels = {"engine": name}
+        state = stats.pool_state()
+        _sample(checked_out, labels, len(stats.open_checkouts))
+        if "size" in state:
+            _sample(size, labels, state["size"])
+        if "overflow" in state:
+            _sample(overflow, labels, max(0, state["overflow"]))
+        _sample(checkouts, labels, stats.checkouts)
+        _sample(long_held, labels, stats.long_held)
+        histogram = stats.checkout_wait
+        running, buckets = 0, []
+        for bound, n in zip(LATENCY_BUCKETS, histogram.counts):
+            running += n
+            buckets.append((bound, running))
+        _histogram_sample(wait, labels, buckets, histogram.count, histogram.total)
+    return [checked_out, size, overflow, checkouts, long_held, wait]
+
+
+def _query_families() -> List[Dict[str, Any]]:
+    from app.core.query_audit import query_auditor
+
+    queries = _family("db_queries", "counter", "SQL statements executed")
+    _sample(queries, {}, query_auditor.queries)
+    slow = _family("db_slow_queries", "counter", "SQL statements slower than DB_SLOW_QUERY_MS")
+    _sample(slow, {}, query_auditor.slow_queries)
+    n_plus_one = _family("db_n_plus_one", "counter", "Repeated statement templates flagged as N+1, by route")
+    for scope, count in list(query_auditor.n_plus_one_by_scope.items()):
+        _sample(n_plus_one, {"scope": scope}, count)
+    return [queries, slow, n_plus_one]
+
+
+def _websocket_families() -> List[Dict[str, Any]]:
+    connections = _family("websocket_connections", "gauge", "Open WebSocket connections by hub scope")
+    patterns = _family("websocket_subscription_patterns", "gauge", "Distinct topic patterns with subscribers")
+    published = _family("websocket_published", "counter", "Messages published on the pub/sub hub")
+    queued = _family("websocket_outbound_queued", "gauge", "Frames waiting in per-connection send queues")
+    frames = _family("websocket_outbound_frames", "counter", "Outbound frames by outcome (sent, dropped, coalesced)")
+    bus = _family("realtime_bus_events", "counter", "Events exchanged with other workers by direction")
+    families = [connections, patterns, published, queued, frames, bus]
+    try:
+        from app.core.pubsub import hub
+        from app.core.event_bus import event_bus
+    except Exception as e:
+        logger.debug(f"WebSocket hub metrics unavailable: {e}")
+        return families
+
+    stats = hub.stats()
+    for scope, count in sorted(stats["connections_by_scope"].items()):
+        _sample(connections, {"scope": scope}, count)
+    _sample(patterns, {}, stats["subscription_patterns"])
+    _sample(published, {}, stats["published"])
+    _sample(queued, {}, stats["outbound"]["queued"])
+    for outcome in ("sent", "dropped", "coalesced"):
+        _sample(frames, {"outcome": outcome}, stats["outbound"][outcome])
+    bus_stats = event_bus.stats()
+    for direction in ("sent", "received"):
+        _sample(bus, {"direction": direction, "broker": bus_stats["broker"] or "none"}, bus_stats[direction])
+    return families
+
+
+def _camera_families() -> List[Dict[str, Any]]:
+    fps = _family("camera_pipeline_fps", "gauge", "Frames per second over the last second by camera and stage")
+    frames = _family("camera_frames", "counter", "Frames processed by camera and stage")
+    try:
+        from app.services.camera_integration import camera_manager
+    except Exception as e:
+        logger.debug(f"Camera metrics unavailable: {e}")
+        return [fps, frames]
+
+    for camera_id, camera in list(camera_manager.cameras.items()):
+        for stage, meter in (("capture", camera.capture_fps), ("record", camera.record_fps)):
+            labels = {"camera_id": camera_id, "stage": stage}
+            _sample(fps, labels, meter.rate())
+            _sample(frames, labels, meter.total)
+    return [fps, frames]
+
+
+COLLECTORS = (
+    _request_families,
+    _cache_families,
+    _database_families,
+    _query_families,
+    _websocket_families,
+    _camera_families,
+)
+
+
+def collect_snapshot() -> List[Dict[str, Any]]:
+    """Copy all metric values out of process state; cheap, call on the event loop"""
+    families: List[Dict[str, Any]] = []
+    for collector in COLLECTORS:
+        try:
+            families.extend(collector())
+        except Exception as e:
+            logger.error(f"Metrics collector {collector.__name__} failed: {e}")
+    return families
+
+
+# --- Multiprocess aggregation ---------------------------------------------------------
+
+def _snapshot_path(directory: str, pid: int) -> str:
+    return os.path.join(directory, f"{SNAPSHOT_PREFIX}{pid}.json")
+
+
+def write_snapshot(directory: str, families: List[Dict[str, Any]], pid: Optional[int] = None):
+    """Atomically publish this worker's snapshot"""
+    fold_sketches(families)
+    pid = os.getpid() if pid is None else pid
+    path = _snapshot_path(directory, pid)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"pid": pid, "written_at": time.time(), "families": families}, f)
+    os.replace(tmp_path, path)
+
+
+def read_snapshots(directory: str, exclude_pid: Optional[int] = None,
+                   max_age: Optional[float] = None) -> List[List[Dict[str, Any]]]:
+    """Snapshots published by other live workers; stale files are removed"""
+    max_age = METRICS_PUBLISH_INTERVAL * 3 if max_age is None else max_age
+    now = time.time()
+    snapshots = []
+    for filename in os.listdir(directory):
+        if not filename.startswith(SNAPSHOT_PREFIX) or not filename.endswith(".json"):
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            with open(path) as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if payload.get("pid") == exclude_pid:
+            continue
+        if now - payload.get("written_at", 0) > max_age:
+            # Worker exited or hung; its counters drop out like a process restart
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        snapshots.append(payload.get("families", []))
+    return snapshots
+
+
+def merge_snapshots(snapshots: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Merge per-worker families sample by sample (sum, max or min per family)"""
+    merged: Dict[str, Dict[str, Any]] = {}
+    order: List[str] = []
+    for families in snapshots:
+        for family in families:
+            name = family["name"]
+            target = merged.get(name)
+            if target is None:
+                target = merged[name] = {**family, "samples": {}}
+                order.append(name)
+            samples = target["samples"]
+            for sample in family["samples"]:
+                key = tuple(sorted(sample["labels"].items()))
+                existing = samples.get(key)
+                if existing is None:
+                    samples[key] = json.loads(json.dumps(sample))
+                elif "buckets" in sample:
+                    for bucket, (_, n) in zip(existing["buckets"], sample["buckets"]):
+                        bucket[1] += n
+                    existing["sum"] += sample["sum"]
+                elif family["agg"] == "max":
+                    existing["value"] = max(existing["value"], sample["value"])
+                elif family["agg"] == "min":
+                    existing["value"] = min(existing["value"], sample["value"])
+                else:
+                    existing["value"] += sample["value"]
+    return [{**merged[name], "samples": list(merged[name]["samples"].values())} for name in order]
+
+
+# --- Rendering ------------------------------------------------------------------------
+
+class _SnapshotCollector:
+    """prometheus_client collector yielding families from a merged snapshot"""
+
+    def __init__(self, families: List[Dict[str, Any]]):
+        self.families = families
+
+    def collect(self):
+        for family in self.families:
+            samples = family["samples"]
+            label_names = list(samples[0]["labels"]) if samples else []
+            if family["type"] == "counter":
+                metric = CounterMetricFamily(family["name"], family["help"], labels=label_names)
+            elif family["type"] == "histogram":
+                metric = HistogramMetricFamily(family["name"], family["help"], labels=label_names)
+            else:
+                metric = GaugeMetricFamily(family["name"], family["help"], labels=label_names)
+
+            for sample in samples:
+                values = [str(sample["labels"].get(label, "")) for label in label_names]
+                if family["type"] == "histogram":
+                    buckets = [(_format_bound(bound), n) for bound, n in sample["buckets"]]
+                    metric.add_metric(values, buckets, sample["sum"])
+                else:
+                    metric.add_metric(values, sample["value"])
+            yield metric
+
+
+def _format_bound(bound) -> str:
+    return bound if isinstance(bound, str) else repr(float(bound))
+
+
+def render(families: List[Dict[str, Any]], openmetrics: bool = True) -> bytes:
+    """Format merged families as OpenMetrics (default) or Prometheus text"""
+    collector = _SnapshotCollector(fold_sketches(families))
+    generate = generate_openmetrics if openmetrics else generate_text
+    return generate(collector)
+
+
+class MetricsExporter:
+    """Serves /metrics and publishes this worker's snapshot for the others"""
+
+    def __init__(self, multiproc_dir: Optional[str] = METRICS_MULTIPROC_DIR,
+                 publish_interval: float = METRICS_PUBLISH_INTERVAL,
+                 render_ttl: float = METRICS_RENDER_TTL):
+        self.multiproc_dir = multiproc_dir
+        self.publish_interval = publish_interval
+        self.render_ttl = render_ttl
+        self._rendered: Dict[bool, Tuple[float, bytes]] = {}
+        self._render_lock = asyncio.Lock()
+        self._publisher_task: Optional[asyncio.Task] = None
+
+    def _build(self, local: List[Dict[str, Any]], openmetrics: bool) -> bytes:
+        """Fold, merge with other workers and format; runs in a worker thread"""
+        fold_sketches(local)
+        if self.multiproc_dir:
+            write_snapshot(self.multiproc_dir, local)
+            snapshots = [local] + read_snapshots(self.multiproc_dir, exclude_pid=os.getpid())
+            families = merge_snapshots(snapshots)
+        else:
+            families = local
+        return render(families, openmetrics)
+
+    async def scrape(self, openmetrics: bool = True) -> bytes:
+        """Rendered exposition, reused for render_ttl so concurrent scrapes share work"""
+        cached = self._rendered.get(openmetrics)
+        if cached is not None and time.monotonic() - cached[0] < self.render_ttl:
+            return cached[1]
+
+        async with self._render_lock:
+            cached = self._rendered.get(openmetrics)
+            if cached is not None and time.monotonic() - cached[0] < self.render_ttl:
+                return cached[1]
+            local = collect_snapshot()
+            body = await asyncio.get_running_loop().run_in_executor(
+                None, self._build, local, openmetrics
+            )
+            self._rendered[openmetrics] = (time.monotonic(), body)
+            return body
+
+    async def _run_publisher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                local = collect_snapshot()
+                await loop.run_in_executor(None, write_snapshot, self.multiproc_dir, local)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error publishing metrics snapshot: {e}")
+            await asyncio.sleep(self.publish_interval)
+
+    def start(self):
+        """Start publishing snapshots when running with several workers"""
+        if not self.multiproc_dir:
+            return
+        os.makedirs(self.multiproc_dir, exist_ok=True)
+        if self._publisher_task is None or self._publisher_task.done():
+            self._publisher_task = asyncio.get_running_loop().create_task(self._run_publisher())
+
+    async def stop(self):
+        """Stop publishing and withdraw this worker's snapshot"""
+        task, self._publisher_task = self._publisher_task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self.multiproc_dir:
+            try:
+                os.remove(_snapshot_path(self.multiproc_dir, os.getpid()))
+            except OSError:
+                pass
+
+
+# Global exporter
+metrics_exporter = MetricsExporter()
@@ -3,18 +3,28 @@ Monitoring and Observability System
 Handles application monitoring, metrics, and health checks
 """
 
+import os
 import time
 import psutil
+import asyncio
 import logging
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 from dataclasses import dataclass, asdict
 from collections import defaultdict, deque
+from app.core.latency import RouteLatencyRecorder
+from app.core.rollups import RollupStore
 import threading
 import json
 
 logger = logging.getLogger(__name__)
 
+SYSTEM_METRICS_INTERVAL = float(os.getenv("SYSTEM_METRICS_INTERVAL", "15"))  # seconds
+SYSTEM_METRICS_HISTORY = int(os.getenv("SYSTEM_METRICS_HISTORY", "5760"))  # 24h at 15s
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "30"))  # seconds
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", "2"))  # seconds, per check
+HEALTH_CHECK_EXTERNAL_URL = os.getenv("HEALTH_CHECK_EXTERNAL_URL", "")
+
 @dataclass
 class SystemMetrics:
     """System performance metrics"""
@@ -57,22 +67,31 @@ class HealthCheck:
 class MetricsCollector:
     """Collects and stores application metrics"""
     
-    def __init__(self, max_history: int = 1000):
+    def __init__(self, max_history: int = 1000, system_history: int = SYSTEM_METRICS_HISTORY):
         self.max_history = max_history
-        self.system_metrics: deque = deque(maxlen=max_history)
+        self.system_metrics: deque = deque(maxlen=system_history)
         self.application_metrics: deque = deque(maxlen=max_history)
-        self.request_times: deque = deque(maxlen=max_history)
-        self.error_log: deque = deque(maxlen=max_history)
+        self.latency = RouteLatencyRecorder()
+        self.errors_total = 0
+        # Per-minute/per-hour request and error history (24h/7d) in constant memory
+        self.rollups = RollupStore()
         self.lock = threading.Lock()
         
         # Initialize baseline metrics
         self._baseline_network = psutil.net_io_counters()
         self._baseline_time = time.time()
+        
+        # Background sampler; the first non-blocking cpu_percent() call only primes the delta
+        self.sample_interval = SYSTEM_METRICS_INTERVAL
+        self.latest_system_metrics: Optional[SystemMetrics] = None
+        self._sampler_task: Optional[asyncio.Task] = None
+        psutil.cpu_percent(interval=None)
     
-    def collect_system_metrics(self) -> SystemMetrics:
-        """Collect current system metrics"""
+    def sample_system_metrics(self) -> Optional[SystemMetrics]:
+        """Take one system metrics sample without blocking"""
         try:
-            cpu_percent = psutil.cpu_percent(interval=1)
+            # CPU usage since the previous sample, instead of sleeping for a second
+            cpu_percent = psutil.cpu_percent(interval=None)
             memory = psutil.virtual_memory()
             disk = psutil.disk_usage('/')
             network = psutil.net_io_counters()
@@ -98,6 +117,7 @@ class MetricsCollector:
             
             with self.lock:
                 self.system_metrics.append(metrics)
+                self.latest_system_metrics = metrics
             
             return metrics
             
@@ -105,56 +125,81 @@ class MetricsCollector:
             logger.error(f"Error collecting system metrics: {e}")
             return None
     
-    def record_request(self, response_time: float, status_code: int = 200):
+    def collect_system_metrics(self) -> Optional[SystemMetrics]:
+        """Get the latest system metrics snapshot, sampling once if none exists yet"""
+        latest = self.latest_system_metrics
+        if latest is not None:
+            return latest
+        return self.sample_system_metrics()
+    
+    async def _run_sampler(self):
+        """Sample system metrics every sample_interval seconds"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                # psutil reads /proc and statfs, which may block on slow filesystems
+                await loop.run_in_executor(None, self.sample_system_metrics)
+                await asyncio.sleep(self.sample_interval)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in system metrics sampler: {e}")
+                await asyncio.sleep(self.sample_interval)
+    
+    def start_sampler(self, interval: Optional[float] = None):
+        """Start the background system metrics sampler on the running loop"""
+        if interval is not None:
+            self.sample_interval = interval
+        if self._sampler_task is None or self._sampler_task.done():
+            self._sampler_task = asyncio.get_running_loop().create_task(self._run_sampler())
+    
+    async def stop_sampler(self):
+        """Stop the background system metrics sampler"""
+        task, self._sampler_task = self._sampler_task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    
+    def record_request(self, response_time: float, status_code: int = 200, route: str = "*",
+                       method: str = "*", tenant: Optional[str] = None):
         """Record a request metric"""
-        with self.lock:
-            self.request_times.append({
-                'timestamp': datetime.now(),
-                'response_time': response_time,
-                'status_code': status_code
-            })
+        self.latency.record(route, status_code, response_time, method=method, tenant=tenant)
+        self.rollups.record_request(response_time, status_code)
     
     def record_error(self, error: Exception, context: str = ""):
         """Record an error"""
-        with self.lock:
-            self.error_log.append({
-                'timestamp': datetime.now(),
-                'error': str(error),
-                'error_type': type(error).__name__,
-                'context': context
-            })
+        self.errors_total += 1
+        self.rollups.record_error(type(error).__name__)
+        if context:
+            logger.debug(f"Recorded {type(error).__name__} in {context}: {error}")
     
     def collect_application_metrics(self) -> ApplicationMetrics:
         """Collect current application metrics"""
         try:
-            # Calculate response time percentiles
-            recent_times = [r['response_time'] for r in list(self.request_times)[-100:]]
-            if recent_times:
-                recent_times.sort()
-                avg_time = sum(recent_times) / len(recent_times)
-                p95_index = int(len(recent_times) * 0.95)
-                p99_index = int(len(recent_times) * 0.99)
-                p95_time = recent_times[p95_index] if p95_index < len(recent_times) else 0
-                p99_time = recent_times[p99_index] if p99_index < len(recent_times) else 0
-            else:
-                avg_time = p95_time = p99_time = 0
+            # Response time percentiles over the last minute
+            window = self.latency.window(60)
+            quantiles = window.quantiles((0.95, 0.99))
+            avg_time = window.total / window.count if window.count else 0
             
-            # Count recent requests and errors
-            recent_requests = [r for r in list(self.request_times)[-100:] 
-                             if (datetime.now() - r['timestamp']).seconds < 60]
-            recent_errors = [e for e in list(self.error_log)[-100:] 
-                           if (datetime.now() - e['timestamp']).seconds < 60]
+            # Errors in the current and previous minute rollups
+            recent_errors = self.rollups.query(60).errors
+            
+            from app.core.cache import cache_manager
+            from app.core.pool_metrics import pool_monitor
             
             metrics = ApplicationMetrics(
                 timestamp=datetime.now(),
-                request_count=len(recent_requests),
-                error_count=len(recent_errors),
+                request_count=window.count,
+                error_count=recent_errors,
                 response_time_avg=avg_time,
-                response_time_p95=p95_time,
-                response_time_p99=p99_time,
+                response_time_p95=quantiles[0.95],
+                response_time_p99=quantiles[0.99],
                 active_users=0,  # Will be updated by user tracking
-                cache_hit_rate=0.0,  # Will be updated by cache tracking
-                database_connections=0,  # Will be updated by DB tracking
+                cache_hit_rate=cache_manager.metrics.hit_rate(),
+                database_connections=pool_monitor.checked_out(),
                 background_tasks=0  # Will be updated by task tracking
             )
             
@@ -174,8 +219,6 @@ class MetricsCollector:
         with self.lock:
             recent_system = [m for m in self.system_metrics if m.timestamp > cutoff_time]
             recent_app = [m for m in self.application_metrics if m.timestamp > cutoff_time]
-            recent_requests = [r for r in self.request_times if r['timestamp'] > cutoff_time]
-            recent_errors = [e for e in self.error_log if e['timestamp'] > cutoff_time]
         
         if not recent_system:
             return {'error': 'No metrics available'}
@@ -183,7 +226,13 @@ class MetricsCollector:
         # Calculate averages
         avg_cpu = sum(m.cpu_percent for m in recent_system) / len(recent_system)
         avg_memory = sum(m.memory_percent for m in recent_system) / len(recent_system)
-        avg_response_time = sum(r['response_time'] for r in recent_requests) / len(recent_requests) if recent_requests else 0
+        
+        # Request and error figures cover the whole period from the rollup store
+        period = self.rollups.query(hours * 3600)
+        requests = period.latency
+        quantiles = requests.quantiles((0.95, 0.99))
+        avg_response_time = requests.total / requests.count if requests.count else 0
+        windows = self.latency.window_lengths
         
         return {
             'period_hours': hours,
@@ -195,12 +244,19 @@ class MetricsCollector:
                 'uptime_hours': round(recent_system[-1].uptime_seconds / 3600, 2) if recent_system else 0
             },
             'application_metrics': {
-                'total_requests': len(recent_requests),
-                'total_errors': len(recent_errors),
-                'error_rate': round(len(recent_errors) / len(recent_requests) * 100, 2) if recent_requests else 0,
+                'window_seconds': hours * 3600,
+                'total_requests': period.requests,
+                'total_errors': period.errors,
+                'server_errors': period.server_errors,
+                'client_errors': period.client_errors,
+                'error_rate': round(period.server_errors / period.requests * 100, 2) if period.requests else 0,
                 'avg_response_time_ms': round(avg_response_time * 1000, 2),
-                'requests_per_minute': round(len(recent_requests) / (hours * 60), 2)
+                'p95_response_time_ms': round(quantiles[0.95] * 1000, 2),
+                'p99_response_time_ms': round(quantiles[0.99] * 1000, 2),
+                'requests_per_minute': round(period.requests / (hours * 60), 2),
+                'error_types': dict(period.error_types.most_common())
             },
+            'latency': {f"{w}s": self.latency.summary(w) for w in windows},
             'latest_metrics': {
                 'system': asdict(recent_system[-1]) if recent_system else None,
                 'application': asdict(recent_app[-1]) if recent_app else None
@@ -208,14 +264,28 @@ class MetricsCollector:
         }
 
 class HealthChecker:
-    """Performs health checks on various services"""
+    """Runs async health probes concurrently and caches their results
     
-    def __init__(self):
+    Probes run in the background every check_interval seconds, each under its
+    own deadline. Readers get the cached results and never wait on I/O.
+    """
+    
+    def __init__(self, check_interval: float = HEALTH_CHECK_INTERVAL,
+                 check_timeout: float = HEALTH_CHECK_TIMEOUT):
         self.health_checks: Dict[str, HealthCheck] = {}
-        self.check_interval = 30  # seconds
+        self.check_funcs: Dict[str, Callable[[], Awaitable[Dict[str, Any]]]] = {}
+        self.check_timeouts: Dict[str, float] = {}
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.last_run: Optional[float] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._checker_task: Optional[asyncio.Task] = None
     
-    def add_health_check(self, service: str, check_func):
-        """Add a health check function for a service"""
+    def add_health_check(self, service: str, check_func: Callable[[], Awaitable[Dict[str, Any]]],
+                         timeout: Optional[float] = None):
+        """Register an async check returning {'status': ..., 'error': ...}"""
+        self.check_funcs[service] = check_func
+        self.check_timeouts[service] = timeout or self.check_timeout
         self.health_checks[service] = HealthCheck(
             service=service,
             status='unknown',
@@ -223,136 +293,192 @@ class HealthChecker:
             last_check=None
         )
     
-    def perform_health_checks(self) -> List[HealthCheck]:
-        """Perform all health checks"""
-        results = []
+    async def _run_check(self, service: str) -> HealthCheck:
+        health_check = self.health_checks[service]
+        timeout = self.check_timeouts[service]
+        start_time = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(self.check_funcs[service](), timeout)
+        except asyncio.TimeoutError:
+            result = {'status': 'unhealthy', 'error': f'Timed out after {timeout:g}s'}
+        except Exception as e:
+            result = {'status': 'unhealthy', 'error': str(e)}
         
-        for service, health_check in self.health_checks.items():
+        health_check.status = result.get('status', 'unknown')
+        health_check.response_time = time.perf_counter() - start_time
+        health_check.error_message = result.get('error')
+        health_check.last_check = datetime.now()
+        return health_check
+    
+    async def perform_health_checks(self) -> List[HealthCheck]:
+        """Run all checks concurrently; total time is bounded by the slowest deadline"""
+        results = await asyncio.gather(*(self._run_check(service) for service in self.check_funcs))
+        self.last_run = time.monotonic()
+        return list(results)
+    
+    def is_stale(self) -> bool:
+        return self.last_run is None or time.monotonic() - self.last_run >= self.check_interval
+    
+    def refresh(self) -> asyncio.Task:
+        """Start a refresh unless one is already running; concurrent callers share it"""
+        task = self._refresh_task
+        if task is None or task.done():
+            task = self._refresh_task = asyncio.get_running_loop().create_task(self.perform_health_checks())
+        return task
+    
+    def get_health_checks(self) -> List[HealthCheck]:
+        """Cached results; schedules a background refresh when they are stale"""
+        if self.is_stale():
+            try:
+                self.refresh()
+            except RuntimeError:
+                pass  # No running loop; the checker task refreshes on its own
+        return list(self.health_checks.values())
+    
+    async def _run_checker(self):
+        """Refresh health checks every check_interval seconds"""
+        while True:
             try:
-                start_time = time.time()
-                
-                # Perform the actual health check
-                if service == 'database':
-                    result = self._check_database()
-                elif service == 'cache':
-                    result = self._check_cache()
-                elif service == 'external_api':
-                    result = self._check_external_api()
-                else:
-                    result = {'status': 'unknown', 'error': 'Unknown service'}
-                
-                response_time = time.time() - start_time
-                
-                # Update health check
-                health_check.status = result.get('status', 'unknown')
-                health_check.response_time = response_time
-                health_check.error_message = result.get('error')
-                health_check.last_check = datetime.now()
-                
-                results.append(health_check)
-                
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                health_check.status = 'unhealthy'
-                health_check.error_message = str(e)
-                health_check.last_check = datetime.now()
-                results.append(health_check)
-        
-        return results
+                logger.error(f"Error running health checks: {e}")
+            await asyncio.sleep(self.check_interval)
+    
+    def start(self):
+        """Start the background health checker on the running loop"""
+        if self._checker_task is None or self._checker_task.done():
+            self._checker_task = asyncio.get_running_loop().create_task(self._run_checker())
     
-    def _check_database(self) -> Dict[str, Any]:
+    async def stop(self):
+        """Stop the background health checker"""
+        for task in (self._checker_task, self._refresh_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._checker_task = self._refresh_task = None
+    
+    async def _check_database(self) -> Dict[str, Any]:
         """Check database health"""
-        try:
-            from app.core.database import get_db
-            from sqlalchemy import text
-            
-            db = next(get_db())
-            result = db.execute(text("SELECT 1"))
-            result.fetchone()
+        from app.core import database
+        from sqlalchemy import text
+        
+        if database.async_engine is not None:
+            async with database.async_engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+        else:
+            def ping():
+                with database.get_engine().connect() as conn:
+                    conn.execute(text("SELECT 1")).fetchone()
             
-            return {'status': 'healthy'}
-        except Exception as e:
-            return {'status': 'unhealthy', 'error': str(e)}
+            await asyncio.to_thread(ping)
+        return {'status': 'healthy'}
     
-    def _check_cache(self) -> Dict[str, Any]:
+    async def _check_cache(self) -> Dict[str, Any]:
         """Check cache health"""
-        try:
-            from app.core.cache import cache_manager
-            
-            # Test cache operations
-            test_key = "health_check_test"
-            test_value = "test"
-            
-            cache_manager.set(test_key, test_value, 10)
-            retrieved = cache_manager.get(test_key)
-            cache_manager.delete(test_key)
-            
-            if retrieved == test_value:
-                return {'status': 'healthy'}
-            else:
-                return {'status': 'degraded', 'error': 'Cache read/write mismatch'}
-                
-        except Exception as e:
-            return {'status': 'unhealthy', 'error': str(e)}
-    
-    def _check_external_api(self) -> Dict[str, Any]:
-        """Check external API health"""
-        try:
-            import requests
-            
-            # Check a simple external service
-            response = requests.get('https://httpbin.org/status/200', timeout=5)
-            
-            if response.status_code == 200:
-                return {'status': 'healthy'}
-            else:
-                return {'status': 'degraded', 'error': f'HTTP {response.status_code}'}
-                
-        except Exception as e:
-            return {'status': 'unhealthy', 'error': str(e)}
+        from app.core.cache import cache_manager
+        
+        test_key = "health_check_test"
+        test_value = "test"
+        
+        cache_manager.set_local(test_key, test_value, 10)
+        retrieved = cache_manager.get_local(test_key)
+        cache_manager.memory.delete(test_key)
+        
+        if retrieved != test_value:
+            return {'status': 'degraded', 'error': 'Cache read/write mismatch'}
+        if cache_manager.redis_client is not None:
+            if not cache_manager.redis_available:
+                return {'status': 'degraded', 'error': 'Redis unavailable, using in-memory cache'}
+            try:
+                await cache_manager.redis_client.ping()
+            except Exception as e:
+                return {'status': 'degraded', 'error': f'Redis ping failed: {e}'}
+        return {'status': 'healthy'}
     
-    def get_overall_health(self) -> str:
-        """Get overall system health status"""
-        checks = self.perform_health_checks()
+    async def _check_external_api(self) -> Dict[str, Any]:
+        """Check the configured external dependency (HEALTH_CHECK_EXTERNAL_URL)"""
+        import aiohttp
         
+        async with aiohttp.ClientSession() as session:
+            async with session.get(HEALTH_CHECK_EXTERNAL_URL) as response:
+                if response.status < 400:
+                    return {'status': 'healthy'}
+                return {'status': 'degraded', 'error': f'HTTP {response.status}'}
+    
+    @staticmethod
+    def overall_status(checks: List[HealthCheck]) -> str:
+        """Worst status across checks"""
         if not checks:
             return 'unknown'
         
-        unhealthy_count = sum(1 for check in checks if check.status == 'unhealthy')
-        degraded_count = sum(1 for check in checks if check.status == 'degraded')
-        
-        if unhealthy_count > 0:
+        statuses = {check.status for check in checks}
+        if 'unhealthy' in statuses:
             return 'unhealthy'
-        elif degraded_count > 0:
+        elif 'degraded' in statuses:
             return 'degraded'
+        elif 'unknown' in statuses:
+            return 'unknown'
         else:
             return 'healthy'
+    
+    def get_overall_health(self) -> str:
+        """Get overall system health status from the cached results"""
+        return self.overall_status(self.get_health_checks())
+    
+    def is_ready(self) -> bool:
+        """Readiness: every check has run and none is unhealthy"""
+        return self.get_overall_health() in ('healthy', 'degraded')
+
+UNMATCHED_ROUTE = "unmatched"
+
+def _route_label(scope) -> str:
+    """Route template (e.g. /cameras/{camera_id}) so IDs don't create new series"""
+    route = scope.get('route')
+    return getattr(route, 'path', None) or UNMATCHED_ROUTE
 
 class MonitoringMiddleware:
-    """FastAPI middleware for request monitoring"""
+    """Pure ASGI middleware recording latency per route, method, status and tenant"""
     
-    def __init__(self, metrics_collector: MetricsCollector):
+    def __init__(self, app, metrics_collector: MetricsCollector):
+        self.app = app
         self.metrics_collector = metrics_collector
     
-    async def __call__(self, request, call_next):
-        start_time = time.time()
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        
+        start_time = time.perf_counter()
+        status_code = 500
+        
+        async def send_with_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
         
         try:
-            response = await call_next(request)
-            response_time = time.time() - start_time
-            
-            # Record successful request
-            self.metrics_collector.record_request(response_time, response.status_code)
-            
-            return response
-            
+            await self.app(scope, receive, send_with_status)
         except Exception as e:
-            response_time = time.time() - start_time
-            
             # Record failed request
-            self.metrics_collector.record_request(response_time, 500)
-            self.metrics_collector.record_error(e, f"Request to {request.url.path}")
-            
+            status_code = 500
+            self.metrics_collector.record_error(e, f"Request to {scope.get('path')}")
             raise
+        finally:
+            # Routing fills scope['route'] and tenant_middleware fills the request state
+            state = scope.get('state') or {}
+            self.metrics_collector.record_request(
+                time.perf_counter() - start_time,
+                status_code,
+                _route_label(scope),
+                method=scope.get('method', '*'),
+                tenant=state.get('tenant_id'),
+            )
 
 # Global instances
 metrics_collector = MetricsCollector()
@@ -361,18 +487,28 @@ health_checker = HealthChecker()
 # Initialize health checks
 health_checker.add_health_check('database', health_checker._check_database)
 health_checker.add_health_check('cache', health_checker._check_cache)
-health_checker.add_health_check('external_api', health_checker._check_external_api)
+if HEALTH_CHECK_EXTERNAL_URL:
+    health_checker.add_health_check('external_api', health_checker._check_external_api)
 
 def get_cache_stats() -> Dict[str, Any]:
     """Get cache statistics"""
     try:
-        # Mock cache stats for now
+        from app.core.cache import cache_manager
+        
+        metrics = cache_manager.metrics.snapshot()
         return {
-            'hits': 0,
-            'misses': 0,
-            'hit_rate': 0.0,
-            'size': 0,
-            'max_size': 1000
+            'hits': metrics['hits'],
+            'misses': metrics['misses'],
+            'hit_rate': metrics['hit_rate'],
+            'sets': metrics['sets'],
+            'evictions': metrics['evictions'],
+            'bytes_written': metrics['bytes_written'],
+            'size': len(cache_manager.memory),
+            'max_size': cache_manager.memory.max_entries,
+            'memory_bytes': cache_manager.memory.current_bytes,
+            'max_memory_bytes': cache_manager.memory.max_bytes,
+            'redis_connected': cache_manager.redis_available,
+            'prefixes': metrics['prefixes']
         }
     except Exception as e:
         logger.error(f"Error getting cache stats: {e}")
@@ -380,17 +516,29 @@ def get_cache_stats() -> Dict[str, Any]:
             'error': str(e)
         }
 
+def get_database_pool_stats() -> Dict[str, Any]:
+    """Get database connection pool statistics"""
+    try:
+        from app.core.pool_metrics import pool_monitor
+        
+        return pool_monitor.snapshot()
+    except Exception as e:
+        logger.error(f"Error getting database pool stats: {e}")
+        return {
+            'error': str(e)
+        }
+
 def get_system_status() -> Dict[str, Any]:
     """Get current system status"""
     try:
         # Collect current metrics
         system_metrics = metrics_collector.collect_system_metrics()
         app_metrics = metrics_collector.collect_application_metrics()
-        health_checks = health_checker.perform_health_checks()
+        health_checks = health_checker.get_health_checks()
         
         return {
             'timestamp': datetime.now().isoformat(),
-            'overall_health': health_checker.get_overall_health(),
+            'overall_health': health_checker.overall_status(health_checks),
             'system_metrics': asdict(system_metrics) if system_metrics else None,
             'application_metrics': asdict(app_metrics) if app_metrics else None,
             'health_checks': [asdict(check) for check in health_checks],
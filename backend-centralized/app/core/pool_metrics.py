@@ -0,0 +1,273 @@
+"""
+Database Pool Telemetry
+Tracks checked-out connections, checkout wait, overflow and leaked connections
+
+A PoolMonitor is attached to each engine built by init_engine(). Pool events
+keep a per-connection record of when and where it was checked out, so
+connections held longer than DB_LEAK_THRESHOLD can be reported. With
+DB_LEAK_STACKS=true the report includes the stack of the call site that
+took them; capture then walks the frames on every checkout (source lines
+are only looked up when a leak is reported), so it is off by default.
+"""
+
+import os
+import sys
+import time
+import logging
+import threading
+import traceback
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event
+
+from app.core.latency import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+DB_LEAK_THRESHOLD = float(os.getenv("DB_LEAK_THRESHOLD", "30"))  # seconds
+DB_LEAK_STACKS = os.getenv("DB_LEAK_STACKS", "false").lower() == "true"
+DB_LEAK_STACK_DEPTH = int(os.getenv("DB_LEAK_STACK_DEPTH", "16"))
+DB_LEAK_REPORT_LIMIT = 20
+
+# Frames from these packages are noise in leak reports
+_IGNORED_FRAME_PATHS = (
+    f"{os.sep}sqlalchemy{os.sep}",
+    f"{os.sep}starlette{os.sep}",
+    f"{os.sep}anyio{os.sep}",
+    f"{os.sep}asyncio{os.sep}",
+    f"{os.sep}threading.py",
+    f"{os.sep}pool_metrics.py",
+)
+
+
+def _capture_stack(limit: int) -> List[tuple]:
+    """(filename, line, function) for the caller's caller and up, outermost first"""
+    frame = sys._getframe(2)
+    stack = []
+    while frame is not None and len(stack) < limit:
+        code = frame.f_code
+        stack.append((code.co_filename, frame.f_lineno, code.co_name))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class _Checkout:
+    """Where and when a pooled connection was checked out"""
+
+    __slots__ = ("started", "thread", "stack")
+
+    def __init__(self, started: float, thread: str, stack):
+        self.started = started
+        self.thread = thread
+        self.stack = stack
+
+
+class EnginePoolStats:
+    """Counters for one engine's connection pool"""
+
+    def __init__(self, name: str, pool):
+        self.name = name
+        self.pool = pool
+        self.checkouts = 0
+        self.checkins = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.checkout_errors = 0
+        self.peak_checked_out = 0
+        self.peak_overflow = 0
+        self.long_held = 0
+        self.max_held = 0.0
+        self.checkout_wait = LatencyHistogram()
+        self.max_checkout_wait = 0.0
+        self.hold_time = LatencyHistogram()
+        self.open_checkouts: Dict[int, _Checkout] = {}
+
+    def pool_state(self) -> Dict[str, Any]:
+        """Live pool gauges; StaticPool/NullPool only report what they track"""
+        state: Dict[str, Any] = {"class": type(self.pool).__name__}
+        for attr in ("size", "checkedin", "checkedout", "overflow"):
+            method = getattr(self.pool, attr, None)
+            if callable(method):
+                try:
+                    state[attr] = method()
+                except Exception:
+                    pass
+        max_overflow = getattr(self.pool, "_max_overflow", None)
+        if max_overflow is not None:
+            state["max_overflow"] = max_overflow
+        return state
+
+
+class PoolMonitor:
+    """Attaches pool event hooks to engines and aggregates their telemetry"""
+
+    def __init__(
+        self,
+        leak_threshold: float = DB_LEAK_THRESHOLD,
+        capture_stacks: bool = DB_LEAK_STACKS,
+        stack_depth: int = DB_LEAK_STACK_DEPTH,
+    ):
+        self.leak_threshold = leak_threshold
+        self.capture_stacks = capture_stacks
+        self.stack_depth = stack_depth
+        self.engines: Dict[str, EnginePoolStats] = {}
+        self.lock = threading.Lock()
+
+    def attach(self, engine, name: str) -> EnginePoolStats:
+        """Install pool hooks on a (sync) engine; idempotent per pool"""
+        pool = engine.pool
+        existing = self.engines.get(name)
+        if existing is not None and existing.pool is pool:
+            return existing
+
+        stats = EnginePoolStats(name, pool)
+        self.engines[name] = stats
+        self._wrap_connect(pool, stats)
+
+        @event.listens_for(pool, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            stats.connects += 1
+
+        @event.listens_for(pool, "checkout")
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            self._on_checkout(stats, connection_record)
+
+        @event.listens_for(pool, "checkin")
+        def on_checkin(dbapi_connection, connection_record):
+            self._on_checkin(stats, connection_record)
+
+        @event.listens_for(pool, "invalidate")
+        def on_invalidate(dbapi_connection, connection_record, exception):
+            stats.invalidations += 1
+
+        return stats
+
+    def detach(self, name: str):
+        """Forget an engine whose pool has been disposed"""
+        self.engines.pop(name, None)
+
+    def _wrap_connect(self, pool, stats: EnginePoolStats):
+        """Time Pool.connect(), which blocks while the pool is exhausted"""
+        connect = pool.connect
+
+        def timed_connect(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return connect(*args, **kwargs)
+            except Exception:
+                stats.checkout_errors += 1
+                raise
+            finally:
+                waited = time.perf_counter() - started
+                stats.checkout_wait.record(waited)
+                if waited > stats.max_checkout_wait:
+                    stats.max_checkout_wait = waited
+
+        pool.connect = timed_connect
+
+    def _on_checkout(self, stats: EnginePoolStats, connection_record):
+        stack = None
+        if self.capture_stacks:
+            # File, line and function only; source lines are read when a leak is reported
+            stack = _capture_stack(self.stack_depth + 8)
+        checkout = _Checkout(time.monotonic(), threading.current_thread().name, stack)
+
+        with self.lock:
+            stats.open_checkouts[id(connection_record)] = checkout
+            stats.checkouts += 1
+            checked_out = len(stats.open_checkouts)
+            if checked_out > stats.peak_checked_out:
+                stats.peak_checked_out = checked_out
+        overflow = getattr(stats.pool, "overflow", None)
+        if callable(overflow):
+            current = overflow()
+            if current > stats.peak_overflow:
+                stats.peak_overflow = current
+
+    def _on_checkin(self, stats: EnginePoolStats, connection_record):
+        with self.lock:
+            checkout = stats.open_checkouts.pop(id(connection_record), None)
+            stats.checkins += 1
+        if checkout is None:
+            return
+
+        held = time.monotonic() - checkout.started
+        stats.hold_time.record(held)
+        if held > stats.max_held:
+            stats.max_held = held
+        if held > self.leak_threshold:
+            stats.long_held += 1
+            logger.warning(
+                f"Database connection on '{stats.name}' held for {held:.1f}s "
+                f"(threshold {self.leak_threshold:.0f}s); checked out at:\n"
+                f"{self._format_stack(checkout.stack)}"
+            )
+
+    def _format_stack(self, stack) -> str:
+        if not stack:
+            return "  <stack capture disabled>"
+        frames = [
+            frame for frame in stack
+            if not any(part in frame[0] for part in _IGNORED_FRAME_PATHS)
+        ] or list(stack)
+        summaries = [traceback.FrameSummary(filename, line, name) for filename, line, name in frames]
+        return "".join(traceback.format_list(summaries[-self.stack_depth:])).rstrip()
+
+    def checked_out(self) -> int:
+        """Connections currently checked out across all engines"""
+        return sum(len(stats.open_checkouts) for stats in self.engines.values())
+
+    def long_held_connections(self, threshold: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Connections still checked out longer than the threshold, oldest first"""
+        threshold = self.leak_threshold if threshold is None else threshold
+        now = time.monotonic()
+        leaks = []
+        with self.lock:
+            for stats in self.engines.values():
+                for checkout in stats.open_checkouts.values():
+                    held = now - checkout.started
+                    if held >= threshold:
+                        leaks.append((held, stats.name, checkout))
+        leaks.sort(key=lambda item: item[0], reverse=True)
+
+        return [
+            {
+                "engine": name,
+                "held_seconds": round(held, 3),
+                "thread": checkout.thread,
+                "stack": self._format_stack(checkout.stack).splitlines(),
+            }
+            for held, name, checkout in leaks[:DB_LEAK_REPORT_LIMIT]
+        ]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Per-engine pool gauges, counters and latency histograms"""
+        engines = {}
+        for name, stats in list(self.engines.items()):
+            engines[name] = {
+                "pool": stats.pool_state(),
+                "checked_out": len(stats.open_checkouts),
+                "peak_checked_out": stats.peak_checked_out,
+                "peak_overflow": stats.peak_overflow,
+                "checkouts": stats.checkouts,
+                "checkins": stats.checkins,
+                "connects": stats.connects,
+                "invalidations": stats.invalidations,
+                "checkout_errors": stats.checkout_errors,
+                "checkout_wait": stats.checkout_wait.to_dict(),
+                "max_checkout_wait_ms": round(stats.max_checkout_wait * 1000, 3),
+                "hold_time": stats.hold_time.to_dict(),
+                "max_held_seconds": round(stats.max_held, 3),
+                "long_held": stats.long_held,
+            }
+        return {
+            "checked_out": self.checked_out(),
+            "leak_threshold_seconds": self.leak_threshold,
+            "engines": engines,
+            "long_held_connections": self.long_held_connections(),
+        }
+
+
+# Global pool monitor
+pool_monitor = PoolMonitor()
@@ -0,0 +1,362 @@
+"""
+On-demand Sampling Profiler
+Time-boxed stack sampling for a live worker, with flamegraph-ready output
+
+A StackSampler runs a daemon thread that wakes every `interval` seconds and
+reads sys._current_frames(); nothing is installed on the request path, so
+overhead is zero while no session is running and a few percent of one core
+while one is. Results are aggregated as folded stacks and exported either as
+collapsed text (flamegraph.pl, speedscope, inferno) or speedscope JSON.
+
+Sessions are started by admins through /api/v1/monitoring/profile, or per
+request by sending the X-Profile header with a token whose role is listed in
+PROFILE_ROLES. Per-request profiles only count samples taken while one of the
+request's tasks is running on the event loop: its own task plus every task
+spawned under it, such as the child task BaseHTTPMiddleware's call_next runs
+the endpoint in. While a request is being profiled, a loop task factory tags
+tasks created inside that request's context. Profiles are fetched afterwards
+by the id returned in the X-Profile-Id response header.
+"""
+
+import os
+import sys
+import time
+import uuid
+import asyncio
+import logging
+import weakref
+import threading
+import contextvars
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROFILER_MAX_DURATION = float(os.getenv("PROFILER_MAX_DURATION", "60"))  # seconds
+PROFILER_DEFAULT_INTERVAL = float(os.getenv("PROFILER_DEFAULT_INTERVAL", "0.005"))  # seconds
+PROFILER_MIN_INTERVAL = 0.001
+PROFILER_MAX_DEPTH = int(os.getenv("PROFILER_MAX_DEPTH", "128"))
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Profile").lower().encode()
+PROFILE_ROLES = {role.strip() for role in os.getenv("PROFILE_ROLES", "admin").split(",") if role.strip()}
+PROFILE_STORE_SIZE = int(os.getenv("PROFILE_STORE_SIZE", "20"))
+PROFILE_MAX_CONCURRENT = int(os.getenv("PROFILE_MAX_CONCURRENT", "4"))
+
+# (qualified name, file, first line) of a code object
+FrameKey = Tuple[str, str, int]
+
+# Sampler of the request being profiled; inherited by tasks spawned under it
+_request_sampler: contextvars.ContextVar[Optional["StackSampler"]] = contextvars.ContextVar(
+    "request_sampler", default=None
+)
+
+
+def _frame_key(code) -> FrameKey:
+    return (getattr(code, "co_qualname", code.co_name), code.co_filename, code.co_firstlineno)
+
+
+class Profile:
+    """Aggregated folded stacks from one sampling session"""
+
+    def __init__(self, profile_id: str, interval: float, label: str = ""):
+        self.id = profile_id
+        self.label = label
+        self.interval = interval
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.samples = 0
+        self.stacks: Counter = Counter()
+
+    @staticmethod
+    def _frame_name(frame: FrameKey) -> str:
+        name, filename, line = frame
+        return f"{name} ({os.path.basename(filename)}:{line})"
+
+    def to_collapsed(self) -> str:
+        """Brendan Gregg folded format: 'root;child;leaf count' per line"""
+        lines = [
+            ";".join(self._frame_name(frame) for frame in stack) + f" {count}"
+            for stack, count in self.stacks.most_common()
+        ]
+        return "\n".join(lines) + ("\n" if lines else "")
+
+    def to_speedscope(self) -> Dict[str, Any]:
+        """speedscope.app sampled-profile JSON"""
+        frames: List[Dict[str, Any]] = []
+        index: Dict[FrameKey, int] = {}
+        samples, weights = [], []
+        for stack, count in self.stacks.items():
+            row = []
+            for frame in stack:
+                position = index.get(frame)
+                if position is None:
+                    position = index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                row.append(position)
+            samples.append(row)
+            weights.append(count * self.interval)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": self.label or self.id,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": self.duration,
+                "samples": samples,
+                "weights": weights,
+            }],
+            "name": self.label or self.id,
+            "exporter": "healthguard-profiler",
+        }
+
+    def summary(self, top: int = 25) -> Dict[str, Any]:
+        """Sample counts plus the functions with the most self and total samples"""
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for frame in set(stack):
+                total[frame] += count
+
+        def ranked(counter: Counter):
+            return [
+                {"function": self._frame_name(frame), "samples": count,
+                 "percent": round(count / self.samples * 100, 2) if self.samples else 0.0}
+                for frame, count in counter.most_common(top)
+            ]
+
+        return {
+            "id": self.id,
+            "label": self.label,
+            "started_at": self.started_at,
+            "duration_seconds": round(self.duration, 3),
+            "interval_seconds": self.interval,
+            "samples": self.samples,
+            "self": ranked(own),
+            "total": ranked(total),
+        }
+
+
+class StackSampler:
+    """Background thread sampling Python stacks at a fixed interval"""
+
+    def __init__(self, profile: Profile, thread_ids: Optional[List[int]] = None,
+                 loop: Optional[asyncio.AbstractEventLoop] = None,
+                 task: Optional[asyncio.Task] = None, max_depth: int = PROFILER_MAX_DEPTH):
+        self.profile = profile
+        self.thread_ids = set(thread_ids) if thread_ids else None
+        self.loop = loop
+        # The request's task tree; further tasks are added by the task factory
+        self.tasks: Optional[weakref.WeakSet] = None
+        if task is not None:
+            self.tasks = weakref.WeakSet([task])
+        self.context_token: Optional[contextvars.Token] = None
+        self.max_depth = max_depth
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started = 0.0
+
+    def _collect(self, frame, thread_name: Optional[str]) -> Tuple[FrameKey, ...]:
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            stack.append(_frame_key(frame.f_code))
+            frame = frame.f_back
+        if thread_name is not None:
+            stack.append((f"thread:{thread_name}", "", 0))
+        stack.reverse()
+        return tuple(stack)
+
+    def sample(self):
+        """Take one sample of the watched threads"""
+        if self.tasks is not None and asyncio.current_task(self.loop) not in self.tasks:
+            # The loop is running some other request's code right now
+            return
+        own = threading.get_ident()
+        names = None if self.thread_ids else {t.ident: t.name for t in threading.enumerate()}
+        stacks = self.profile.stacks
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            if self.thread_ids is not None and thread_id not in self.thread_ids:
+                continue
+            thread_name = names.get(thread_id, str(thread_id)) if names is not None else None
+            stacks[self._collect(frame, thread_name)] += 1
+        self.profile.samples += 1
+
+    def _run(self):
+        interval = self.profile.interval
+        while not self._stop.wait(interval):
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Profiler sample failed: {e}")
+                return
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Profile:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.profile.duration = time.perf_counter() - self._started
+        return self.profile
+
+
+class ProfileStore:
+    """Most recent per-request profiles, bounded by PROFILE_STORE_SIZE"""
+
+    def __init__(self, size: int = PROFILE_STORE_SIZE):
+        self.size = size
+        self.profiles: "OrderedDict[str, Profile]" = OrderedDict()
+
+    def add(self, profile: Profile):
+        self.profiles[profile.id] = profile
+        while len(self.profiles) > self.size:
+            self.profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[Profile]:
+        return self.profiles.get(profile_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        return [
+            {"id": p.id, "label": p.label, "samples": p.samples, "duration_seconds": round(p.duration, 3)}
+            for p in reversed(self.profiles.values())
+        ]
+
+
+class SamplingProfiler:
+    """Runs time-boxed sessions on this worker, one on-demand session at a time"""
+
+    def __init__(self):
+        self.store = ProfileStore()
+        self._session_lock = asyncio.Lock()
+        self._request_sessions = 0
+        self._previous_factory = None
+
+    @property
+    def busy(self) -> bool:
+        return self._session_lock.locked()
+
+    async def profile_for(self, duration: float, interval: float = PROFILER_DEFAULT_INTERVAL,
+                          all_threads: bool = False) -> Profile:
+        """Sample the event loop thread (or every thread) for `duration` seconds"""
+        duration = min(max(duration, 0.1), PROFILER_MAX_DURATION)
+        interval = max(interval, PROFILER_MIN_INTERVAL)
+        async with self._session_lock:
+            profile = Profile(uuid.uuid4().hex[:12], interval, label=f"worker {os.getpid()}")
+            threads = None if all_threads else [threading.get_ident()]
+            sampler = StackSampler(profile, thread_ids=threads)
+            sampler.start()
+            try:
+                await asyncio.sleep(duration)
+            finally:
+                await asyncio.to_thread(sampler.stop)
+            return profile
+
+    def _task_factory(self, loop, coro, context=None):
+        """Create tasks as usual, tagging those spawned inside a profiled request"""
+        if self._previous_factory is not None:
+            if context is None:
+                task = self._previous_factory(loop, coro)
+            else:
+                task = self._previous_factory(loop, coro, context=context)
+        else:
+            task = asyncio.Task(coro, loop=loop, context=context)
+        sampler = _request_sampler.get() if context is None else context.get(_request_sampler)
+        if sampler is not None and sampler.tasks is not None:
+            sampler.tasks.add(task)
+        return task
+
+    def begin_request(self, label: str) -> Optional[StackSampler]:
+        """Start sampling the current task and its children; None when the concurrency cap is reached
+
+        Must be paired with an awaited end_request from the same task, which
+        resets the request marker.
+        """
+        if self._request_sessions >= PROFILE_MAX_CONCURRENT:
+            return None
+        loop = asyncio.get_running_loop()
+        if self._request_sessions == 0 and loop.get_task_factory() != self._task_factory:
+            self._previous_factory = loop.get_task_factory()
+            loop.set_task_factory(self._task_factory)
+        self._request_sessions += 1
+        profile = Profile(uuid.uuid4().hex[:12], PROFILER_MIN_INTERVAL, label=label)
+        sampler = StackSampler(
+            profile, thread_ids=[threading.get_ident()], loop=loop, task=asyncio.current_task(),
+        )
+        sampler.context_token = _request_sampler.set(sampler)
+        sampler.start()
+        return sampler
+
+    async def end_request(self, sampler: StackSampler):
+        _request_sampler.reset(sampler.context_token)
+        self._request_sessions -= 1
+        if self._request_sessions == 0:
+            loop = asyncio.get_running_loop()
+            if loop.get_task_factory() == self._task_factory:
+                loop.set_task_factory(self._previous_factory)
+            self._previous_factory = None
+        # Joining the sampler thread can take up to one interval; keep it off the loop
+        self.store.add(await asyncio.to_thread(sampler.stop))
+
+
+def _profiling_allowed(headers: Dict[bytes, bytes]) -> bool:
+    """Only tokens whose role is in PROFILE_ROLES may profile a request"""
+    authorization = headers.get(b"authorization", b"").decode("latin-1")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    try:
+        from app.core.auth import verify_token
+
+        payload = verify_token(token)
+    except Exception:
+        return False
+    return payload.get("type") == "access" and payload.get("role") in PROFILE_ROLES
+
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware profiling requests that opt in with the X-Profile header"""
+
+    def __init__(self, app, profiler: SamplingProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        # Idle cost: one scan of the raw header list
+        if not any(name == PROFILE_HEADER for name, _ in scope["headers"]):
+            await self.app(scope, receive, send)
+            return
+        if not _profiling_allowed(dict(scope["headers"])):
+            await self.app(scope, receive, send)
+            return
+
+        sampler = self.profiler.begin_request(f"{scope['method']} {scope['path']}")
+        if sampler is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = sampler.profile.id.encode()
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-profile-id", profile_id)]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            await self.profiler.end_request(sampler)
+
+
+# Global profiler
+profiler = SamplingProfiler()
@@ -0,0 +1,357 @@
+"""
+Topic Pub/Sub Hub
+One registry for every WebSocket connection, addressed by hierarchical topics
+
+Topics are slash-separated paths such as `tenant/{id}/camera/{id}`,
+`user/{id}` or `app/{name}`. Server code may also subscribe connections to
+patterns where `+` matches one segment and a trailing `#` matches the topic
+itself and everything below it (`tenant/t1/#`, `tenant/+/camera/cam-1`).
+
+Ids are often client-controlled, so the topic builders escape `/`, `+`,
+`#` and `%` inside a segment (and a segment that is exactly `_`, see
+event_topic); `subscribe` only accepts concrete topics, and wildcards go
+through `subscribe_pattern`. A client sending `userId: "+"` therefore gets
+`user/%2B`, not every user's topic.
+
+Subscriptions are kept in a segment trie, so computing the recipients of a
+publish walks at most one path per wildcard branch instead of scanning every
+connection. The message is encoded once and queued on each recipient's
+OutboundConnection; a connection subscribed through several matching
+patterns still receives one copy.
+
+The legacy managers (core.websocket, core.realtime, services.websocket_service
+and the endpoint-local registries) are thin facades over the global `hub`,
+distinguished by the connection's `scope`. With several workers, the event
+bus (app.core.event_bus) carries publishes between their hubs.
+"""
+
+import time
+import uuid
+import logging
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set, Union
+
+from app.core.ws_outbound import OutboundConnection, encode_message
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TENANT = "default"
+BROADCAST_TOPIC = "broadcast"
+ANY_SEGMENT = "_"  # event topic segment meaning "not restricted"
+
+WILDCARDS = ("+", "#")
+
+Topics = Union[str, Iterable[str]]
+
+_SEGMENT_ESCAPES = str.maketrans({"%": "%25", "/": "%2F", "+": "%2B", "#": "%23"})
+
+
+def topic_segment(value: Any) -> str:
+    """Escape an id for use as exactly one literal topic segment"""
+    segment = str(value).translate(_SEGMENT_ESCAPES)
+    return "%5F" if segment == ANY_SEGMENT else segment
+
+
+def is_pattern(topic: str) -> bool:
+    return any(segment in WILDCARDS for segment in topic.split("/"))
+
+
+def user_topic(user_id: str) -> str:
+    return f"user/{topic_segment(user_id)}"
+
+
+def client_topic(client_id: str) -> str:
+    return f"client/{topic_segment(client_id)}"
+
+
+def tenant_topic(tenant_id: Optional[str]) -> str:
+    return f"tenant/{topic_segment(tenant_id or DEFAULT_TENANT)}"
+
+
+def camera_topic(camera_id: str, tenant_id: Optional[str] = None) -> str:
+    return f"{tenant_topic(tenant_id)}/camera/{topic_segment(camera_id)}"
+
+
+def app_topic(app_name: str) -> str:
+    return f"app/{topic_segment(app_name)}"
+
+
+def role_topic(role: str) -> str:
+    return f"role/{topic_segment(role)}"
+
+
+def event_topic(event_type: str, tenant_id: Optional[str] = None, role: Optional[str] = None) -> str:
+    """`events/{type}/{tenant}/{role}`, with `_` for an unrestricted dimension"""
+    tenant = topic_segment(tenant_id) if tenant_id else ANY_SEGMENT
+    role = topic_segment(role) if role else ANY_SEGMENT
+    return f"events/{topic_segment(event_type)}/{tenant}/{role}"
+
+
+class _TopicNode:
+    __slots__ = ("children", "subscribers")
+
+    def __init__(self):
+        self.children: Dict[str, "_TopicNode"] = {}
+        self.subscribers: Set[str] = set()
+
+
+class TopicIndex:
+    """Segment trie from subscription patterns to connection ids"""
+
+    def __init__(self):
+        self.root = _TopicNode()
+        self.patterns = 0
+
+    def add(self, pattern: str, connection_id: str):
+        node = self.root
+        for segment in pattern.split("/"):
+            child = node.children.get(segment)
+            if child is None:
+                child = node.children[segment] = _TopicNode()
+            node = child
+        if connection_id not in node.subscribers:
+            if not node.subscribers:
+                self.patterns += 1
+            node.subscribers.add(connection_id)
+
+    def remove(self, pattern: str, connection_id: str):
+        path = [self.root]
+        segments = pattern.split("/")
+        for segment in segments:
+            node = path[-1].children.get(segment)
+            if node is None:
+                return
+            path.append(node)
+        node = path[-1]
+        if connection_id not in node.subscribers:
+            return
+        node.subscribers.discard(connection_id)
+        if not node.subscribers:
+            self.patterns -= 1
+        # Prune branches left empty
+        for depth in range(len(segments), 0, -1):
+            node = path[depth]
+            if node.subscribers or node.children:
+                break
+            del path[depth - 1].children[segments[depth - 1]]
+
+    def subscribers(self, pattern: str) -> Set[str]:
+        """Connections subscribed to exactly this pattern"""
+        node = self.root
+        for segment in pattern.split("/"):
+            node = node.children.get(segment)
+            if node is None:
+                return set()
+        return set(node.subscribers)
+
+    def match(self, topic: str, into: Optional[Set[str]] = None) -> Set[str]:
+        """Connection ids whose patterns match a concrete topic"""
+        result = set() if into is None else into
+        frontier = [self.root]
+        for segment in topic.split("/"):
+            next_frontier = []
+            for node in frontier:
+                children = node.children
+                rest = children.get("#")
+                if rest is not None:
+                    result |= rest.subscribers
+                child = children.get(segment)
+                if child is not None:
+                    next_frontier.append(child)
+                child = children.get("+")
+                if child is not None:
+                    next_frontier.append(child)
+            if not next_frontier:
+                return result
+            frontier = next_frontier
+        for node in frontier:
+            result |= node.subscribers
+            rest = node.children.get("#")
+            if rest is not None:
+                result |= rest.subscribers
+        return result
+
+
+class Subscriber:
+    """One WebSocket connection registered with the hub"""
+
+    __slots__ = ("connection_id", "websocket", "outbound", "scope", "user_id", "tenant_id",
+                 "role", "client_id", "topics", "connected_at", "info")
+
+    def __init__(self, connection_id: str, websocket, outbound: OutboundConnection, scope: str,
+                 user_id: Optional[str] = None, tenant_id: Optional[str] = None,
+                 role: Optional[str] = None, client_id: Optional[str] = None):
+        self.connection_id = connection_id
+        self.websocket = websocket
+        self.outbound = outbound
+        self.scope = scope
+        self.user_id = user_id
+        self.tenant_id = tenant_id
+        self.role = role
+        self.client_id = client_id
+        self.topics: Set[str] = set()
+        self.connected_at = time.time()
+        self.info: Dict[str, Any] = {}
+
+
+class PubSubHub:
+    """Registry of WebSocket connections with topic subscriptions and fan-out"""
+
+    def __init__(self):
+        self.connections: Dict[str, Subscriber] = {}
+        self.index = TopicIndex()
+        self._by_socket: Dict[int, str] = {}
+        self.published = 0
+        self.bus = None  # EventBus, attached by event_bus.start() for cross-worker fan-out
+
+    async def connect(self, websocket, scope: str = "default", user_id: Optional[str] = None,
+                      tenant_id: Optional[str] = None, role: Optional[str] = None,
+                      client_id: Optional[str] = None, topics: Iterable[str] = (),
+                      patterns: Iterable[str] = (), connection_id: Optional[str] = None,
+                      accept: bool = True) -> Subscriber:
+        """Accept a socket, start its writer and subscribe it to `topics` and wildcard `patterns`"""
+        if accept:
+            await websocket.accept()
+        connection_id = connection_id or f"{scope}_{uuid.uuid4().hex[:16]}"
+        outbound = OutboundConnection(websocket, connection_id, on_close=self.disconnect)
+        subscriber = Subscriber(connection_id, websocket, outbound, scope, user_id=user_id,
+                                tenant_id=tenant_id, role=role, client_id=client_id)
+        self.connections[connection_id] = subscriber
+        self._by_socket[id(websocket)] = connection_id
+        for topic in topics:
+            self.subscribe(connection_id, topic)
+        for pattern in patterns:
+            self.subscribe_pattern(connection_id, pattern)
+        return subscriber
+
+    def disconnect(self, connection_id: str) -> Optional[Subscriber]:
+        """Drop a connection and all of its subscriptions; safe to call twice"""
+        subscriber = self.connections.pop(connection_id, None)
+        if subscriber is None:
+            return None
+        self._by_socket.pop(id(subscriber.websocket), None)
+        for pattern in subscriber.topics:
+            self.index.remove(pattern, connection_id)
+        subscriber.topics.clear()
+        subscriber.outbound.close()
+        return subscriber
+
+    def connection_for(self, websocket) -> Optional[Subscriber]:
+        connection_id = self._by_socket.get(id(websocket))
+        return self.connections.get(connection_id) if connection_id else None
+
+    def disconnect_socket(self, websocket) -> Optional[Subscriber]:
+        subscriber = self.connection_for(websocket)
+        return self.disconnect(subscriber.connection_id) if subscriber else None
+
+    def subscribe(self, connection_id: str, topic: str) -> bool:
+        """Subscribe to one concrete topic; wildcard segments are rejected"""
+        if is_pattern(topic):
+            raise ValueError(f"Wildcard topic {topic!r} needs subscribe_pattern")
+        return self.subscribe_pattern(connection_id, topic)
+
+    def subscribe_pattern(self, connection_id: str, pattern: str) -> bool:
+        """Subscribe to a `+`/`#` pattern; only for patterns built by server code"""
+        subscriber = self.connections.get(connection_id)
+        if subscriber is None:
+            return False
+        if pattern not in subscriber.topics:
+            subscriber.topics.add(pattern)
+            self.index.add(pattern, connection_id)
+        return True
+
+    def unsubscribe(self, connection_id: str, pattern: str) -> bool:
+        subscriber = self.connections.get(connection_id)
+        if subscriber is None or pattern not in subscriber.topics:
+            return False
+        subscriber.topics.discard(pattern)
+        self.index.remove(pattern, connection_id)
+        return True
+
+    def recipients(self, topics: Topics) -> Set[str]:
+        """Connection ids subscribed to any of the topics (each counted once)"""
+        if isinstance(topics, str):
+            return self.index.match(topics)
+        result: Set[str] = set()
+        for topic in topics:
+            self.index.match(topic, result)
+        return result
+
+    def _deliver(self, connection_ids: Iterable[str], payload: str, coalesce_key: Optional[str] = None,
+                 exclude: Optional[str] = None) -> int:
+        delivered = 0
+        connections = self.connections
+        for connection_id in connection_ids:
+            if connection_id == exclude:
+                continue
+            subscriber = connections.get(connection_id)
+            if subscriber is not None and subscriber.outbound.offer(payload, coalesce_key):
+                delivered += 1
+        return delivered
+
+    def deliver(self, topics: Topics, payload: str, coalesce_key: Optional[str] = None,
+                exclude: Optional[str] = None) -> int:
+        """Queue an encoded payload on every matching local connection"""
+        recipients = self.recipients(topics)
+        if not recipients:
+            return 0
+        return self._deliver(recipients, payload, coalesce_key, exclude)
+
+    def publish_local(self, topics: Topics, message: Any, coalesce_key: Optional[str] = None,
+                      exclude: Optional[str] = None) -> int:
+        """Encode once and queue on every matching connection in this worker only"""
+        self.published += 1
+        recipients = self.recipients(topics)
+        if not recipients:
+            return 0
+        return self._deliver(recipients, encode_message(message), coalesce_key, exclude)
+
+    async def publish(self, topics: Topics, message: Any, coalesce_key: Optional[str] = None,
+                      exclude: Optional[str] = None) -> int:
+        """Publish a message on one or more topics
+
+        Delivered to this worker's subscribers right away and, when an event
+        bus is attached, handed to it for the other workers. Returns the
+        number of local connections reached.
+        """
+        if self.bus is None:
+            return self.publish_local(topics, message, coalesce_key, exclude)
+        self.published += 1
+        payload = encode_message(message)
+        self.bus.publish(topics, payload, coalesce_key)
+        return self.deliver(topics, payload, coalesce_key, exclude)
+
+    def send(self, connection_id: str, message: Any, coalesce_key: Optional[str] = None) -> bool:
+        """Queue a message for a single connection"""
+        return self._deliver((connection_id,), encode_message(message), coalesce_key) == 1
+
+    def connections_in(self, scope: Optional[str] = None) -> List[Subscriber]:
+        return [s for s in list(self.connections.values()) if scope is None or s.scope == scope]
+
+    def count(self, scope: Optional[str] = None) -> int:
+        if scope is None:
+            return len(self.connections)
+        return sum(1 for s in list(self.connections.values()) if s.scope == scope)
+
+    def subscriber_count(self, pattern: str) -> int:
+        """Connections subscribed to exactly this pattern"""
+        return len(self.index.subscribers(pattern))
+
+    def stats(self) -> Dict[str, Any]:
+        by_scope: Counter = Counter()
+        outbound = {"queued": 0, "sent": 0, "dropped": 0, "coalesced": 0}
+        for subscriber in list(self.connections.values()):
+            by_scope[subscriber.scope] += 1
+            for key, value in subscriber.outbound.stats().items():
+                outbound[key] += value
+        return {
+            "connections": len(self.connections),
+            "connections_by_scope": dict(by_scope),
+            "subscription_patterns": self.index.patterns,
+            "published": self.published,
+            "outbound": outbound,
+        }
+
+
+# Global pub/sub hub
+hub = PubSubHub()
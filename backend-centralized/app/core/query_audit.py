@@ -0,0 +1,304 @@
+"""
+Query Auditing
+Slow-query log and N+1 detection for SQLAlchemy engines
+
+QueryAuditor hooks cursor execution on each engine. Statements slower than
+DB_SLOW_QUERY_MS are logged with their normalized template and the *shape*
+of their bound parameters (types and counts, never values, since rows here
+hold patient and billing data).
+
+Within an audit scope (one per HTTP request via QueryAuditMiddleware, or
+opened explicitly with `query_auditor.scope(name)` for jobs), executions are
+counted per statement template. A template executed DB_N_PLUS_ONE_THRESHOLD
+or more times in one scope is flagged as a likely N+1: the first call site
+that crossed the threshold is captured, the finding is counted in the
+metrics and it is logged at debug level, or as a warning when
+DB_QUERY_AUDIT_WARN=true.
+
+With the asyncio engines, cursor events run inside SQLAlchemy's greenlet,
+whose own stack holds only SQLAlchemy frames; the call site is taken from
+the suspended parent greenlet, i.e. the coroutine chain that awaited the
+query.
+"""
+
+import os
+import re
+import time
+import logging
+import functools
+import threading
+import traceback
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import event
+
+try:
+    import greenlet
+
+    GREENLET_AVAILABLE = True
+except ImportError:
+    GREENLET_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DB_QUERY_AUDIT = os.getenv("DB_QUERY_AUDIT", "true").lower() == "true"
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+DB_N_PLUS_ONE_THRESHOLD = int(os.getenv("DB_N_PLUS_ONE_THRESHOLD", "10"))
+DB_QUERY_AUDIT_WARN = os.getenv("DB_QUERY_AUDIT_WARN", "false").lower() == "true"
+QUERY_AUDIT_HISTORY = 100
+QUERY_AUDIT_MAX_TEMPLATES = 1000
+TEMPLATE_MAX_LENGTH = 500
+
+_WHITESPACE = re.compile(r"\s+")
+# Expanded IN lists / VALUES rows: "?, ?, ?" or "%(id_1)s, %(id_2)s" -> "?, ..."
+_PLACEHOLDER_RUN = re.compile(r"(?:\?|%\(\w+\)s|\$\d+|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|\$\d+|:\w+))+")
+_NUMBER = re.compile(r"(?<![$\w])\d+\b")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+
+# Call-site frames from these paths are skipped when locating an N+1
+_IGNORED_FRAME_PATHS = (
+    f"{os.sep}sqlalchemy{os.sep}",
+    f"{os.sep}starlette{os.sep}",
+    f"{os.sep}fastapi{os.sep}",
+    f"{os.sep}anyio{os.sep}",
+    f"{os.sep}asyncio{os.sep}",
+    f"{os.sep}query_audit.py",
+    f"{os.sep}tracing.py",
+)
+
+
+@functools.lru_cache(maxsize=2048)
+def statement_template(statement: str) -> str:
+    """Normalize a SQL statement so executions differing only in literals match"""
+    template = _WHITESPACE.sub(" ", statement).strip()
+    template = _STRING.sub("?", template)
+    template = _PLACEHOLDER_RUN.sub("?, ...", template)
+    template = _NUMBER.sub("?", template)
+    # Literal IN lists only become placeholder runs once numbers are replaced
+    template = _PLACEHOLDER_RUN.sub("?, ...", template)
+    return template[:TEMPLATE_MAX_LENGTH]
+
+
+def _value_shape(value: Any) -> str:
+    if isinstance(value, (list, tuple, set)):
+        return f"{type(value).__name__}[{len(value)}]"
+    if isinstance(value, (str, bytes)):
+        return f"{type(value).__name__}({len(value)})"
+    return type(value).__name__
+
+
+def parameter_shape(parameters: Any, executemany: bool = False) -> str:
+    """Types (and lengths) of bound parameters, without their values"""
+    if executemany and isinstance(parameters, (list, tuple)):
+        first = parameter_shape(parameters[0]) if parameters else "()"
+        return f"{len(parameters)} x {first}"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{key}: {_value_shape(value)}" for key, value in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        return "(" + ", ".join(_value_shape(value) for value in parameters) + ")"
+    return _value_shape(parameters)
+
+
+def _call_site() -> List[str]:
+    """Application frames leading to the current query, innermost last"""
+    stack = traceback.extract_stack()[:-2]
+    if GREENLET_AVAILABLE:
+        # Inside greenlet_spawn: prepend the stacks of the greenlets waiting on this one
+        parent = greenlet.getcurrent().parent
+        while parent is not None:
+            if parent.gr_frame is not None:
+                stack = traceback.extract_stack(parent.gr_frame) + stack
+            parent = parent.parent
+    frames = [
+        frame for frame in stack
+        if not any(part in frame.filename for part in _IGNORED_FRAME_PATHS)
+    ]
+    return [f"{frame.filename}:{frame.lineno} in {frame.name}" for frame in frames[-6:]]
+
+
+class QueryScope:
+    """Statement counts for one request or job"""
+
+    __slots__ = ("name", "counts", "durations", "sites", "queries", "total_time", "truncated")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.counts: Counter = Counter()
+        self.durations: Dict[str, float] = {}
+        self.sites: Dict[str, List[str]] = {}
+        self.queries = 0
+        self.total_time = 0.0
+        self.truncated = False
+
+
+class QueryAuditor:
+    """Attaches query hooks to engines and aggregates slow-query and N+1 findings"""
+
+    def __init__(self, enabled: bool = DB_QUERY_AUDIT, slow_ms: float = DB_SLOW_QUERY_MS,
+                 n_plus_one_threshold: int = DB_N_PLUS_ONE_THRESHOLD, warn: bool = DB_QUERY_AUDIT_WARN):
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.warn = warn
+        self.queries = 0
+        self.slow_queries = 0
+        self.n_plus_one_total = 0
+        self.n_plus_one_by_scope: Counter = Counter()
+        self.recent_slow: deque = deque(maxlen=QUERY_AUDIT_HISTORY)
+        self.recent_n_plus_one: deque = deque(maxlen=QUERY_AUDIT_HISTORY)
+        self.lock = threading.Lock()
+        self._scope: ContextVar[Optional[QueryScope]] = ContextVar("query_scope", default=None)
+
+    def attach(self, engine, name: str):
+        """Install cursor hooks on a (sync) engine; idempotent"""
+        if not self.enabled or getattr(engine, "_query_audit_attached", False):
+            return
+        engine._query_audit_attached = True
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("query_audit_started", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            started = conn.info.get("query_audit_started")
+            if started:
+                self._record(name, statement, parameters, executemany, time.perf_counter() - started.pop())
+
+        @event.listens_for(engine, "handle_error")
+        def handle_error(exception_context):
+            conn = exception_context.connection
+            started = conn.info.get("query_audit_started") if conn is not None else None
+            if started:
+                started.pop()
+
+    def _record(self, engine_name: str, statement: str, parameters: Any, executemany: bool, elapsed: float):
+        self.queries += 1
+        scope = self._scope.get()
+        template = None
+
+        if scope is not None:
+            template = statement_template(statement)
+            counts = scope.counts
+            if template not in counts and len(counts) >= QUERY_AUDIT_MAX_TEMPLATES:
+                scope.truncated = True
+            else:
+                counts[template] += 1
+                scope.durations[template] = scope.durations.get(template, 0.0) + elapsed
+                if counts[template] == self.n_plus_one_threshold:
+                    # Stack is only captured once per template per scope
+                    scope.sites[template] = _call_site()
+            scope.queries += 1
+            scope.total_time += elapsed
+
+        elapsed_ms = elapsed * 1000
+        if elapsed_ms >= self.slow_ms:
+            template = template or statement_template(statement)
+            shape = parameter_shape(parameters, executemany)
+            with self.lock:
+                self.slow_queries += 1
+                self.recent_slow.append({
+                    "engine": engine_name,
+                    "scope": scope.name if scope is not None else None,
+                    "duration_ms": round(elapsed_ms, 3),
+                    "template": template,
+                    "parameters": shape,
+                    "at": time.time(),
+                })
+            logger.warning(
+                f"Slow query on '{engine_name}' ({elapsed_ms:.1f}ms"
+                f"{', ' + scope.name if scope is not None else ''}): {template} params={shape}"
+            )
+
+    @contextmanager
+    def scope(self, name: str) -> Iterator[Optional[QueryScope]]:
+        """Count statements executed in this block and report N+1 patterns on exit"""
+        if not self.enabled:
+            yield None
+            return
+        scope = QueryScope(name)
+        token = self._scope.set(scope)
+        try:
+            yield scope
+        finally:
+            self._scope.reset(token)
+            self.finish_scope(scope)
+
+    def finish_scope(self, scope: QueryScope):
+        findings = [
+            (template, count) for template, count in scope.counts.items()
+            if count >= self.n_plus_one_threshold
+        ]
+        if not findings:
+            return
+
+        with self.lock:
+            for template, count in findings:
+                self.n_plus_one_total += 1
+                self.n_plus_one_by_scope[scope.name] += 1
+                self.recent_n_plus_one.append({
+                    "scope": scope.name,
+                    "template": template,
+                    "executions": count,
+                    "total_ms": round(scope.durations.get(template, 0.0) * 1000, 3),
+                    "call_site": scope.sites.get(template, []),
+                    "at": time.time(),
+                })
+        log = logger.warning if self.warn else logger.debug
+        if self.warn or logger.isEnabledFor(logging.DEBUG):
+            for template, count in findings:
+                site = scope.sites.get(template) or ["<unknown>"]
+                log(
+                    f"Possible N+1 in {scope.name}: statement ran {count}x "
+                    f"({scope.durations.get(template, 0.0) * 1000:.1f}ms total) from {site[-1]}: {template}"
+                )
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters plus the most recent slow queries and N+1 findings"""
+        with self.lock:
+            return {
+                "enabled": self.enabled,
+                "slow_query_threshold_ms": self.slow_ms,
+                "n_plus_one_threshold": self.n_plus_one_threshold,
+                "queries": self.queries,
+                "slow_queries": self.slow_queries,
+                "n_plus_one": self.n_plus_one_total,
+                "n_plus_one_by_scope": dict(self.n_plus_one_by_scope.most_common(50)),
+                "recent_slow_queries": list(reversed(self.recent_slow)),
+                "recent_n_plus_one": list(reversed(self.recent_n_plus_one)),
+            }
+
+
+def _scope_name(scope) -> str:
+    route = getattr(scope.get("route"), "path", None)
+    return f"{scope['method']} {route or scope['path']}"
+
+
+class QueryAuditMiddleware:
+    """Pure ASGI middleware opening one query audit scope per HTTP request"""
+
+    def __init__(self, app, auditor: QueryAuditor):
+        self.app = app
+        self.auditor = auditor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.auditor.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        audit = QueryScope(f"{scope['method']} {scope['path']}")
+        token = self.auditor._scope.set(audit)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.auditor._scope.reset(token)
+            # Route template is only known once routing has run
+            audit.name = _scope_name(scope)
+            self.auditor.finish_scope(audit)
+
+
+# Global query auditor
+query_auditor = QueryAuditor()
@@ -6,11 +6,14 @@ Handles WebSocket connections and real-time updates across all applications
 import asyncio
 import json
 import logging
-from typing import Dict, List, Set, Any, Optional
+from typing import Dict, Iterable, List, Set, Any, Optional
 from datetime import datetime
 from fastapi import WebSocket, WebSocketDisconnect
 from enum import Enum
 
+from app.core.event_history import REALTIME_HISTORY_FILE, REALTIME_HISTORY_SIZE, EventRing
+from app.core.pubsub import BROADCAST_TOPIC, PubSubHub, app_topic, camera_topic, hub, user_topic
+
 logger = logging.getLogger(__name__)
 
 class EventType(Enum):
@@ -29,27 +32,47 @@ class EventType(Enum):
     USER_ACTIVITY = "user_activity"
 
 class RealtimeManager:
-    """Manages WebSocket connections and real-time event broadcasting"""
+    """Manages WebSocket connections and real-time event broadcasting
+    
+    A facade over the pub/sub hub: each connection (scope "realtime") is
+    subscribed to its app topic, its user topic and the realtime broadcast
+    topic, so targeted events only touch the matching subscribers.
+    
+    Events carry a `seq` and the `epoch` of this worker's history ring; a
+    reconnecting client can fetch what it missed with
+    get_event_history(since=seq, epoch=epoch).
+    """
+    
+    scope = "realtime"
+    broadcast_topic = f"{BROADCAST_TOPIC}/realtime"
     
-    def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
-        self.user_subscriptions: Dict[str, Set[str]] = {}
-        self.event_history: List[Dict[str, Any]] = []
-        self.max_history = 1000
+    def __init__(self, pubsub: Optional[PubSubHub] = None):
+        self.hub = pubsub or hub
+        self.event_history = EventRing(REALTIME_HISTORY_SIZE, path=REALTIME_HISTORY_FILE)
+    
+    @property
+    def active_connections(self) -> Dict[str, List[WebSocket]]:
+        """app_name -> connected sockets"""
+        apps: Dict[str, List[WebSocket]] = {}
+        for subscriber in self.hub.connections_in(self.scope):
+            apps.setdefault(subscriber.info.get("app"), []).append(subscriber.websocket)
+        return apps
+    
+    @property
+    def user_subscriptions(self) -> Dict[str, Set[str]]:
+        """user_id -> apps the user is connected to"""
+        users: Dict[str, Set[str]] = {}
+        for subscriber in self.hub.connections_in(self.scope):
+            users.setdefault(subscriber.user_id, set()).add(subscriber.info.get("app"))
+        return users
         
     async def connect(self, websocket: WebSocket, user_id: str, app_name: str):
         """Connect a new WebSocket client"""
-        await websocket.accept()
-        
-        if app_name not in self.active_connections:
-            self.active_connections[app_name] = []
-        
-        self.active_connections[app_name].append(websocket)
-        
-        if user_id not in self.user_subscriptions:
-            self.user_subscriptions[user_id] = set()
-        
-        self.user_subscriptions[user_id].add(app_name)
+        subscriber = await self.hub.connect(
+            websocket, scope=self.scope, user_id=user_id,
+            topics=(app_topic(app_name), user_topic(user_id), self.broadcast_topic),
+        )
+        subscriber.info["app"] = app_name
         
         logger.info(f"User {user_id} connected to {app_name}")
         
@@ -63,53 +86,33 @@ class RealtimeManager:
     
     def disconnect(self, websocket: WebSocket, user_id: str, app_name: str):
         """Disconnect a WebSocket client"""
-        if app_name in self.active_connections:
-            self.active_connections[app_name].remove(websocket)
-            if not self.active_connections[app_name]:
-                del self.active_connections[app_name]
-        
-        if user_id in self.user_subscriptions:
-            self.user_subscriptions[user_id].discard(app_name)
-            if not self.user_subscriptions[user_id]:
-                del self.user_subscriptions[user_id]
-        
+        self.hub.disconnect_socket(websocket)
         logger.info(f"User {user_id} disconnected from {app_name}")
     
     async def send_personal_message(self, message: Dict[str, Any], websocket: WebSocket):
         """Send a message to a specific WebSocket connection"""
-        try:
-            await websocket.send_text(json.dumps(message))
-        except Exception as e:
-            logger.error(f"Error sending personal message: {e}")
+        subscriber = self.hub.connection_for(websocket)
+        if subscriber is None:
+            logger.error("Error sending personal message: socket is not connected")
+            return
+        self.hub.send(subscriber.connection_id, message)
     
     async def broadcast_to_app(self, app_name: str, message: Dict[str, Any]):
         """Broadcast a message to all connections of a specific app"""
-        if app_name not in self.active_connections:
-            return
-        
-        disconnected = []
-        for connection in self.active_connections[app_name]:
-            try:
-                await connection.send_text(json.dumps(message))
-            except Exception as e:
-                logger.error(f"Error broadcasting to {app_name}: {e}")
-                disconnected.append(connection)
-        
-        # Remove disconnected connections
-        for connection in disconnected:
-            self.active_connections[app_name].remove(connection)
+        await self.hub.publish(app_topic(app_name), message)
     
     async def broadcast_to_user(self, user_id: str, message: Dict[str, Any]):
         """Broadcast a message to all connections of a specific user"""
-        if user_id not in self.user_subscriptions:
-            return
-        
-        for app_name in self.user_subscriptions[user_id]:
-            await self.broadcast_to_app(app_name, message)
+        await self.hub.publish(user_topic(user_id), message)
     
     async def broadcast_event(self, event_type: EventType, data: Dict[str, Any], 
-                            target_app: Optional[str] = None, target_user: Optional[str] = None):
-        """Broadcast an event to relevant connections"""
+                            target_app: Optional[str] = None, target_user: Optional[str] = None,
+                            topics: Iterable[str] = ()):
+        """Broadcast an event to relevant connections
+        
+        `topics` adds further hub topics (e.g. a camera topic); a connection
+        matching several targets still receives the event once.
+        """
         event = {
             "type": "event",
             "event_type": event_type.value,
@@ -117,20 +120,20 @@ class RealtimeManager:
             "timestamp": datetime.now().isoformat()
         }
         
-        # Add to event history
-        self.event_history.append(event)
-        if len(self.event_history) > self.max_history:
-            self.event_history.pop(0)
+        # Add to event history; the seq and epoch go out with the event for resuming
+        event["epoch"] = self.event_history.epoch
+        event["seq"] = self.event_history.append(event)
         
         # Broadcast based on target
         if target_user:
-            await self.broadcast_to_user(target_user, event)
+            targets = [user_topic(target_user)]
         elif target_app:
-            await self.broadcast_to_app(target_app, event)
+            targets = [app_topic(target_app)]
         else:
             # Broadcast to all connected apps
-            for app_name in self.active_connections:
-                await self.broadcast_to_app(app_name, event)
+            targets = [self.broadcast_topic]
+        targets.extend(topics)
+        await self.hub.publish(targets, event)
     
     async def send_hipaa_alert(self, violation_type: str, details: Dict[str, Any], 
                              user_id: str, app_name: str):
@@ -174,16 +177,35 @@ class RealtimeManager:
         
         await self.broadcast_event(EventType.USER_ACTIVITY, activity_data)
     
+    def get_event_history(self, since: Optional[int] = None, limit: int = 100,
+                          epoch: Optional[str] = None) -> Dict[str, Any]:
+        """Events after `since` (oldest first), or the latest `limit` when not resuming"""
+        history = self.event_history
+        if since is None:
+            events, truncated = history.latest(limit), False
+        else:
+            entries, truncated = history.entries(since, limit, epoch)
+            events = [event for _, event in entries]
+        return {
+            "events": events,
+            "epoch": history.epoch,
+            "first_seq": history.first_seq,
+            "last_seq": history.last_seq,
+            "truncated": truncated,
+        }
+    
     def get_connection_stats(self) -> Dict[str, Any]:
         """Get connection statistics"""
+        apps = self.active_connections
         stats = {
-            "total_connections": sum(len(connections) for connections in self.active_connections.values()),
-            "apps_connected": list(self.active_connections.keys()),
+            "total_connections": sum(len(connections) for connections in apps.values()),
+            "apps_connected": list(apps.keys()),
             "users_connected": len(self.user_subscriptions),
-            "event_history_count": len(self.event_history)
+            "event_history_count": len(self.event_history),
+            "event_history_last_seq": self.event_history.last_seq
         }
         
-        for app_name, connections in self.active_connections.items():
+        for app_name, connections in apps.items():
             stats[f"{app_name}_connections"] = len(connections)
         
         return stats
@@ -243,7 +265,8 @@ class RealtimeService:
         await realtime_manager.broadcast_event(
             EventType.CAMERA_STATUS_CHANGED,
             camera_data,
-            target_app="surveillance-guard"
+            target_app="surveillance-guard",
+            topics=[camera_topic(camera_data.get("id"))] if camera_data.get("id") else ()
         )
         
         await realtime_manager.send_user_activity(
@@ -263,7 +286,8 @@ class RealtimeService:
         await realtime_manager.broadcast_event(
             EventType.MOTION_DETECTED,
             motion_data,
-            target_app="surveillance-guard"
+            target_app="surveillance-guard",
+            topics=[camera_topic(camera_id)]
         )
         
         await realtime_manager.send_user_activity(
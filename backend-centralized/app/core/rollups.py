@@ -0,0 +1,314 @@
+"""
+Metric Rollups
+Per-minute and per-hour request/error aggregates in fixed-size rings
+
+Each resolution is a ring of slots indexed by `timestamp // resolution`;
+a slot holds request, error and status-class counters, error counts by type
+and a LatencySketch. Memory is constant: 1440 minute slots cover 24h and
+168 hour slots cover 7d. Queries merge at most one ring's worth of slots and
+pick the finest resolution that covers the requested range.
+
+With METRICS_ROLLUP_DB set, slot deltas are flushed to a SQLite file every
+METRICS_ROLLUP_FLUSH_INTERVAL seconds and merged into existing rows, so
+workers sharing the file accumulate into the same history and it survives
+restarts. On startup the rings are reloaded from that file.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.latency import LatencySketch, bucket_index
+
+logger = logging.getLogger(__name__)
+
+METRICS_ROLLUP_DB = os.getenv("METRICS_ROLLUP_DB", "")
+METRICS_ROLLUP_FLUSH_INTERVAL = float(os.getenv("METRICS_ROLLUP_FLUSH_INTERVAL", "60"))  # seconds
+
+# (resolution seconds, slots)
+ROLLUP_RESOLUTIONS: Tuple[Tuple[int, int], ...] = ((60, 1440), (3600, 168))
+ROLLUP_MAX_ERROR_TYPES = 20  # distinct error types kept per slot
+OTHER_ERROR_TYPE = "__other__"
+
+
+class RollupSlot:
+    """Aggregates for one time bucket"""
+
+    __slots__ = ("requests", "client_errors", "server_errors", "errors", "error_types", "latency")
+
+    def __init__(self):
+        self.requests = 0
+        self.client_errors = 0
+        self.server_errors = 0
+        self.errors = 0
+        self.error_types: Counter = Counter()
+        self.latency = LatencySketch()
+
+    def add_error_type(self, error_type: str, n: int = 1):
+        if error_type not in self.error_types and len(self.error_types) >= ROLLUP_MAX_ERROR_TYPES:
+            error_type = OTHER_ERROR_TYPE
+        self.error_types[error_type] += n
+
+    def merge(self, other: "RollupSlot") -> "RollupSlot":
+        self.requests += other.requests
+        self.client_errors += other.client_errors
+        self.server_errors += other.server_errors
+        self.errors += other.errors
+        for error_type, n in other.error_types.items():
+            self.add_error_type(error_type, n)
+        self.latency.merge(other.latency)
+        return self
+
+    def to_state(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "client_errors": self.client_errors,
+            "server_errors": self.server_errors,
+            "errors": self.errors,
+            "error_types": dict(self.error_types),
+            "latency": self.latency.to_state(),
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "RollupSlot":
+        slot = cls()
+        slot.requests = state.get("requests", 0)
+        slot.client_errors = state.get("client_errors", 0)
+        slot.server_errors = state.get("server_errors", 0)
+        slot.errors = state.get("errors", 0)
+        slot.error_types = Counter(state.get("error_types", {}))
+        slot.latency = LatencySketch.from_state(state.get("latency", {}))
+        return slot
+
+    def to_dict(self) -> Dict[str, Any]:
+        latency = self.latency
+        quantiles = latency.quantiles((0.5, 0.95, 0.99))
+        return {
+            "requests": self.requests,
+            "client_errors": self.client_errors,
+            "server_errors": self.server_errors,
+            "errors": self.errors,
+            "error_rate": round(self.server_errors / self.requests * 100, 2) if self.requests else 0.0,
+            "avg_response_time_ms": round(latency.total / latency.count * 1000, 3) if latency.count else 0.0,
+            "p50_ms": round(quantiles[0.5] * 1000, 3),
+            "p95_ms": round(quantiles[0.95] * 1000, 3),
+            "p99_ms": round(quantiles[0.99] * 1000, 3),
+            "error_types": dict(self.error_types.most_common()),
+        }
+
+
+class RollupRing:
+    """Fixed ring of slots at one resolution"""
+
+    def __init__(self, resolution: int, slots: int):
+        self.resolution = resolution
+        self.slot_ids: List[int] = [-1] * slots
+        self.slots: List[Optional[RollupSlot]] = [None] * slots
+
+    @property
+    def span(self) -> int:
+        return self.resolution * len(self.slots)
+
+    def slot(self, slot_id: int) -> RollupSlot:
+        position = slot_id % len(self.slots)
+        slot = self.slots[position]
+        if slot is None or self.slot_ids[position] != slot_id:
+            slot = self.slots[position] = RollupSlot()
+            self.slot_ids[position] = slot_id
+        return slot
+
+    def range(self, start: float, end: float) -> List[Tuple[int, RollupSlot]]:
+        """(slot_id, slot) pairs overlapping [start, end], oldest first"""
+        first = int(start // self.resolution)
+        last = int(end // self.resolution)
+        oldest = last - len(self.slots) + 1
+        return sorted(
+            (slot_id, slot) for slot_id, slot in zip(self.slot_ids, self.slots)
+            if slot is not None and max(first, oldest) <= slot_id <= last
+        )
+
+
+class RollupStore:
+    """Request and error history at minute and hour resolution in constant memory"""
+
+    def __init__(self, resolutions: Tuple[Tuple[int, int], ...] = ROLLUP_RESOLUTIONS,
+                 db_path: str = METRICS_ROLLUP_DB, flush_interval: float = METRICS_ROLLUP_FLUSH_INTERVAL):
+        self.rings = [RollupRing(resolution, slots) for resolution, slots in resolutions]
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        # (resolution, slot_id) -> changes since the last flush
+        self._pending: Dict[Tuple[int, int], RollupSlot] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _slots(self, now: float):
+        for ring in self.rings:
+            slot_id = int(now // ring.resolution)
+            yield ring.slot(slot_id)
+            if self.db_path:
+                key = (ring.resolution, slot_id)
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = RollupSlot()
+                yield pending
+
+    def record_request(self, seconds: float, status_code: int = 200, now: Optional[float] = None,
+                       index: Optional[int] = None):
+        now = time.time() if now is None else now
+        if index is None:
+            index = bucket_index(int(seconds * 1_000_000)) if seconds > 0 else 0
+        with self.lock:
+            for slot in self._slots(now):
+                slot.requests += 1
+                if status_code >= 500:
+                    slot.server_errors += 1
+                elif status_code >= 400:
+                    slot.client_errors += 1
+                slot.latency.add(index, seconds)
+
+    def record_error(self, error_type: str, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        with self.lock:
+            for slot in self._slots(now):
+                slot.errors += 1
+                slot.add_error_type(error_type)
+
+    def _ring_for(self, seconds: float) -> RollupRing:
+        for ring in self.rings:
+            if seconds <= ring.span:
+                return ring
+        return self.rings[-1]
+
+    def query(self, seconds: float, now: Optional[float] = None) -> RollupSlot:
+        """Merged aggregates for the last `seconds` (rounded out to whole slots)"""
+        now = time.time() if now is None else now
+        ring = self._ring_for(seconds)
+        result = RollupSlot()
+        with self.lock:
+            for _, slot in ring.range(now - seconds + 1e-9, now):
+                result.merge(slot)
+        return result
+
+    def timeline(self, seconds: float, now: Optional[float] = None) -> Dict[str, Any]:
+        """Per-slot points for the last `seconds` at the finest covering resolution"""
+        now = time.time() if now is None else now
+        ring = self._ring_for(seconds)
+        with self.lock:
+            points = [
+                {"timestamp": slot_id * ring.resolution, **slot.to_dict()}
+                for slot_id, slot in ring.range(now - seconds + 1e-9, now)
+            ]
+        return {"resolution_seconds": ring.resolution, "points": points}
+
+    # --- Persistence -----------------------------------------------------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS metric_rollups ("
+            "resolution INTEGER NOT NULL, slot_id INTEGER NOT NULL, state TEXT NOT NULL, "
+            "PRIMARY KEY (resolution, slot_id))"
+        )
+        return conn
+
+    def flush(self):
+        """Merge pending slot deltas into the SQLite file (blocking)"""
+        if not self.db_path:
+            return
+        with self.lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                for (resolution, slot_id), delta in pending.items():
+                    row = conn.execute(
+                        "SELECT state FROM metric_rollups WHERE resolution = ? AND slot_id = ?",
+                        (resolution, slot_id),
+                    ).fetchone()
+                    if row is not None:
+                        delta = RollupSlot.from_state(json.loads(row[0])).merge(delta)
+                    conn.execute(
+                        "INSERT OR REPLACE INTO metric_rollups (resolution, slot_id, state) VALUES (?, ?, ?)",
+                        (resolution, slot_id, json.dumps(delta.to_state())),
+                    )
+                now = time.time()
+                for ring in self.rings:
+                    conn.execute(
+                        "DELETE FROM metric_rollups WHERE resolution = ? AND slot_id < ?",
+                        (ring.resolution, int((now - ring.span) // ring.resolution)),
+                    )
+        except Exception as e:
+            logger.error(f"Failed to flush metric rollups to {self.db_path}: {e}")
+            # Put the deltas back so the next flush retries them
+            with self.lock:
+                for key, delta in pending.items():
+                    current = self._pending.get(key)
+                    self._pending[key] = delta if current is None else delta.merge(current)
+        finally:
+            conn.close()
+
+    def load(self, now: Optional[float] = None) -> int:
+        """Fill the rings from the SQLite file; returns the number of slots loaded"""
+        if not self.db_path or not os.path.exists(self.db_path):
+            return 0
+        now = time.time() if now is None else now
+        loaded = 0
+        conn = self._connect()
+        try:
+            for ring in self.rings:
+                oldest = int((now - ring.span) // ring.resolution)
+                rows = conn.execute(
+                    "SELECT slot_id, state FROM metric_rollups WHERE resolution = ? AND slot_id > ?",
+                    (ring.resolution, oldest),
+                ).fetchall()
+                with self.lock:
+                    for slot_id, state in rows:
+                        ring.slot(slot_id).merge(RollupSlot.from_state(json.loads(state)))
+                        loaded += 1
+        except Exception as e:
+            logger.error(f"Failed to load metric rollups from {self.db_path}: {e}")
+        finally:
+            conn.close()
+        return loaded
+
+    async def _run_flusher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await loop.run_in_executor(None, self.flush)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error flushing metric rollups: {e}")
+
+    async def start(self):
+        """Load persisted history and start periodic flushing (no-op without a DB path)"""
+        if not self.db_path:
+            return
+        loaded = await asyncio.get_running_loop().run_in_executor(None, self.load)
+        logger.info(f"Loaded {loaded} metric rollup slots from {self.db_path}")
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._run_flusher())
+
+    async def stop(self):
+        """Stop flushing and write out what is pending"""
+        task, self._flush_task = self._flush_task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self.db_path:
+            await asyncio.get_running_loop().run_in_executor(None, self.flush)
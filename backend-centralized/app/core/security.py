@@ -18,6 +18,7 @@ import jwt
 from fastapi import HTTPException, Depends, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from passlib.context import CryptContext
+from sqlalchemy.orm import Session
 from app.core.database import get_db
 from app.models.user import User
 
@@ -234,6 +235,7 @@ security = HTTPBearer()
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_db),
 ):
     """Get current user from JWT token"""
     try:
@@ -247,7 +249,6 @@ async def get_current_user(
         raise HTTPException(status_code=401, detail="Invalid token")
 
     # Get user from database
-    db = next(get_db())
     user = db.query(User).filter(User.id == user_id).first()
     if user is None:
         raise HTTPException(status_code=401, detail="User not found")
@@ -0,0 +1,452 @@
+"""
+Request Tracing
+Context-var spans linking a request to the DB, cache and outbound work it triggers
+
+TracingMiddleware opens a root span per sampled HTTP request. Child spans
+created anywhere below it (SQL statements, cache calls, message sends,
+subprocesses) find their parent through a ContextVar, so they follow the
+request across awaits and into threadpool workers without passing anything
+around. Outside a traced request, span() and @traced cost a ContextVar
+lookup and record nothing.
+
+Finished traces go to the in-memory viewer (/api/v1/monitoring/traces) and,
+when TRACE_EXPORT_DIR is set, to OTLP/JSON lines files that an OpenTelemetry
+collector or viewer can load later. No collector is needed at runtime.
+
+Tracing is off unless TRACING_ENABLED=true, and then samples
+TRACE_SAMPLE_RATE (default 10%) of requests.
+"""
+
+import os
+import json
+import time
+import queue
+import random
+import asyncio
+import logging
+import functools
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "500"))  # per trace
+TRACE_EXPORT_DIR = os.getenv("TRACE_EXPORT_DIR", "")
+TRACE_SQL_MAX_LENGTH = 1000
+SERVICE_NAME = os.getenv("SERVICE_NAME", "healthguard-api")
+
+# OTLP span kinds
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+def _random_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+class Trace:
+    """Spans recorded for one request"""
+
+    __slots__ = ("trace_id", "spans", "state", "tenant_id", "dropped")
+
+    def __init__(self, state: Optional[Dict[str, Any]] = None):
+        self.trace_id = _random_id(128)
+        self.spans: List["Span"] = []
+        # Request state; the tenant middleware fills in tenant_id after the trace starts
+        self.state = state if state is not None else {}
+        self.tenant_id: Optional[str] = None
+        self.dropped = 0
+
+    @property
+    def tenant(self) -> Optional[str]:
+        return self.tenant_id or self.state.get("tenant_id")
+
+    @property
+    def root(self) -> Optional["Span"]:
+        return self.spans[0] if self.spans else None
+
+    def summary(self) -> Dict[str, Any]:
+        root = self.root
+        return {
+            "trace_id": self.trace_id,
+            "name": root.name if root else None,
+            "tenant_id": self.tenant,
+            "start": datetime.fromtimestamp(root.start_ns / 1e9).isoformat() if root else None,
+            "duration_ms": root.duration_ms if root else 0.0,
+            "span_count": len(self.spans),
+            "dropped_spans": self.dropped,
+            "status": root.status if root else STATUS_UNSET,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Summary plus spans ordered by start time"""
+        result = self.summary()
+        tenant = self.tenant
+        result["spans"] = [span.to_dict(tenant) for span in sorted(self.spans, key=lambda s: s.start_ns)]
+        return result
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """OTLP/JSON ExportTraceServiceRequest for this trace"""
+        tenant = self.tenant
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": _otlp_attributes({"service.name": SERVICE_NAME, "process.pid": os.getpid()})},
+                "scopeSpans": [{
+                    "scope": {"name": __name__},
+                    "spans": [span.to_otlp(self.trace_id, tenant) for span in self.spans],
+                }],
+            }]
+        }
+
+
+class Span:
+    """One timed operation within a trace"""
+
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns",
+                 "attributes", "status", "status_message")
+
+    def __init__(self, trace: Trace, name: str, parent: Optional["Span"], kind: int,
+                 attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = _random_id(64)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.status = STATUS_UNSET
+        self.status_message: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns or time.time_ns()
+        return round((end - self.start_ns) / 1e6, 3)
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException):
+        self.status = STATUS_ERROR
+        self.status_message = f"{type(error).__name__}: {error}"
+
+    def finish(self):
+        if not self.end_ns:
+            self.end_ns = time.time_ns()
+
+    def to_dict(self, tenant: Optional[str]) -> Dict[str, Any]:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_offset_ms": round((self.start_ns - self.trace.root.start_ns) / 1e6, 3),
+            "duration_ms": self.duration_ms,
+            "tenant_id": tenant,
+            "attributes": self.attributes,
+            "status": self.status,
+            "error": self.status_message,
+        }
+
+    def to_otlp(self, trace_id: str, tenant: Optional[str]) -> Dict[str, Any]:
+        attributes = dict(self.attributes)
+        if tenant is not None:
+            attributes["tenant.id"] = tenant
+        span = {
+            "traceId": trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": _otlp_attributes(attributes),
+            "status": {"code": self.status},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.status_message:
+            span["status"]["message"] = self.status_message
+        return span
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def start_span(name: str, kind: int = SPAN_KIND_INTERNAL, **attributes) -> Optional[Span]:
+    """Open a child of the current span without making it current; None when not tracing"""
+    parent = _current_span.get()
+    if parent is None:
+        return None
+    trace = parent.trace
+    if len(trace.spans) >= TRACE_MAX_SPANS:
+        trace.dropped += 1
+        return None
+    span = Span(trace, name, parent, kind, attributes)
+    trace.spans.append(span)
+    return span
+
+
+@contextmanager
+def span(name: str, kind: int = SPAN_KIND_INTERNAL, **attributes) -> Iterator[Optional[Span]]:
+    """Time a block as a child of the current span"""
+    child = start_span(name, kind, **attributes)
+    if child is None:
+        yield None
+        return
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.record_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        child.finish()
+
+
+def traced(name: str, kind: int = SPAN_KIND_INTERNAL,
+           attributes: Optional[Callable[..., Dict[str, Any]]] = None):
+    """Decorator wrapping a sync or async function in a span
+
+    `attributes`, if given, is called with the function's arguments and
+    returns extra span attributes.
+    """
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _current_span.get() is None:
+                    return await func(*args, **kwargs)
+                extra = attributes(*args, **kwargs) if attributes else {}
+                with span(name, kind, **extra):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_span.get() is None:
+                return func(*args, **kwargs)
+            extra = attributes(*args, **kwargs) if attributes else {}
+            with span(name, kind, **extra):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class InMemoryTraceExporter:
+    """Most recent finished traces, bounded by TRACE_BUFFER_SIZE"""
+
+    def __init__(self, size: int = TRACE_BUFFER_SIZE):
+        self.traces: deque = deque(maxlen=size)
+
+    def export(self, trace: Trace):
+        self.traces.append(trace)
+
+    def get(self, trace_id: str) -> Optional[Trace]:
+        for trace in reversed(self.traces):
+            if trace.trace_id == trace_id:
+                return trace
+        return None
+
+    def recent(self, limit: int = 50, min_duration_ms: float = 0.0,
+               tenant_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        results = []
+        for trace in reversed(self.traces):
+            summary = trace.summary()
+            if summary["duration_ms"] < min_duration_ms:
+                continue
+            if tenant_id is not None and summary["tenant_id"] != tenant_id:
+                continue
+            results.append(summary)
+            if len(results) >= limit:
+                break
+        return results
+
+
+class OTLPFileExporter:
+    """Appends traces as OTLP/JSON lines to a daily file; writes happen off the loop"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._queue: "queue.Queue[Trace]" = queue.Queue(maxsize=10000)
+        self._thread: Optional[threading.Thread] = None
+
+    def _path(self) -> str:
+        return os.path.join(self.directory, f"traces-{datetime.now():%Y%m%d}-{os.getpid()}.jsonl")
+
+    def _run(self):
+        os.makedirs(self.directory, exist_ok=True)
+        while True:
+            trace = self._queue.get()
+            batch = [trace]
+            while not self._queue.empty() and len(batch) < 100:
+                batch.append(self._queue.get_nowait())
+            try:
+                with open(self._path(), "ab") as f:
+                    for item in batch:
+                        f.write(json.dumps(item.to_otlp(), default=str).encode() + b"\n")
+            except Exception as e:
+                logger.error(f"Trace export to {self.directory} failed: {e}")
+
+    def export(self, trace: Trace):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+            self._thread.start()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            logger.warning("Trace export queue full; dropping trace")
+
+
+class Tracer:
+    """Starts request traces and hands finished ones to the exporters"""
+
+    def __init__(self, enabled: bool = TRACING_ENABLED, sample_rate: float = TRACE_SAMPLE_RATE,
+                 export_dir: str = TRACE_EXPORT_DIR):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.memory = InMemoryTraceExporter()
+        self.exporters: List[Any] = [self.memory]
+        if export_dir:
+            self.exporters.append(OTLPFileExporter(export_dir))
+
+    def should_sample(self) -> bool:
+        return self.enabled and (self.sample_rate >= 1.0 or random.random() < self.sample_rate)
+
+    def start_trace(self, name: str, state: Optional[Dict[str, Any]] = None,
+                    kind: int = SPAN_KIND_SERVER, **attributes) -> Span:
+        trace = Trace(state)
+        root = Span(trace, name, None, kind, attributes)
+        trace.spans.append(root)
+        return root
+
+    def finish_trace(self, root: Span):
+        root.finish()
+        for exporter in self.exporters:
+            try:
+                exporter.export(root.trace)
+            except Exception as e:
+                logger.error(f"Trace exporter {type(exporter).__name__} failed: {e}")
+
+
+def _sql_operation(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+
+
+def instrument_engine(engine, name: str):
+    """Record a span per SQL statement executed on a (sync) engine"""
+    from sqlalchemy import event
+
+    if getattr(engine, "_tracing_instrumented", False):
+        return
+    engine._tracing_instrumented = True
+    db_system = engine.dialect.name
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        child = start_span(
+            f"db.{_sql_operation(statement).lower() or 'query'}", SPAN_KIND_CLIENT,
+            **{"db.system": db_system, "db.engine": name,
+               "db.statement": statement[:TRACE_SQL_MAX_LENGTH], "db.executemany": executemany},
+        )
+        if child is not None:
+            conn.info.setdefault("tracing_spans", []).append(child)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get("tracing_spans")
+        if spans:
+            child = spans.pop()
+            if cursor is not None and cursor.rowcount is not None and cursor.rowcount >= 0:
+                child.set_attribute("db.rowcount", cursor.rowcount)
+            child.finish()
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        conn = exception_context.connection
+        spans = conn.info.get("tracing_spans") if conn is not None else None
+        if spans:
+            child = spans.pop()
+            child.record_error(exception_context.original_exception)
+            child.finish()
+
+
+class TracingMiddleware:
+    """Pure ASGI middleware opening a root span for each sampled HTTP request"""
+
+    def __init__(self, app, tracer: Tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.tracer.should_sample():
+            await self.app(scope, receive, send)
+            return
+
+        state = scope.setdefault("state", {})
+        method = scope["method"]
+        root = self.tracer.start_trace(
+            f"{method} {scope['path']}", state,
+            **{"http.method": method, "http.target": scope["path"]},
+        )
+        token = _current_span.set(root)
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                root.set_attribute("http.status_code", status_code)
+                if status_code >= 500:
+                    root.status = STATUS_ERROR
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-trace-id", root.trace.trace_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        except BaseException as e:
+            root.record_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            route = getattr(scope.get("route"), "path", None)
+            if route:
+                root.name = f"{method} {route}"
+                root.set_attribute("http.route", route)
+            self.tracer.finish_trace(root)
+
+
+# Global tracer
+tracer = Tracer()
@@ -10,35 +10,80 @@ from fastapi import WebSocket, WebSocketDisconnect
 from datetime import datetime
 import logging
 
+from app.core.pubsub import ANY_SEGMENT, PubSubHub, client_topic, event_topic, hub, topic_segment, user_topic
+
 logger = logging.getLogger(__name__)
 
+ADMIN_ROLE = "admin"
+ALL_EVENTS = "+"
+OTHER_EVENTS = "other"
+# Broadcast message types a connection can filter on; any other type is filed under "other"
+EVENT_TYPES = ("notification", "activity_log", "real_time_update", "system_status", "communication_event",
+               OTHER_EVENTS)
+SUBSCRIPTION_ALIASES = {
+    "notifications": "notification",
+    "activity": "activity_log",
+    "updates": "real_time_update",
+    "status": "system_status",
+    "communication": "communication_event",
+}
+
 class ConnectionManager:
-    """Manages WebSocket connections and broadcasting"""
+    """Manages WebSocket connections and broadcasting
+    
+    A facade over the pub/sub hub: connections are registered in `hub` with
+    scope "core" and subscribed to their user and client topics.
+    
+    Broadcasts are published on `events/{type}/{tenant}/{role}`, where `_`
+    leaves a dimension unrestricted. For each event type it wants, a
+    connection subscribes the combinations of its own tenant and role with
+    `_`, so the topic trie acts as an inverted index over (type, tenant,
+    role) and a broadcast only reaches matching sockets. New connections
+    receive every type until they send their first `subscribe`. Types
+    outside EVENT_TYPES share the "other" bucket, so they stay reachable
+    for filtered connections and never alter the topic's shape.
+    """
+    
+    scope = "core"
+    
+    def __init__(self, pubsub: Optional[PubSubHub] = None):
+        self.hub = pubsub or hub
+    
+    @property
+    def active_connections(self) -> Dict[str, WebSocket]:
+        return {s.connection_id: s.websocket for s in self.hub.connections_in(self.scope)}
+    
+    @property
+    def user_connections(self) -> Dict[str, Set[str]]:
+        """user_id -> set of connection_ids, across every hub scope"""
+        users: Dict[str, Set[str]] = {}
+        for subscriber in self.hub.connections_in():
+            if subscriber.user_id:
+                users.setdefault(subscriber.user_id, set()).add(subscriber.connection_id)
+        return users
     
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
-        self.user_connections: Dict[str, Set[str]] = {}  # user_id -> set of connection_ids
-        self.client_connections: Dict[str, Set[str]] = {}  # client_id -> set of connection_ids
-        self.connection_users: Dict[str, str] = {}  # connection_id -> user_id
-        self.connection_clients: Dict[str, str] = {}  # connection_id -> client_id
+    @property
+    def client_connections(self) -> Dict[str, Set[str]]:
+        """client_id -> set of connection_ids, across every hub scope"""
+        clients: Dict[str, Set[str]] = {}
+        for subscriber in self.hub.connections_in():
+            if subscriber.client_id:
+                clients.setdefault(subscriber.client_id, set()).add(subscriber.connection_id)
+        return clients
     
-    async def connect(self, websocket: WebSocket, user_id: str, client_id: Optional[str] = None):
+    async def connect(self, websocket: WebSocket, user_id: str, client_id: Optional[str] = None,
+                      tenant_id: Optional[str] = None, role: Optional[str] = None):
         """Connect a new WebSocket client"""
-        await websocket.accept()
-        connection_id = f"{user_id}_{datetime.now().timestamp()}"
-        
-        self.active_connections[connection_id] = websocket
-        self.connection_users[connection_id] = user_id
-        
-        if user_id not in self.user_connections:
-            self.user_connections[user_id] = set()
-        self.user_connections[user_id].add(connection_id)
-        
+        topics = [user_topic(user_id)]
         if client_id:
-            self.connection_clients[connection_id] = client_id
-            if client_id not in self.client_connections:
-                self.client_connections[client_id] = set()
-            self.client_connections[client_id].add(connection_id)
+            topics.append(client_topic(client_id))
+        subscriber = await self.hub.connect(
+            websocket, scope=self.scope, user_id=user_id, client_id=client_id,
+            tenant_id=tenant_id, role=role, topics=topics
+        )
+        connection_id = subscriber.connection_id
+        subscriber.info["event_types"] = None  # all types until the first subscribe
+        self._set_event_patterns(subscriber, ALL_EVENTS, True)
         
         logger.info(f"WebSocket connected: {connection_id} for user {user_id}")
         
@@ -51,87 +96,92 @@ class ConnectionManager:
         
         return connection_id
     
+    def _set_event_patterns(self, subscriber, event_type: str, subscribed: bool):
+        type_segment = ALL_EVENTS if event_type == ALL_EVENTS else topic_segment(event_type)
+        tenants = [ANY_SEGMENT] + ([topic_segment(subscriber.tenant_id)] if subscriber.tenant_id else [])
+        roles = [ANY_SEGMENT] + ([topic_segment(subscriber.role)] if subscriber.role else [])
+        update = self.hub.subscribe_pattern if subscribed else self.hub.unsubscribe
+        for tenant in tenants:
+            for role in roles:
+                update(subscriber.connection_id, f"events/{type_segment}/{tenant}/{role}")
+    
+    def subscribe_events(self, connection_id: str, event_types) -> Optional[List[str]]:
+        """Receive only these broadcast types (added to earlier subscriptions)"""
+        subscriber = self.hub.connections.get(connection_id)
+        if subscriber is None:
+            return None
+        current = subscriber.info.get("event_types")
+        if current is None:
+            # The first explicit subscription replaces the receive-everything default
+            self._set_event_patterns(subscriber, ALL_EVENTS, False)
+            current = subscriber.info["event_types"] = set()
+        for event_type in event_types:
+            if event_type not in current:
+                current.add(event_type)
+                self._set_event_patterns(subscriber, event_type, True)
+        return sorted(current)
+    
+    def unsubscribe_events(self, connection_id: str, event_types) -> Optional[List[str]]:
+        """Stop receiving these broadcast types"""
+        subscriber = self.hub.connections.get(connection_id)
+        if subscriber is None:
+            return None
+        if subscriber.info.get("event_types") is None:
+            self.subscribe_events(connection_id, EVENT_TYPES)
+        current = subscriber.info["event_types"]
+        for event_type in event_types:
+            if event_type in current:
+                current.discard(event_type)
+                self._set_event_patterns(subscriber, event_type, False)
+        return sorted(current)
+    
     def disconnect(self, connection_id: str):
         """Disconnect a WebSocket client"""
-        if connection_id in self.active_connections:
-            user_id = self.connection_users.get(connection_id)
-            client_id = self.connection_clients.get(connection_id)
-            
-            # Remove from active connections
-            del self.active_connections[connection_id]
-            
-            # Remove from user connections
-            if user_id and user_id in self.user_connections:
-                self.user_connections[user_id].discard(connection_id)
-                if not self.user_connections[user_id]:
-                    del self.user_connections[user_id]
-            
-            # Remove from client connections
-            if client_id and client_id in self.client_connections:
-                self.client_connections[client_id].discard(connection_id)
-                if not self.client_connections[client_id]:
-                    del self.client_connections[client_id]
-            
-            # Clean up mappings
-            if connection_id in self.connection_users:
-                del self.connection_users[connection_id]
-            if connection_id in self.connection_clients:
-                del self.connection_clients[connection_id]
-            
+        if self.hub.disconnect(connection_id) is not None:
             logger.info(f"WebSocket disconnected: {connection_id}")
     
     async def send_personal_message(self, message: dict, connection_id: str):
         """Send message to specific connection"""
-        if connection_id in self.active_connections:
-            try:
-                await self.active_connections[connection_id].send_text(json.dumps(message))
-            except Exception as e:
-                logger.error(f"Failed to send message to {connection_id}: {e}")
-                self.disconnect(connection_id)
+        self.hub.send(connection_id, message)
     
     async def send_to_user(self, message: dict, user_id: str):
         """Send message to all connections of a specific user"""
-        if user_id in self.user_connections:
-            for connection_id in self.user_connections[user_id].copy():
-                await self.send_personal_message(message, connection_id)
+        await self.hub.publish(user_topic(user_id), message)
     
     async def send_to_client(self, message: dict, client_id: str):
         """Send message to all connections of a specific client"""
-        if client_id in self.client_connections:
-            for connection_id in self.client_connections[client_id].copy():
-                await self.send_personal_message(message, connection_id)
+        await self.hub.publish(client_topic(client_id), message)
     
-    async def broadcast(self, message: dict):
-        """Broadcast message to all connected clients"""
-        disconnected = []
-        for connection_id, websocket in self.active_connections.items():
-            try:
-                await websocket.send_text(json.dumps(message))
-            except Exception as e:
-                logger.error(f"Failed to broadcast to {connection_id}: {e}")
-                disconnected.append(connection_id)
+    async def broadcast(self, message: dict, coalesce_key: Optional[str] = None,
+                        tenant_id: Optional[str] = None, role: Optional[str] = None):
+        """Broadcast message to connected clients subscribed to its type
         
-        # Clean up disconnected connections
-        for connection_id in disconnected:
-            self.disconnect(connection_id)
+        Optionally restricted to one tenant and/or role. Serializes once and
+        queues the frame on every matching connection; writers send
+        concurrently, so a slow client never delays the others. Frames sharing
+        a coalesce_key may replace each other for clients that fall behind.
+        """
+        event_type = message.get("type")
+        if event_type not in EVENT_TYPES:
+            event_type = OTHER_EVENTS
+        topic = event_topic(event_type, tenant_id, role)
+        return await self.hub.publish(topic, message, coalesce_key)
     
-    async def broadcast_to_admins(self, message: dict):
+    async def broadcast_to_admins(self, message: dict, tenant_id: Optional[str] = None):
         """Broadcast message to admin users only"""
-        # This would require checking user roles
-        # For now, broadcast to all (implement role checking later)
-        await self.broadcast(message)
+        return await self.broadcast(message, tenant_id=tenant_id, role=ADMIN_ROLE)
     
     def get_connection_count(self) -> int:
         """Get total number of active connections"""
-        return len(self.active_connections)
+        return self.hub.count(self.scope)
     
     def get_user_connection_count(self, user_id: str) -> int:
         """Get number of connections for a specific user"""
-        return len(self.user_connections.get(user_id, set()))
+        return self.hub.subscriber_count(user_topic(user_id))
     
     def get_client_connection_count(self, client_id: str) -> int:
         """Get number of connections for a specific client"""
-        return len(self.client_connections.get(client_id, set()))
+        return self.hub.subscriber_count(client_topic(client_id))
 
 # Global connection manager instance
 manager = ConnectionManager()
@@ -188,9 +238,30 @@ class WebSocketMessage:
             "data": data
         })
 
-async def handle_websocket_connection(websocket: WebSocket, user_id: str, client_id: Optional[str] = None):
-    """Handle WebSocket connection lifecycle"""
-    connection_id = await manager.connect(websocket, user_id, client_id)
+def _token_identity(token: Optional[str]):
+    """(tenant_id, role) from a verified access token; (None, None) otherwise"""
+    if not token:
+        return None, None
+    try:
+        from app.core.auth import verify_token
+
+        payload = verify_token(token)
+    except Exception as e:
+        logger.warning(f"Ignoring invalid WebSocket token: {e}")
+        return None, None
+    if payload.get("type") != "access":
+        return None, None
+    return payload.get("tenant_id"), payload.get("role")
+
+async def handle_websocket_connection(websocket: WebSocket, user_id: str, client_id: Optional[str] = None,
+                                      token: Optional[str] = None):
+    """Handle WebSocket connection lifecycle
+    
+    Tenant and role (used for filtered broadcasts such as broadcast_to_admins)
+    only come from a verified access token, never from client messages.
+    """
+    tenant_id, role = _token_identity(token)
+    connection_id = await manager.connect(websocket, user_id, client_id, tenant_id=tenant_id, role=role)
     
     try:
         while True:
@@ -218,55 +289,65 @@ async def handle_websocket_message(connection_id: str, message: dict, user_id: s
             "timestamp": datetime.now().isoformat()
         }, connection_id)
     
-    elif message_type == "subscribe":
-        # Handle subscription requests
-        subscription_type = message.get("subscription_type")
-        if subscription_type == "notifications":
-            # Subscribe to notifications
-            pass
-        elif subscription_type == "activity":
-            # Subscribe to activity feed
-            pass
-    
-    elif message_type == "unsubscribe":
-        # Handle unsubscription requests
-        pass
+    elif message_type in ("subscribe", "unsubscribe"):
+        # {"type": "subscribe", "subscription_type": "notifications"} or "event_types": [...]
+        requested = message.get("event_types") or [message.get("subscription_type")]
+        if not isinstance(requested, list):
+            requested = [requested]
+        event_types = [SUBSCRIPTION_ALIASES.get(name, name) for name in requested if isinstance(name, str) and name]
+        unknown = [name for name in event_types if name not in EVENT_TYPES]
+        if unknown or not event_types:
+            await manager.send_personal_message({
+                "type": "error",
+                "message": f"Unknown subscription type: {', '.join(unknown) or 'none given'}",
+                "available": list(EVENT_TYPES),
+                "timestamp": datetime.now().isoformat()
+            }, connection_id)
+            return
+        
+        if message_type == "subscribe":
+            subscribed = manager.subscribe_events(connection_id, event_types)
+        else:
+            subscribed = manager.unsubscribe_events(connection_id, event_types)
+        await manager.send_personal_message({
+            "type": "subscriptions",
+            "event_types": subscribed,
+            "timestamp": datetime.now().isoformat()
+        }, connection_id)
     
     else:
         # Unknown message type
         logger.warning(f"Unknown WebSocket message type: {message_type}")
 
 # Real-time event handlers
-async def broadcast_notification(title: str, message: str, level: str = "info"):
-    """Broadcast notification to all connected clients"""
+async def broadcast_notification(title: str, message: str, level: str = "info", tenant_id: Optional[str] = None):
+    """Broadcast notification to clients subscribed to notifications"""
     notification = WebSocketMessage.notification(title, message, level)
-    await manager.broadcast(notification)
+    await manager.broadcast(notification, tenant_id=tenant_id)
 
-async def broadcast_to_admins(message: dict):
+async def broadcast_to_admins(message: dict, tenant_id: Optional[str] = None):
     """Broadcast message to admin users only"""
-    # This would require checking user roles
-    # For now, broadcast to all (implement role checking later)
-    await manager.broadcast(message)
+    await manager.broadcast_to_admins(message, tenant_id=tenant_id)
 
-async def broadcast_activity_log(action: str, details: dict, user_id: str):
+async def broadcast_activity_log(action: str, details: dict, user_id: str, tenant_id: Optional[str] = None):
     """Broadcast activity log to relevant users"""
     activity = WebSocketMessage.activity_log(action, details, user_id)
-    await manager.broadcast(activity)
+    await manager.broadcast(activity, tenant_id=tenant_id)
 
-async def broadcast_real_time_update(update_type: str, data: Any):
+async def broadcast_real_time_update(update_type: str, data: Any, tenant_id: Optional[str] = None):
     """Broadcast real-time update"""
     update = WebSocketMessage.real_time_update(update_type, data)
-    await manager.broadcast(update)
+    await manager.broadcast(update, coalesce_key=f"real_time_update:{update_type}", tenant_id=tenant_id)
 
 async def broadcast_system_status(status: dict):
     """Broadcast system status update"""
     status_msg = WebSocketMessage.system_status(status)
-    await manager.broadcast(status_msg)
+    await manager.broadcast(status_msg, coalesce_key="system_status")
 
-async def broadcast_communication_event(event_type: str, data: dict):
+async def broadcast_communication_event(event_type: str, data: dict, tenant_id: Optional[str] = None):
     """Broadcast communication event"""
     event = WebSocketMessage.communication_event(event_type, data)
-    await manager.broadcast(event)
+    await manager.broadcast(event, tenant_id=tenant_id)
 
 # Background task for periodic updates
 async def periodic_status_updates():
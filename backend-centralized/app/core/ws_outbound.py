@@ -0,0 +1,142 @@
+"""
+WebSocket Outbound Queues
+Per-connection bounded send queues drained by a dedicated writer task
+
+Broadcasting never awaits a socket: the message is serialized once and the
+same text frame is offered to every recipient's OutboundConnection, which
+appends it to a bounded deque and wakes its writer task. Each writer sends
+its frames in order, so a slow client only delays itself.
+
+When a client falls WS_SEND_QUEUE_SIZE frames behind, WS_SLOW_CONSUMER_POLICY
+decides what happens:
+  drop       - discard the oldest queued frame
+  coalesce   - replace a queued frame with the same coalesce key (e.g. a
+               status snapshot) with the newer one, else drop the oldest
+  disconnect - close the connection (code 1013, try again later)
+A send that takes longer than WS_SEND_TIMEOUT seconds closes the connection.
+"""
+
+import os
+import json
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+try:
+    import orjson
+
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop")  # drop | coalesce | disconnect
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))  # seconds
+
+SLOW_CONSUMER_POLICIES = ("drop", "coalesce", "disconnect")
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+def encode_message(message: Any) -> str:
+    """Serialize a message once for all recipients"""
+    if isinstance(message, str):
+        return message
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(message, default=str).decode()
+    return json.dumps(message, default=str)
+
+
+class OutboundConnection:
+    """A WebSocket with a bounded outbound queue and its own writer task"""
+
+    def __init__(self, websocket, connection_id: str, max_queue: int = WS_SEND_QUEUE_SIZE,
+                 policy: str = WS_SLOW_CONSUMER_POLICY, send_timeout: float = WS_SEND_TIMEOUT,
+                 on_close: Optional[Callable[[str], None]] = None):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.websocket = websocket
+        self.connection_id = connection_id
+        self.max_queue = max_queue
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.on_close = on_close
+        self.queue: Deque[Tuple[Optional[str], str]] = deque()
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.closed = False
+        self._wakeup = asyncio.Event()
+        self._writer = asyncio.get_running_loop().create_task(self._run_writer())
+
+    def offer(self, payload: str, coalesce_key: Optional[str] = None) -> bool:
+        """Queue an encoded frame without blocking; False if it was not queued"""
+        if self.closed:
+            return False
+        queue = self.queue
+        if len(queue) >= self.max_queue:
+            if self.policy == "disconnect":
+                logger.warning(f"Closing slow WebSocket consumer {self.connection_id} ({len(queue)} frames behind)")
+                self.close(CLOSE_TRY_AGAIN_LATER)
+                return False
+            if self.policy == "coalesce" and coalesce_key is not None:
+                for position, (key, _) in enumerate(queue):
+                    if key == coalesce_key:
+                        queue[position] = (coalesce_key, payload)
+                        self.coalesced += 1
+                        return True
+            queue.popleft()
+            self.dropped += 1
+        queue.append((coalesce_key, payload))
+        self._wakeup.set()
+        return True
+
+    async def _run_writer(self):
+        queue = self.queue
+        send_text = self.websocket.send_text
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while queue:
+                    _, payload = queue.popleft()
+                    await asyncio.wait_for(send_text(payload), self.send_timeout)
+                    self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            logger.warning(f"WebSocket send to {self.connection_id} timed out after {self.send_timeout}s")
+            self.close(CLOSE_TRY_AGAIN_LATER)
+        except Exception as e:
+            logger.error(f"Failed to send message to {self.connection_id}: {e}")
+            self.close()
+
+    def close(self, code: Optional[int] = None):
+        """Stop the writer, optionally close the socket, and notify the owner once"""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        current = asyncio.current_task()
+        if self._writer is not current:
+            self._writer.cancel()
+        if code is not None:
+            asyncio.get_running_loop().create_task(self._close_socket(code))
+        if self.on_close is not None:
+            self.on_close(self.connection_id)
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": len(self.queue),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+        }
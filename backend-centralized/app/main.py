@@ -6,11 +6,12 @@ from fastapi.responses import HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from contextlib import asynccontextmanager
+import asyncio
 import logging
 import os
 from typing import Optional
 from datetime import datetime, timezone
-from app.core.database import engine, Base
+from app.core.database import Base, dispose_engine, init_engine
 from app.api.v1 import (
     surveillance,
     tenants,
@@ -47,7 +48,16 @@ from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from app.core.database import get_db
 from dotenv import load_dotenv
-from app.models.addons import Addon
+from app.core.addon_gating import addon_states, addon_slug_for_path
+from app.core.monitoring import MonitoringMiddleware, health_checker, metrics_collector
+from app.core.metrics_export import PROMETHEUS_AVAILABLE, metrics_exporter
+from app.core.profiling import ProfilingMiddleware, profiler
+from app.core.tracing import TracingMiddleware, tracer
+from app.core.query_audit import QueryAuditMiddleware, query_auditor
+from app.core.logging import setup_logging
+from app.core.event_bus import event_bus
+from app.core.realtime import realtime_manager
+from app.core.cache import cache_manager
 
 # Rate limiting imports
 try:
@@ -59,7 +69,8 @@ try:
 except ImportError:
     RATE_LIMITING_AVAILABLE = False
 
-logging.basicConfig(level=logging.INFO)
+# Queue-based JSON logging; configured here rather than on import of app.core.logging
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Initialize rate limiter
@@ -82,6 +93,9 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.warning(f"⚠️ Could not load .env: {e}")
 
+    # Connect to the database; raises in production when it is unreachable
+    engine = await asyncio.to_thread(init_engine)
+
     # Create database tables
     try:
         Base.metadata.create_all(bind=engine)
@@ -89,6 +103,27 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"❌ Database table creation failed: {e}")
 
+    # Load add-on states for route gating
+    if await asyncio.to_thread(addon_states.load):
+        logger.info("✅ Add-on states loaded")
+    else:
+        logger.warning("⚠️ Add-on states not loaded; gated routes hidden until reload")
+
+    # Sample system metrics in the background; endpoints read the latest snapshot
+    metrics_collector.start_sampler()
+    # Reload persisted request/error rollups and keep flushing them (METRICS_ROLLUP_DB)
+    await metrics_collector.rollups.start()
+    # Publish this worker's metrics for /metrics aggregation when multiprocess
+    metrics_exporter.start()
+    # Run readiness probes in the background; probe endpoints read cached results
+    health_checker.start()
+    # Carry realtime publishes between workers (REALTIME_BROKER)
+    await event_bus.start()
+    # Reload the persisted realtime event tail for since=<seq> replay (REALTIME_HISTORY_FILE)
+    await realtime_manager.event_history.start()
+    # Sync endpoints hand their Redis cache invalidations to this loop
+    cache_manager.bind_loop(asyncio.get_running_loop())
+
     # Initialize services
     try:
         from app.services.notification_service import notification_service
@@ -102,6 +137,20 @@ async def lifespan(app: FastAPI):
 
     # Shutdown
     logger.info("🛑 Shutting down HealthGuard Surveillance Pro...")
+    await metrics_collector.stop_sampler()
+    await metrics_collector.rollups.stop()
+    await metrics_exporter.stop()
+    await health_checker.stop()
+    await event_bus.stop()
+    await realtime_manager.event_history.stop()
+    try:
+        await cache_manager.close()
+    except Exception as e:
+        logger.warning(f"⚠️ Cache shutdown failed: {e}")
+    try:
+        await dispose_engine()
+    except Exception as e:
+        logger.warning(f"⚠️ Database shutdown failed: {e}")
 
 
 app = FastAPI(
@@ -193,64 +242,61 @@ async def tenant_middleware(request: Request, call_next):
 # Add-on gating: block addon routes when not enabled
 @app.middleware("http")
 async def addons_gating_middleware(request: Request, call_next):
-    path = request.url.path
-    # Only gate API v1 routes
-    if path.startswith("/api/v1/"):
-        # Map API prefixes to addon slugs
-        prefix_to_addon = {
-            "ai-analytics": "ai-analytics-suite",
-            "cloud-storage": "cloud-storage-pro",
-            "inventory": "inventory-tracker",
-            "financial": "financial-manager",
-            "education": "education-platform",
-            "hr": "hr-manager-plus",
-            "compliance": "compliance-guardian",
-            "support": "support-desk",
-            "autism-care": "autism-care",
-            "website-builder": "website-builder",
-            "mobile-app": "mobile-app",
-        }
-        try:
-            # Extract first segment after /api/v1/
-            rest = path[len("/api/v1/") :]
-            seg = rest.split("/", 1)[0]
-            slug = prefix_to_addon.get(seg)
-            if slug:
-                # Check DB for addon status
-                db_gen = get_db()
-                db: Session = next(db_gen)
-                addon: Addon | None = db.query(Addon).get(slug)
-                # Close session promptly
-                try:
-                    if not addon or not addon.enabled:
-                        return JSONResponse(
-                            status_code=404, content={"detail": "Not Found"}
-                        )
-                finally:
-                    db.close()
-        except Exception:
+    slug = addon_slug_for_path(request.url.path)
+    if slug:
+        # In-process state table; refreshed in the background when stale
+        addon_states.refresh_if_stale()
+        if not addon_states.is_enabled(slug):
             # Fail closed (hide feature) rather than erroring
             return JSONResponse(status_code=404, content={"detail": "Not Found"})
     return await call_next(request)
 
 
+# Slow-query log and per-request N+1 detection
+app.add_middleware(QueryAuditMiddleware, auditor=query_auditor)
+
+# Request-scoped tracing spans for DB, cache and outbound calls
+app.add_middleware(TracingMiddleware, tracer=tracer)
+
+# Per-request profiling for callers sending X-Profile with an allowed role
+app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
+# Request metrics; added last so it is outermost and times the whole stack
+app.add_middleware(MonitoringMiddleware, metrics_collector=metrics_collector)
+
+
 async def get_current_tenant(request: Request) -> Optional[str]:
     """Get current tenant from request"""
     return getattr(request.state, "tenant_id", None)
 
 
 @app.get("/health")
+@app.get("/health/live")
 async def health_check():
-    """Health check endpoint"""
+    """Liveness probe; answers from process state only, never does I/O"""
     return {
         "status": "healthy",
         "service": "HealthGuard Surveillance Pro",
         "version": "2.0.0",
         "multi_tenant": True,
-        "timestamp": "2024-01-27T10:00:00Z",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
     }
 
 
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness probe; reports the cached background health checks"""
+    checks = health_checker.get_health_checks()
+    status = health_checker.overall_status(checks)
+    return JSONResponse(
+        status_code=200 if status in ("healthy", "degraded") else 503,
+        content={
+            "status": status,
+            "checks": {check.service: check.status for check in checks},
+        },
+    )
+
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -353,6 +399,23 @@ async def admin_metrics():
     }
 
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(request: Request):
+    """Prometheus/OpenMetrics exposition, aggregated across workers"""
+    from fastapi.responses import Response
+
+    token = os.getenv("METRICS_TOKEN")
+    if token and request.headers.get("authorization") != f"Bearer {token}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    if not PROMETHEUS_AVAILABLE:
+        raise HTTPException(status_code=503, detail="prometheus_client is not installed")
+    from app.core.metrics_export import OPENMETRICS_CONTENT_TYPE, TEXT_CONTENT_TYPE
+
+    openmetrics = "application/openmetrics-text" in request.headers.get("accept", "")
+    body = await metrics_exporter.scrape(openmetrics=openmetrics)
+    return Response(content=body, media_type=OPENMETRICS_CONTENT_TYPE if openmetrics else TEXT_CONTENT_TYPE)
+
+
 @app.exception_handler(404)
 async def not_found_handler(request: Request, exc: HTTPException):
     """Handle 404 errors"""
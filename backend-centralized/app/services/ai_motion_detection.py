@@ -11,6 +11,8 @@ import asyncio
 from enum import Enum
 import json
 
+from app.core.event_history import EventRing
+
 logger = logging.getLogger(__name__)
 
 class ObjectType(Enum):
@@ -72,9 +74,8 @@ class AIMotionDetector:
         self.trackers = {}
         self.next_track_id = 1
         
-        # Event history
-        self.event_history = []
-        self.max_history = 1000
+        # Event history (bounded ring, oldest events overwritten)
+        self.event_history = EventRing(1000)
         
         # Configuration
         self.enabled = True
@@ -108,10 +109,6 @@ class AIMotionDetector:
             event = await self._create_motion_event(camera_id, detected_objects)
             self.event_history.append(event)
             
-            # Keep only recent history
-            if len(self.event_history) > self.max_history:
-                self.event_history.pop(0)
-            
             return event
             
         except Exception as e:
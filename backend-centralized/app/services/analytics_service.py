@@ -69,7 +69,7 @@ class AdvancedAnalyticsService:
             "anomaly_detection": await self._detect_anomalies(alerts, motion_events),
             "predictive_insights": await self._generate_predictive_insights(recordings, alerts),
             "compliance_metrics": await self._generate_compliance_metrics(recordings, alerts),
-            "cost_analysis": await self._generate_cost_analysis(recordings, cameras),
+            "cost_analysis": await self._generate_cost_analysis(recordings, cameras, alerts),
             "recommendations": await self._generate_recommendations(cameras, recordings, alerts)
         }
         
@@ -341,7 +341,7 @@ class AdvancedAnalyticsService:
             }
         }
     
-    async def _generate_cost_analysis(self, recordings: List[Dict], cameras: List[Dict]) -> Dict[str, Any]:
+    async def _generate_cost_analysis(self, recordings: List[Dict], cameras: List[Dict], alerts: List[Dict] = None) -> Dict[str, Any]:
         """Generate cost analysis"""
         
         # Calculate storage costs (example rates)
@@ -367,7 +367,7 @@ class AdvancedAnalyticsService:
                 "total_monthly_cost": total_monthly_cost
             },
             "roi_analysis": {
-                "cost_per_incident_prevented": total_monthly_cost / max(len([a for a in alerts if a.get('severity') == 'high']), 1),
+                "cost_per_incident_prevented": total_monthly_cost / max(len([a for a in alerts or [] if a.get('severity') == 'high']), 1),
                 "value_generated": "High",  # Placeholder
                 "cost_effectiveness_score": 85.0
             }
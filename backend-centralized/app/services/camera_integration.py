@@ -75,6 +75,32 @@ class RecordingInfo:
     encryption_key: Optional[str]
     retention_policy: str
 
+class FrameRateMeter:
+    """Frames per second over the last full second; tick() and rate() are O(1)"""
+    
+    def __init__(self):
+        self.total = 0
+        self._second = 0
+        self._count = 0
+        self._last_rate = 0
+    
+    def tick(self):
+        second = int(time.monotonic())
+        if second != self._second:
+            self._last_rate = self._count if second == self._second + 1 else 0
+            self._second = second
+            self._count = 0
+        self._count += 1
+        self.total += 1
+    
+    def rate(self) -> float:
+        second = int(time.monotonic())
+        if second == self._second:
+            return float(self._last_rate)
+        if second == self._second + 1:
+            return float(self._count)
+        return 0.0
+
 class CameraConnection:
     """Manages individual camera connections"""
     
@@ -90,6 +116,8 @@ class CameraConnection:
         self.last_frame = None
         self.connection_retries = 0
         self.max_retries = 5
+        self.capture_fps = FrameRateMeter()
+        self.record_fps = FrameRateMeter()
         
     async def connect(self) -> bool:
         """Establish connection to camera"""
@@ -194,6 +222,7 @@ class CameraConnection:
         try:
             ret, frame = self.cap.read()
             if ret:
+                self.capture_fps.tick()
                 self.last_frame = frame
                 return frame
             return None
@@ -246,6 +275,7 @@ class CameraConnection:
                     
                     # Write frame
                     self.video_writer.write(frame)
+                    self.record_fps.tick()
                     
                     # Check for motion
                     if self.config.motion_detection_enabled:
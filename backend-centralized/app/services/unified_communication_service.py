@@ -23,6 +23,7 @@ import stripe
 
 # Local imports
 from app.core.config import settings
+from app.core.tracing import SPAN_KIND_CLIENT, traced
 from app.models.communication import (
     Call, Message, Contact, Conference, Voicemail, 
     PhoneNumber, CallRecording, CommunicationSettings
@@ -79,6 +80,11 @@ class CommunicationMessage:
     scheduled_at: Optional[datetime] = None
     metadata: Optional[Dict[str, Any]] = None
 
+def _message_attributes(self, message: "CommunicationMessage", *args, **kwargs) -> Dict[str, Any]:
+    """Span attributes for outbound message sends"""
+    return {"message.id": message.id, "message.type": getattr(message.type, "value", message.type)}
+
+
 class UnifiedCommunicationService:
     """Unified communication service handling all communication types"""
     
@@ -218,6 +224,7 @@ class UnifiedCommunicationService:
                 "error": str(e)
             }
     
+    @traced("communication.send_email", SPAN_KIND_CLIENT, attributes=_message_attributes)
     async def _send_email(self, message: CommunicationMessage) -> Dict[str, Any]:
         """Send email message"""
         try:
@@ -251,6 +258,7 @@ class UnifiedCommunicationService:
                 "message_id": message.id
             }
     
+    @traced("communication.send_sms", SPAN_KIND_CLIENT, attributes=_message_attributes)
     async def _send_sms(self, message: CommunicationMessage) -> Dict[str, Any]:
         """Send SMS message via Twilio"""
         try:
@@ -279,6 +287,7 @@ class UnifiedCommunicationService:
                 "message_id": message.id
             }
     
+    @traced("communication.send_whatsapp", SPAN_KIND_CLIENT, attributes=_message_attributes)
     async def _send_whatsapp(self, message: CommunicationMessage) -> Dict[str, Any]:
         """Send WhatsApp message"""
         try:
@@ -323,6 +332,7 @@ class UnifiedCommunicationService:
                 "message_id": message.id
             }
     
+    @traced("communication.send_telegram", SPAN_KIND_CLIENT, attributes=_message_attributes)
     async def _send_telegram(self, message: CommunicationMessage) -> Dict[str, Any]:
         """Send Telegram message"""
         try:
@@ -359,6 +369,7 @@ class UnifiedCommunicationService:
                 "message_id": message.id
             }
     
+    @traced("communication.send_fax", SPAN_KIND_CLIENT, attributes=_message_attributes)
     async def _send_fax(self, message: CommunicationMessage) -> Dict[str, Any]:
         """Send fax message"""
         try:
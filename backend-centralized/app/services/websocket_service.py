@@ -10,6 +10,8 @@ from datetime import datetime
 from fastapi import WebSocket, WebSocketDisconnect
 from enum import Enum
 
+from app.core.pubsub import PubSubHub, camera_topic, hub, topic_segment
+
 logger = logging.getLogger(__name__)
 
 class ConnectionType(Enum):
@@ -17,135 +19,132 @@ class ConnectionType(Enum):
     ANALYTICS = "analytics"
     ADMIN = "admin"
 
+def surveillance_topic(connection_type: ConnectionType) -> str:
+    return f"surveillance/{connection_type.value}"
+
+def camera_pattern(camera_id: str) -> str:
+    """A camera in any tenant"""
+    return f"tenant/+/camera/{topic_segment(camera_id)}"
+
 class WebSocketConnectionManager:
-    """Manages WebSocket connections for real-time surveillance updates"""
+    """Manages WebSocket connections for real-time surveillance updates
     
-    def __init__(self):
-        self.active_connections: Dict[ConnectionType, List[WebSocket]] = {
-            ConnectionType.SURVEILLANCE: [],
-            ConnectionType.ANALYTICS: [],
-            ConnectionType.ADMIN: []
-        }
-        self.camera_subscriptions: Dict[str, Set[WebSocket]] = {}
-        self.connection_info: Dict[WebSocket, Dict[str, Any]] = {}
+    A facade over the pub/sub hub (scope "surveillance"): each connection is
+    subscribed to its type topic, and camera subscriptions are
+    `tenant/+/camera/{id}` patterns, so events published on a camera topic
+    reach exactly the sockets watching that camera.
+    """
+    
+    scope = "surveillance"
+    
+    def __init__(self, pubsub: Optional[PubSubHub] = None):
+        self.hub = pubsub or hub
+    
+    @property
+    def active_connections(self) -> Dict[ConnectionType, List[WebSocket]]:
+        connections: Dict[ConnectionType, List[WebSocket]] = {connection_type: [] for connection_type in ConnectionType}
+        for subscriber in self.hub.connections_in(self.scope):
+            connections[subscriber.info["type"]].append(subscriber.websocket)
+        return connections
+    
+    @property
+    def connection_info(self) -> Dict[WebSocket, Dict[str, Any]]:
+        return {subscriber.websocket: subscriber.info for subscriber in self.hub.connections_in(self.scope)}
+    
+    @property
+    def camera_subscriptions(self) -> Dict[str, Set[WebSocket]]:
+        cameras: Dict[str, Set[WebSocket]] = {}
+        for subscriber in self.hub.connections_in(self.scope):
+            for camera_id in subscriber.info["subscribed_cameras"]:
+                cameras.setdefault(camera_id, set()).add(subscriber.websocket)
+        return cameras
         
     async def connect(self, websocket: WebSocket, connection_type: ConnectionType = ConnectionType.SURVEILLANCE):
         """Accept a new WebSocket connection"""
-        await websocket.accept()
-        self.active_connections[connection_type].append(websocket)
-        self.connection_info[websocket] = {
+        subscriber = await self.hub.connect(websocket, scope=self.scope, topics=(surveillance_topic(connection_type),))
+        subscriber.info.update({
             "type": connection_type,
             "connected_at": datetime.utcnow(),
             "subscribed_cameras": set(),
             "last_activity": datetime.utcnow()
-        }
-        logger.info(f"WebSocket connected: {connection_type.value} (total: {len(self.active_connections[connection_type])})")
+        })
+        logger.info(f"WebSocket connected: {connection_type.value} (total: {self.hub.subscriber_count(surveillance_topic(connection_type))})")
         
     def disconnect(self, websocket: WebSocket):
         """Remove a WebSocket connection"""
-        # Remove from active connections
-        for connection_type, connections in self.active_connections.items():
-            if websocket in connections:
-                connections.remove(websocket)
-                logger.info(f"WebSocket disconnected: {connection_type.value} (total: {len(connections)})")
-                break
-        
-        # Remove from camera subscriptions
-        if websocket in self.connection_info:
-            subscribed_cameras = self.connection_info[websocket].get("subscribed_cameras", set())
-            for camera_id in subscribed_cameras:
-                if camera_id in self.camera_subscriptions:
-                    self.camera_subscriptions[camera_id].discard(websocket)
-                    if not self.camera_subscriptions[camera_id]:
-                        del self.camera_subscriptions[camera_id]
-        
-        # Remove connection info
-        if websocket in self.connection_info:
-            del self.connection_info[websocket]
+        subscriber = self.hub.disconnect_socket(websocket)
+        if subscriber is not None:
+            connection_type = subscriber.info["type"]
+            logger.info(f"WebSocket disconnected: {connection_type.value} (total: {self.hub.subscriber_count(surveillance_topic(connection_type))})")
     
     async def send_personal_message(self, message: str, websocket: WebSocket):
         """Send a message to a specific WebSocket connection"""
-        try:
-            await websocket.send_text(message)
-            self.connection_info[websocket]["last_activity"] = datetime.utcnow()
-        except Exception as e:
-            logger.error(f"Failed to send personal message: {e}")
-            self.disconnect(websocket)
+        subscriber = self.hub.connection_for(websocket)
+        if subscriber is None or not self.hub.send(subscriber.connection_id, message):
+            logger.error("Failed to send personal message: socket is not connected")
+            return
+        subscriber.info["last_activity"] = datetime.utcnow()
     
     async def broadcast_to_type(self, message: str, connection_type: ConnectionType):
         """Broadcast a message to all connections of a specific type"""
-        disconnected = []
-        for websocket in self.active_connections[connection_type]:
-            try:
-                await websocket.send_text(message)
-                self.connection_info[websocket]["last_activity"] = datetime.utcnow()
-            except Exception as e:
-                logger.error(f"Failed to broadcast to {connection_type.value}: {e}")
-                disconnected.append(websocket)
-        
-        # Clean up disconnected connections
-        for websocket in disconnected:
-            self.disconnect(websocket)
+        await self.hub.publish(surveillance_topic(connection_type), message)
     
     async def broadcast_to_camera(self, camera_id: str, message: str):
         """Broadcast a message to all connections subscribed to a specific camera"""
-        if camera_id not in self.camera_subscriptions:
-            return
-        
-        disconnected = []
-        for websocket in self.camera_subscriptions[camera_id]:
-            try:
-                await websocket.send_text(message)
-                self.connection_info[websocket]["last_activity"] = datetime.utcnow()
-            except Exception as e:
-                logger.error(f"Failed to broadcast to camera {camera_id}: {e}")
-                disconnected.append(websocket)
-        
-        # Clean up disconnected connections
-        for websocket in disconnected:
-            self.disconnect(websocket)
+        await self.hub.publish(camera_topic(camera_id), message)
     
     def subscribe_to_camera(self, websocket: WebSocket, camera_id: str):
         """Subscribe a connection to a specific camera"""
-        if camera_id not in self.camera_subscriptions:
-            self.camera_subscriptions[camera_id] = set()
-        
-        self.camera_subscriptions[camera_id].add(websocket)
-        self.connection_info[websocket]["subscribed_cameras"].add(camera_id)
+        subscriber = self.hub.connection_for(websocket)
+        if subscriber is None:
+            return
+        self.hub.subscribe_pattern(subscriber.connection_id, camera_pattern(camera_id))
+        subscriber.info["subscribed_cameras"].add(camera_id)
         logger.info(f"WebSocket subscribed to camera {camera_id}")
     
     def unsubscribe_from_camera(self, websocket: WebSocket, camera_id: str):
         """Unsubscribe a connection from a specific camera"""
-        if camera_id in self.camera_subscriptions:
-            self.camera_subscriptions[camera_id].discard(websocket)
-            if not self.camera_subscriptions[camera_id]:
-                del self.camera_subscriptions[camera_id]
-        
-        if websocket in self.connection_info:
-            self.connection_info[websocket]["subscribed_cameras"].discard(camera_id)
+        subscriber = self.hub.connection_for(websocket)
+        if subscriber is None:
+            return
+        self.hub.unsubscribe(subscriber.connection_id, camera_pattern(camera_id))
+        subscriber.info["subscribed_cameras"].discard(camera_id)
         logger.info(f"WebSocket unsubscribed from camera {camera_id}")
     
     def get_connection_stats(self) -> Dict[str, Any]:
         """Get statistics about active connections"""
+        active_connections = self.active_connections
+        camera_subscriptions = self.camera_subscriptions
         return {
-            "total_connections": sum(len(connections) for connections in self.active_connections.values()),
+            "total_connections": sum(len(connections) for connections in active_connections.values()),
             "connections_by_type": {
                 connection_type.value: len(connections) 
-                for connection_type, connections in self.active_connections.items()
+                for connection_type, connections in active_connections.items()
             },
             "camera_subscriptions": {
                 camera_id: len(subscribers) 
-                for camera_id, subscribers in self.camera_subscriptions.items()
+                for camera_id, subscribers in camera_subscriptions.items()
             },
-            "active_cameras": len(self.camera_subscriptions)
+            "active_cameras": len(camera_subscriptions)
         }
 
 class SurveillanceWebSocketService:
-    """Service for handling surveillance-specific WebSocket operations"""
+    """Service for handling surveillance-specific WebSocket operations
+    
+    Thin publishers: each event is published once on the union of its camera
+    and type topics, so a socket matching both receives a single copy.
+    """
     
     def __init__(self, manager: WebSocketConnectionManager):
         self.manager = manager
     
+    async def _publish(self, message: Dict[str, Any], *connection_types: ConnectionType,
+                       camera_id: Optional[str] = None):
+        topics = [surveillance_topic(connection_type) for connection_type in connection_types]
+        if camera_id:
+            topics.append(camera_topic(camera_id))
+        await self.manager.hub.publish(topics, message)
+    
     async def broadcast_motion_event(self, camera_id: str, event_data: Dict[str, Any]):
         """Broadcast a motion detection event"""
         message = {
@@ -155,8 +154,7 @@ class SurveillanceWebSocketService:
             "timestamp": datetime.utcnow().isoformat(),
             "data": event_data
         }
-        await self.manager.broadcast_to_camera(camera_id, json.dumps(message))
-        await self.manager.broadcast_to_type(json.dumps(message), ConnectionType.SURVEILLANCE)
+        await self._publish(message, ConnectionType.SURVEILLANCE, camera_id=camera_id)
     
     async def broadcast_face_recognition(self, camera_id: str, recognition_data: Dict[str, Any]):
         """Broadcast a face recognition event"""
@@ -167,8 +165,7 @@ class SurveillanceWebSocketService:
             "timestamp": datetime.utcnow().isoformat(),
             "data": recognition_data
         }
-        await self.manager.broadcast_to_camera(camera_id, json.dumps(message))
-        await self.manager.broadcast_to_type(json.dumps(message), ConnectionType.SURVEILLANCE)
+        await self._publish(message, ConnectionType.SURVEILLANCE, camera_id=camera_id)
     
     async def broadcast_behavior_analysis(self, camera_id: str, behavior_data: Dict[str, Any]):
         """Broadcast a behavior analysis event"""
@@ -179,8 +176,7 @@ class SurveillanceWebSocketService:
             "timestamp": datetime.utcnow().isoformat(),
             "data": behavior_data
         }
-        await self.manager.broadcast_to_camera(camera_id, json.dumps(message))
-        await self.manager.broadcast_to_type(json.dumps(message), ConnectionType.SURVEILLANCE)
+        await self._publish(message, ConnectionType.SURVEILLANCE, camera_id=camera_id)
     
     async def broadcast_predictive_alert(self, alert_data: Dict[str, Any]):
         """Broadcast a predictive alert"""
@@ -190,8 +186,7 @@ class SurveillanceWebSocketService:
             "timestamp": datetime.utcnow().isoformat(),
             "data": alert_data
         }
-        await self.manager.broadcast_to_type(json.dumps(message), ConnectionType.SURVEILLANCE)
-        await self.manager.broadcast_to_type(json.dumps(message), ConnectionType.ADMIN)
+        await self._publish(message, ConnectionType.SURVEILLANCE, ConnectionType.ADMIN)
     
     async def broadcast_risk_assessment(self, camera_id: str, assessment_data: Dict[str, Any]):
         """Broadcast a risk assessment update"""
@@ -202,8 +197,7 @@ class SurveillanceWebSocketService:
             "timestamp": datetime.utcnow().isoformat(),
             "data": assessment_data
         }
-        await self.manager.broadcast_to_camera(camera_id, json.dumps(message))
-        await self.manager.broadcast_to_type(json.dumps(message), ConnectionType.SURVEILLANCE)
+        await self._publish(message, ConnectionType.SURVEILLANCE, camera_id=camera_id)
     
     async def broadcast_system_status(self, status_data: Dict[str, Any]):
         """Broadcast system status updates"""
@@ -212,8 +206,7 @@ class SurveillanceWebSocketService:
             "timestamp": datetime.utcnow().isoformat(),
             "data": status_data
         }
-        await self.manager.broadcast_to_type(json.dumps(message), ConnectionType.SURVEILLANCE)
-        await self.manager.broadcast_to_type(json.dumps(message), ConnectionType.ADMIN)
+        await self._publish(message, ConnectionType.SURVEILLANCE, ConnectionType.ADMIN)
     
     async def broadcast_analytics_update(self, analytics_data: Dict[str, Any]):
         """Broadcast analytics updates"""
@@ -222,7 +215,7 @@ class SurveillanceWebSocketService:
             "timestamp": datetime.utcnow().isoformat(),
             "data": analytics_data
         }
-        await self.manager.broadcast_to_type(json.dumps(message), ConnectionType.ANALYTICS)
+        await self._publish(message, ConnectionType.ANALYTICS)
 
 # Global instances
 connection_manager = WebSocketConnectionManager()
@@ -239,8 +232,9 @@ async def handle_websocket_connection(websocket: WebSocket, connection_type: Con
             message = json.loads(data)
             
             # Update last activity
-            if websocket in connection_manager.connection_info:
-                connection_manager.connection_info[websocket]["last_activity"] = datetime.utcnow()
+            subscriber = connection_manager.hub.connection_for(websocket)
+            if subscriber is not None:
+                subscriber.info["last_activity"] = datetime.utcnow()
             
             # Handle different message types
             await handle_websocket_message(websocket, message)
@@ -0,0 +1,91 @@
+"""
+Monitoring middleware benchmark
+Measures the per-request cost of MonitoringMiddleware by driving a minimal
+FastAPI app directly over ASGI (no server, no sockets), with the middleware
+off, installed as pure ASGI, and wrapped in BaseHTTPMiddleware for comparison
+
+Usage (from backend-centralized/):
+    python scripts/benchmark_monitoring_middleware.py [--requests 20000]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, Request  # noqa: E402
+from starlette.middleware.base import BaseHTTPMiddleware  # noqa: E402
+
+from app.core.monitoring import MetricsCollector, MonitoringMiddleware, _route_label  # noqa: E402
+
+
+def build_app(mode: str, collector: MetricsCollector) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/api/v1/cameras/{camera_id}")
+    async def get_camera(camera_id: str):
+        return {"id": camera_id}
+
+    if mode == "asgi":
+        app.add_middleware(MonitoringMiddleware, metrics_collector=collector)
+    elif mode == "base-http":
+        async def monitor(request: Request, call_next):
+            started = time.perf_counter()
+            response = await call_next(request)
+            collector.record_request(
+                time.perf_counter() - started, response.status_code,
+                _route_label(request.scope), method=request.method,
+            )
+            return response
+
+        app.add_middleware(BaseHTTPMiddleware, dispatch=monitor)
+    return app
+
+
+async def drive(app: FastAPI, requests: int) -> float:
+    """Return mean microseconds per request"""
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    def scope(i: int):
+        return {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": "GET", "scheme": "http", "path": f"/api/v1/cameras/{i % 50}",
+            "raw_path": f"/api/v1/cameras/{i % 50}".encode(), "root_path": "",
+            "query_string": b"", "headers": [(b"host", b"bench")],
+            "client": ("127.0.0.1", 1234), "server": ("bench", 80),
+            "state": {"tenant_id": f"tenant-{i % 5}"},
+        }
+
+    for i in range(500):  # warm up
+        await app(scope(i), receive, send)
+    started = time.perf_counter()
+    for i in range(requests):
+        await app(scope(i), receive, send)
+    return (time.perf_counter() - started) / requests * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    results = {}
+    for mode in ("none", "asgi", "base-http"):
+        collector = MetricsCollector()
+        results[mode] = asyncio.run(drive(build_app(mode, collector), args.requests))
+
+    print(f"Per-request cost over {args.requests} requests")
+    print(f"{'middleware':<12}{'us/request':>12}{'overhead us':>14}")
+    for mode, micros in results.items():
+        print(f"{mode:<12}{micros:>12.1f}{micros - results['none']:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
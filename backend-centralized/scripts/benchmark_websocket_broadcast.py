@@ -0,0 +1,116 @@
+"""
+WebSocket broadcast benchmark
+Measures ConnectionManager.broadcast against simulated sockets: the time the
+broadcast call holds the event loop and the time until every fast client has
+the frame, with a share of slow clients, compared to the old sequential loop
+that awaited send_text and re-encoded the message per recipient
+
+Usage (from backend-centralized/):
+    python scripts/benchmark_websocket_broadcast.py [--sockets 1000 10000] [--slow 0.01]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.websocket import ConnectionManager  # noqa: E402
+
+MESSAGE = {
+    "type": "real_time_update",
+    "data": {"update_type": "motion", "data": {"camera_id": "cam-1", "confidence": 0.93, "zones": list(range(20))}},
+    "timestamp": "2024-01-01T00:00:00",
+}
+
+
+class SimulatedSocket:
+    """Socket whose send yields to the loop like a real transport; slow ones take `delay` seconds"""
+
+    def __init__(self, delay: float, done: asyncio.Event, pending: list):
+        self.delay = delay
+        self.done = done
+        self.pending = pending
+
+    async def accept(self):
+        pass
+
+    async def close(self, code=1000):
+        pass
+
+    async def send_text(self, text):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+            return
+        await asyncio.sleep(0)
+        self.pending[0] -= 1
+        if self.pending[0] == 0:
+            self.done.set()
+
+
+async def run_queued(sockets: int, slow_share: float, slow_delay: float, rounds: int):
+    manager = ConnectionManager()
+    done = asyncio.Event()
+    pending = [0]
+    slow_every = int(1 / slow_share) if slow_share else 0
+    fast = 0
+    for i in range(sockets):
+        slow = bool(slow_every) and i % slow_every == 0
+        fast += not slow
+        await manager.connect(SimulatedSocket(slow_delay if slow else 0.0, done, pending), f"user-{i}")
+    await asyncio.sleep(0.1)  # flush welcome frames
+
+    call_times, delivery_times = [], []
+    for _ in range(rounds):
+        done.clear()
+        pending[0] = fast
+        started = time.perf_counter()
+        await manager.broadcast(MESSAGE)
+        call_times.append(time.perf_counter() - started)
+        await done.wait()
+        delivery_times.append(time.perf_counter() - started)
+    for connection_id in list(manager.active_connections):
+        manager.disconnect(connection_id)
+    return min(call_times), sorted(delivery_times)[len(delivery_times) // 2]
+
+
+async def run_sequential(sockets: int, slow_share: float, slow_delay: float, rounds: int):
+    done = asyncio.Event()
+    pending = [0]
+    slow_every = int(1 / slow_share) if slow_share else 0
+    clients = [
+        SimulatedSocket(slow_delay if slow_every and i % slow_every == 0 else 0.0, done, pending)
+        for i in range(sockets)
+    ]
+    times = []
+    for _ in range(rounds):
+        pending[0] = sockets
+        started = time.perf_counter()
+        for client in clients:
+            await client.send_text(json.dumps(MESSAGE))
+        times.append(time.perf_counter() - started)
+    median = sorted(times)[len(times) // 2]
+    return median, median
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sockets", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--slow", type=float, default=0.01, help="share of slow clients")
+    parser.add_argument("--slow-delay", type=float, default=0.05, help="seconds per send for slow clients")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"Broadcast latency, {args.slow:.0%} slow clients at {args.slow_delay * 1000:.0f}ms/send")
+    print(f"{'sockets':>8}  {'mode':<11}{'call ms':>10}{'delivered ms':>14}")
+    for sockets in args.sockets:
+        for mode, runner in (("sequential", run_sequential), ("queued", run_queued)):
+            call, delivered = asyncio.run(runner(sockets, args.slow, args.slow_delay, args.rounds))
+            print(f"{sockets:>8}  {mode:<11}{call * 1000:>10.2f}{delivered * 1000:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,17 @@
+import os
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import MagicMock, patch
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+# Keep the app lifespan off the Postgres startup probe
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+
 from app.main import app
-from app.core.database import Base, get_db
+from app.core.database import Base, get_db, get_async_db
 
 # Create in-memory SQLite database for testing
 SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
@@ -17,6 +23,13 @@ engine = create_engine(
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(
+    "sqlite+aiosqlite:///:memory:",
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+TestingAsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+
 
 def override_get_db():
     db = TestingSessionLocal()
@@ -26,14 +39,32 @@ def override_get_db():
         db.close()
 
 
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+
+async def _run_async_ddl(fn):
+    async with async_engine.begin() as conn:
+        await conn.run_sync(fn)
+
+
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
 
 
 @pytest.fixture(scope="function")
 def client():
     Base.metadata.create_all(bind=engine)
     with TestClient(app) as test_client:
-        yield test_client
+        # DDL and disposal run on the app's loop, the one that uses the connection;
+        # disposing stops aiosqlite's worker thread so the run can exit
+        test_client.portal.call(_run_async_ddl, Base.metadata.create_all)
+        try:
+            yield test_client
+        finally:
+            test_client.portal.call(_run_async_ddl, Base.metadata.drop_all)
+            test_client.portal.call(async_engine.dispose)
     Base.metadata.drop_all(bind=engine)
 
 
@@ -101,6 +101,34 @@ class TestMonitoringEndpoints:
         # Should exist even if returns error
         assert response.status_code in [200, 401, 403, 404, 500]
 
+    def test_request_profile_samples_endpoint_behind_http_middlewares(self, client):
+        """Test X-Profile samples the endpoint through the app's BaseHTTPMiddleware stack"""
+        import time
+
+        from app.core.auth import create_access_token
+        from app.core.profiling import profiler
+        from app.main import app
+
+        async def profile_probe():
+            deadline = time.perf_counter() + 0.1
+            while time.perf_counter() < deadline:
+                pass
+            return {"ok": True}
+
+        app.add_api_route("/profile-probe", profile_probe)
+        route = app.router.routes[-1]
+        try:
+            token = create_access_token({"sub": "root", "role": "admin"})
+            response = client.get(
+                "/profile-probe", headers={"X-Profile": "1", "Authorization": f"Bearer {token}"}
+            )
+        finally:
+            app.router.routes.remove(route)
+
+        profile = profiler.store.get(response.headers["x-profile-id"])
+        assert profile.samples > 0
+        assert "profile_probe (test_api.py:" in profile.to_collapsed()
+
 
 class TestAPIValidation:
     def test_invalid_json_body(self, client):
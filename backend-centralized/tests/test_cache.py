@@ -0,0 +1,311 @@
+import asyncio
+import time
+
+from datetime import datetime
+from decimal import Decimal
+
+from app.core.cache import CacheManager, LRUMemoryCache
+from app.core.cache_codec import CacheSerializer, HEADER_MAGIC
+
+
+class TestLRUMemoryCache:
+    def test_evicts_least_recently_used_entry(self):
+        """Test entry-count bound evicts the least recently used key"""
+        cache = LRUMemoryCache(max_entries=2, max_bytes=1024)
+        cache.set("a", 1, ttl=60, size=1)
+        cache.set("b", 2, ttl=60, size=1)
+        cache.get("a")
+        cache.set("c", 3, ttl=60, size=1)
+
+        assert cache.get("b", None) is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        assert cache.evictions == 1
+
+    def test_byte_budget_is_enforced(self):
+        """Test byte accounting evicts entries beyond the size budget"""
+        cache = LRUMemoryCache(max_entries=100, max_bytes=10)
+        cache.set("a", "x", ttl=60, size=6)
+        cache.set("b", "y", ttl=60, size=6)
+
+        assert len(cache) == 1
+        assert cache.current_bytes == 6
+        assert cache.set("huge", "z", ttl=60, size=11) is False
+
+    def test_expired_entries_are_dropped(self):
+        """Test TTL expiry on read and on purge"""
+        cache = LRUMemoryCache()
+        cache.set("a", 1, ttl=0.01, size=1)
+        cache.set("b", 2, ttl=0.01, size=1)
+        time.sleep(0.02)
+
+        assert cache.get("a", None) is None
+        assert cache.purge_expired() == 1
+        assert cache.current_bytes == 0
+
+    def test_clear_by_glob_pattern(self):
+        """Test pattern clear uses glob semantics"""
+        cache = LRUMemoryCache()
+        cache.set("user:1", 1, ttl=60, size=1)
+        cache.set("user:2", 2, ttl=60, size=1)
+        cache.set("client:1", 3, ttl=60, size=1)
+
+        assert cache.clear("user:*") == 2
+        assert cache.get("client:1") == 3
+
+
+class TestCacheSerializer:
+    def test_msgpack_preserves_datetime_and_decimal(self):
+        """Test msgpack codec round-trips datetime and Decimal values"""
+        serializer = CacheSerializer(codec="msgpack", compression="none")
+        value = {"at": datetime(2024, 1, 27, 10, 0), "amount": Decimal("19.99"), 1: [1, 2]}
+
+        payload = serializer.dumps(value)
+
+        assert payload[0] == HEADER_MAGIC
+        assert serializer.loads(payload) == value
+
+    def test_large_payloads_are_compressed(self):
+        """Test payloads above the threshold are compressed"""
+        serializer = CacheSerializer(codec="msgpack", compression="zlib", compress_threshold=64)
+        value = {"rows": ["same value"] * 200}
+
+        payload = serializer.dumps(value)
+
+        assert payload[1] >> 4 != 0
+        assert len(payload) < len(CacheSerializer(compression="none").dumps(value))
+        assert serializer.loads(payload) == value
+
+    def test_reads_other_codecs_and_legacy_json(self):
+        """Test a reader decodes payloads written by other codecs"""
+        reader = CacheSerializer(codec="msgpack")
+        written = CacheSerializer(codec="json").dumps({"a": 1})
+
+        assert reader.loads(written) == {"a": 1}
+        assert reader.loads(b'{"legacy": true}') == {"legacy": True}
+
+    def test_tags_round_trip_in_envelope(self):
+        """Test tags written with a value are read back so memory refills stay tagged"""
+        serializer = CacheSerializer(codec="msgpack", compression="zlib", compress_threshold=64)
+        value = {"rows": ["same value"] * 200}
+
+        payload = serializer.dumps(value, tags=("tenant:1", "resource:camera"))
+
+        assert serializer.loads_tagged(payload) == (value, ("tenant:1", "resource:camera"))
+        assert serializer.loads(payload) == value
+        assert serializer.loads_tagged(serializer.dumps(value)) == (value, ())
+
+
+class TestCacheManager:
+    def test_async_round_trip_without_redis(self):
+        """Test async get/set/delete against the in-process tier"""
+        manager = CacheManager(redis_url=None)
+
+        async def scenario():
+            assert await manager.set("key", {"value": 1}, ttl=60)
+            assert await manager.get("key") == {"value": 1}
+            assert await manager.exists("key")
+            await manager.delete("key")
+            return await manager.get("key", "default")
+
+        assert asyncio.run(scenario()) == "default"
+
+    def test_cached_decorator_supports_async_and_sync(self, monkeypatch):
+        """Test the cached decorator wraps coroutine and plain functions"""
+        from app.core import cache as cache_module
+
+        monkeypatch.setattr(cache_module, "cache_manager", CacheManager(redis_url=None))
+        calls = []
+
+        @cache_module.cached("async-prefix", ttl=60)
+        async def load_async(value):
+            calls.append(("async", value))
+            return value * 2
+
+        @cache_module.cached("sync-prefix", ttl=60)
+        def load_sync(value):
+            calls.append(("sync", value))
+            return value * 3
+
+        async def scenario():
+            return [await load_async(2), await load_async(2)]
+
+        assert asyncio.run(scenario()) == [4, 4]
+        assert [load_sync(2), load_sync(2)] == [6, 6]
+        assert calls == [("async", 2), ("sync", 2)]
+
+    def test_concurrent_misses_are_coalesced(self, monkeypatch):
+        """Test concurrent misses on one key share a single computation"""
+        from app.core import cache as cache_module
+
+        manager = CacheManager(redis_url=None)
+        monkeypatch.setattr(cache_module, "cache_manager", manager)
+        calls = []
+
+        @cache_module.cached("hot-key", ttl=60)
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"status": "ok"}
+
+        async def scenario():
+            return await asyncio.gather(*[load() for _ in range(5)])
+
+        results = asyncio.run(scenario())
+
+        assert results == [{"status": "ok"}] * 5
+        assert len(calls) == 1
+        assert manager.coalescing.coalesced_waits == 4
+
+    def test_cancelled_leader_does_not_cancel_waiters(self):
+        """Test waiters retry and one becomes the new leader when the leader is cancelled"""
+        from app.core.cache import SingleFlight
+
+        flights = SingleFlight()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.02)
+            return len(calls)
+
+        async def scenario():
+            leader = asyncio.create_task(flights.do("key", compute))
+            await asyncio.sleep(0)
+            waiters = [asyncio.create_task(flights.do("key", compute)) for _ in range(3)]
+            await asyncio.sleep(0.005)
+            leader.cancel()
+            results = await asyncio.gather(*waiters)
+            return leader.cancelled(), results
+
+        leader_cancelled, results = asyncio.run(scenario())
+
+        assert leader_cancelled
+        assert sorted(results) == [(2, False), (2, True), (2, True)]
+        assert len(calls) == 2
+
+    def test_stale_value_served_while_refreshing(self, monkeypatch):
+        """Test stale-while-revalidate serves the old value and refreshes once"""
+        from app.core import cache as cache_module
+
+        manager = CacheManager(redis_url=None)
+        monkeypatch.setattr(cache_module, "cache_manager", manager)
+        versions = iter(range(1, 10))
+
+        @cache_module.cached("swr", ttl=0, stale_ttl=60)
+        async def load():
+            return next(versions)
+
+        async def scenario():
+            first = await load()
+            stale = [await load(), await load()]
+            await asyncio.sleep(0.01)
+            return first, stale
+
+        first, stale = asyncio.run(scenario())
+
+        assert first == 1
+        assert stale == [1, 1]
+        assert manager.coalescing.stale_serves == 2
+        assert manager.coalescing.refreshes == 1
+
+    def test_invalidate_by_tag(self):
+        """Test tag invalidation removes only the tagged entries"""
+        manager = CacheManager(redis_url=None)
+
+        async def scenario():
+            await manager.set("a", 1, tags=["tenant:1", "resource:camera"])
+            await manager.set("b", 2, tags=["tenant:2", "resource:camera"])
+            await manager.set("c", 3, tags=["tenant:1"])
+            removed = await manager.invalidate_tags("tenant:1")
+            return removed, [await manager.get(k) for k in ("a", "b", "c")]
+
+        removed, values = asyncio.run(scenario())
+
+        assert removed == 2
+        assert values == [None, 2, None]
+
+    def test_namespace_generation_bump(self, monkeypatch):
+        """Test bumping a namespace generation invalidates decorated entries"""
+        from app.core import cache as cache_module
+
+        manager = CacheManager(redis_url=None)
+        monkeypatch.setattr(cache_module, "cache_manager", manager)
+        calls = []
+
+        @cache_module.cached("report", ttl=60, namespace="analytics")
+        async def report(time_range):
+            calls.append(time_range)
+            return {"range": time_range}
+
+        @cache_module.invalidate_cache(namespace="analytics")
+        async def record_event():
+            return True
+
+        async def scenario():
+            await report("7d")
+            await report("7d")
+            await record_event()
+            await report("7d")
+
+        asyncio.run(scenario())
+
+        assert calls == ["7d", "7d"]
+
+    def test_sync_invalidation_outside_event_loop(self, monkeypatch):
+        """Test a sync mutation bumps the namespace now and hands background work to the bound loop"""
+        import threading
+        from app.core import cache as cache_module
+
+        manager = CacheManager(redis_url=None)
+        monkeypatch.setattr(cache_module, "cache_manager", manager)
+        calls = []
+
+        @cache_module.cached("report", ttl=60, namespace="analytics")
+        def report(time_range):
+            calls.append(time_range)
+            return {"range": time_range}
+
+        @cache_module.invalidate_cache(namespace="analytics")
+        def record_event():
+            return True
+
+        report("7d")
+        record_event()
+        report("7d")
+        assert calls == ["7d", "7d"]
+
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        try:
+            manager.bind_loop(loop)
+
+            async def on_loop():
+                return threading.current_thread() is thread
+
+            assert manager.schedule(on_loop()).result(timeout=5)
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+    def test_per_prefix_metrics(self):
+        """Test hits, misses, sets and evictions are counted per prefix"""
+        manager = CacheManager(redis_url=None, max_entries=2)
+
+        async def scenario():
+            await manager.set("user:1", {"name": "a"})
+            await manager.get("user:1")
+            await manager.get("user:2")
+            await manager.set("analytics:7d", [1, 2, 3])
+            await manager.set("analytics:30d", [1, 2, 3])
+
+        asyncio.run(scenario())
+        snapshot = manager.metrics.snapshot()
+
+        user = snapshot["prefixes"]["user"]
+        assert (user["hits"], user["misses"], user["sets"], user["evictions"]) == (1, 1, 1, 1)
+        assert user["get_latency"]["count"] == 2
+        assert snapshot["prefixes"]["analytics"]["sets"] == 2
+        assert snapshot["hit_rate"] == 0.5
@@ -0,0 +1,423 @@
+import asyncio
+import time
+
+from app.core.monitoring import MetricsCollector
+
+
+class TestSystemMetricsSampler:
+    def test_collect_returns_latest_snapshot_without_blocking(self):
+        """Test reads return the sampled snapshot instead of sleeping on psutil"""
+        collector = MetricsCollector()
+        sampled = collector.sample_system_metrics()
+
+        started = time.perf_counter()
+        latest = collector.collect_system_metrics()
+
+        assert latest is sampled
+        assert time.perf_counter() - started < 0.05
+
+    def test_background_sampler_fills_ring_buffer(self):
+        """Test the sampler task appends snapshots into a bounded buffer"""
+        collector = MetricsCollector(system_history=3)
+
+        async def scenario():
+            collector.start_sampler(interval=0.01)
+            await asyncio.sleep(0.1)
+            await collector.stop_sampler()
+
+        asyncio.run(scenario())
+
+        assert len(collector.system_metrics) == 3
+        assert collector.collect_system_metrics() is collector.system_metrics[-1]
+
+
+class TestLatencySketch:
+    def test_quantiles_within_bucket_error(self):
+        """Test sketch quantiles stay within the log-linear bucket error"""
+        from app.core.latency import LatencySketch
+
+        sketch = LatencySketch()
+        values = [i / 10000 for i in range(1, 10001)]  # 0.1ms .. 1s
+        for value in values:
+            sketch.record(value)
+
+        quantiles = sketch.quantiles((0.5, 0.95, 0.99))
+
+        for q, expected in ((0.5, 0.5), (0.95, 0.95), (0.99, 0.99)):
+            assert abs(quantiles[q] - expected) / expected < 0.04
+        assert sketch.count == 10000
+        assert len(sketch.counts) < 300
+
+    def test_sketches_merge(self):
+        """Test merging two sketches equals recording into one"""
+        from app.core.latency import LatencySketch
+
+        first, second, combined = LatencySketch(), LatencySketch(), LatencySketch()
+        for i in range(1, 500):
+            (first if i % 2 else second).record(i / 1000)
+            combined.record(i / 1000)
+
+        merged = LatencySketch.merged([first, second])
+
+        assert merged.counts == combined.counts
+        assert merged.quantile(0.99) == combined.quantile(0.99)
+
+    def test_rolling_windows_expire_old_samples(self):
+        """Test a sample leaves the 1m window but stays in the 5m and 1h windows"""
+        from app.core.latency import RollingLatency
+
+        rolling = RollingLatency()
+        rolling.record(0.2, now=1000.0)
+        later = 1000.0 + 120
+
+        assert rolling.window(60, now=1000.0).count == 1
+        assert rolling.window(60, now=later).count == 0
+        assert rolling.window(300, now=later).count == 1
+        assert rolling.window(3600, now=later).count == 1
+
+    def test_route_and_status_class_series(self):
+        """Test requests are split per route template and status class"""
+        collector = MetricsCollector()
+        collector.record_request(0.010, 200, "/api/v1/cameras/{camera_id}")
+        collector.record_request(0.020, 201, "/api/v1/cameras/{camera_id}")
+        collector.record_request(0.500, 503, "/api/v1/cameras/{camera_id}")
+
+        summary = collector.latency.summary(60)
+        route = summary["routes"]["/api/v1/cameras/{camera_id}"]
+
+        assert route["2xx"]["count"] == 2
+        assert route["5xx"]["count"] == 1
+        assert summary["overall"]["count"] == 3
+        assert not hasattr(collector, "request_times")
+
+
+class TestHealthChecker:
+    def test_checks_run_concurrently_under_deadline(self):
+        """Test slow checks time out individually without delaying the others"""
+        from app.core.monitoring import HealthChecker
+
+        async def fast():
+            await asyncio.sleep(0.05)
+            return {"status": "healthy"}
+
+        async def hung():
+            await asyncio.sleep(10)
+            return {"status": "healthy"}
+
+        checker = HealthChecker(check_timeout=0.2)
+        checker.add_health_check("a", fast)
+        checker.add_health_check("b", fast)
+        checker.add_health_check("slow", hung)
+
+        started = time.perf_counter()
+        checks = {check.service: check for check in asyncio.run(checker.perform_health_checks())}
+
+        assert time.perf_counter() - started < 1.0
+        assert checks["a"].status == "healthy"
+        assert checks["slow"].status == "unhealthy"
+        assert "Timed out" in checks["slow"].error_message
+        assert checker.get_overall_health() == "unhealthy"
+
+    def test_results_are_cached_between_refreshes(self):
+        """Test readers reuse cached results instead of re-running checks"""
+        from app.core.monitoring import HealthChecker
+
+        calls = []
+
+        async def probe():
+            calls.append(1)
+            return {"status": "healthy"}
+
+        async def scenario():
+            checker = HealthChecker(check_interval=60)
+            checker.add_health_check("db", probe)
+            assert checker.get_overall_health() == "unknown"
+            await checker.refresh()
+            for _ in range(5):
+                checker.get_health_checks()
+            return checker.get_overall_health()
+
+        assert asyncio.run(scenario()) == "healthy"
+        assert len(calls) == 1
+
+
+class TestMonitoringMiddleware:
+    def test_labels_route_template_method_status_and_tenant(self):
+        """Test the ASGI middleware records matched route templates and tenant state"""
+        from fastapi import FastAPI, HTTPException, Request
+        from fastapi.testclient import TestClient
+
+        from app.core.monitoring import MonitoringMiddleware
+
+        collector = MetricsCollector()
+        app = FastAPI()
+
+        @app.get("/cameras/{camera_id}")
+        async def get_camera(camera_id: str):
+            if camera_id == "missing":
+                raise HTTPException(status_code=404)
+            return {"id": camera_id}
+
+        @app.middleware("http")
+        async def tenant_middleware(request: Request, call_next):
+            request.state.tenant_id = request.headers.get("X-Tenant-ID")
+            return await call_next(request)
+
+        app.add_middleware(MonitoringMiddleware, metrics_collector=collector)
+
+        client = TestClient(app)
+        client.get("/cameras/1", headers={"X-Tenant-ID": "acme"})
+        client.get("/cameras/2", headers={"X-Tenant-ID": "acme"})
+        client.get("/cameras/missing")
+        client.get("/nope")
+
+        summary = collector.latency.summary(60)
+
+        assert summary["routes"]["GET /cameras/{camera_id}"]["2xx"]["count"] == 2
+        assert summary["routes"]["GET /cameras/{camera_id}"]["4xx"]["count"] == 1
+        assert summary["routes"]["GET unmatched"]["4xx"]["count"] == 1
+        assert summary["tenants"]["acme"]["2xx"]["count"] == 2
+
+
+class TestMetricsExport:
+    def test_merges_worker_snapshots(self, tmp_path):
+        """Test counters and histograms sum across workers while max gauges do not"""
+        from app.core.metrics_export import merge_snapshots, read_snapshots, write_snapshot
+
+        def worker(requests, cpu):
+            return [
+                {"name": "hg_requests", "type": "counter", "help": "", "agg": "sum",
+                 "samples": [{"labels": {"route": "/a"}, "value": requests}]},
+                {"name": "hg_cpu", "type": "gauge", "help": "", "agg": "max",
+                 "samples": [{"labels": {}, "value": cpu}]},
+                {"name": "hg_latency", "type": "histogram", "help": "", "agg": "sum",
+                 "samples": [{"labels": {"route": "/a"}, "buckets": [[0.1, requests], ["+Inf", requests]],
+                              "sum": requests * 0.05}]},
+            ]
+
+        write_snapshot(str(tmp_path), worker(3, 40.0), pid=1)
+        write_snapshot(str(tmp_path), worker(5, 70.0), pid=2)
+        merged = {f["name"]: f for f in merge_snapshots(read_snapshots(str(tmp_path)))}
+
+        assert merged["hg_requests"]["samples"][0]["value"] == 8
+        assert merged["hg_cpu"]["samples"][0]["value"] == 70.0
+        assert merged["hg_latency"]["samples"][0]["buckets"] == [[0.1, 8], ["+Inf", 8]]
+
+    def test_renders_openmetrics(self):
+        """Test the collected snapshot renders as OpenMetrics text"""
+        from app.core.metrics_export import collect_snapshot, render
+        from app.core.monitoring import metrics_collector
+
+        metrics_collector.record_request(0.02, 200, "/cameras/{camera_id}", method="GET")
+
+        snapshot = collect_snapshot()
+        duration = next(f for f in snapshot if f["name"].endswith("_http_request_duration_seconds"))
+        assert all("sketch" in sample and "buckets" not in sample for sample in duration["samples"])
+
+        body = render(snapshot).decode()
+
+        assert 'http_request_duration_seconds_bucket{le="0.025",method="GET",route="/cameras/{camera_id}"' in body
+        assert "websocket_connections" in body
+        assert body.rstrip().endswith("# EOF")
+
+
+class TestSamplingProfiler:
+    def test_on_demand_session_produces_folded_stacks(self):
+        """Test a time-boxed session samples the event loop and renders flamegraph output"""
+        from app.core.profiling import SamplingProfiler
+
+        def spin(seconds):
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                pass
+
+        async def scenario():
+            profiler = SamplingProfiler()
+            session = asyncio.create_task(profiler.profile_for(0.3, interval=0.002))
+            await asyncio.sleep(0.01)
+            spin(0.2)
+            return await session
+
+        profile = asyncio.run(scenario())
+
+        assert profile.samples > 10
+        assert "spin (test_monitoring.py:" in profile.to_collapsed()
+        speedscope = profile.to_speedscope()
+        assert len(speedscope["profiles"][0]["samples"]) == len(speedscope["profiles"][0]["weights"])
+
+    def test_profile_header_requires_allowed_role(self):
+        """Test only tokens with a profiling role get a per-request profile"""
+        from fastapi import FastAPI
+        from fastapi.testclient import TestClient
+
+        from app.core.auth import create_access_token
+        from app.core.profiling import ProfilingMiddleware, SamplingProfiler
+
+        profiler = SamplingProfiler()
+        app = FastAPI()
+
+        @app.get("/work")
+        async def work():
+            return {"ok": True}
+
+        app.add_middleware(ProfilingMiddleware, profiler=profiler)
+        client = TestClient(app)
+
+        admin = create_access_token({"sub": "root", "role": "admin"})
+        user = create_access_token({"sub": "bob", "role": "user"})
+
+        assert "x-profile-id" not in client.get("/work", headers={"X-Profile": "1"}).headers
+        denied = client.get("/work", headers={"X-Profile": "1", "Authorization": f"Bearer {user}"})
+        assert "x-profile-id" not in denied.headers
+        allowed = client.get("/work", headers={"X-Profile": "1", "Authorization": f"Bearer {admin}"})
+        assert profiler.store.get(allowed.headers["x-profile-id"]) is not None
+
+
+class TestTracing:
+    def test_request_trace_links_sql_and_cache_spans(self):
+        """Test spans opened under a request share its trace and tenant tag"""
+        from fastapi import FastAPI, Request
+        from fastapi.testclient import TestClient
+        from sqlalchemy import create_engine, text
+
+        from app.core.cache import CacheManager
+        from app.core.tracing import Tracer, TracingMiddleware, instrument_engine
+
+        engine = create_engine("sqlite://")
+        instrument_engine(engine, "test")
+        cache = CacheManager()
+        tracer = Tracer(enabled=True, sample_rate=1.0, export_dir="")
+        app = FastAPI()
+
+        @app.get("/cameras/{camera_id}")
+        async def get_camera(camera_id: str):
+            await cache.get(f"camera:{camera_id}")
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1")).fetchone()
+            return {"id": camera_id}
+
+        @app.middleware("http")
+        async def tenant_middleware(request: Request, call_next):
+            request.state.tenant_id = request.headers.get("X-Tenant-ID")
+            return await call_next(request)
+
+        app.add_middleware(TracingMiddleware, tracer=tracer)
+
+        response = TestClient(app).get("/cameras/7", headers={"X-Tenant-ID": "acme"})
+        trace = tracer.memory.get(response.headers["x-trace-id"]).to_dict()
+        names = [span["name"] for span in trace["spans"]]
+
+        assert trace["name"] == "GET /cameras/{camera_id}"
+        assert trace["tenant_id"] == "acme"
+        assert "cache.get" in names and "db.select" in names
+        root_id = trace["spans"][0]["span_id"]
+        assert all(span["parent_id"] == root_id for span in trace["spans"][1:])
+        engine.dispose()
+
+    def test_spans_are_noops_outside_a_trace(self):
+        """Test span() records nothing when no request trace is active"""
+        from app.core import tracing
+
+        with tracing.span("orphan") as span:
+            assert span is None
+
+
+class TestRollupStore:
+    def test_queries_cover_full_period_in_constant_memory(self):
+        """Test a day of traffic is summarized from fixed minute and hour rings"""
+        from app.core.rollups import RollupStore
+
+        store = RollupStore(db_path="")
+        start = 1_699_999_200.0  # hour-aligned
+        for minute in range(2 * 24 * 60):
+            store.record_request(0.05, 200, now=start + minute * 60)
+            if minute % 60 == 0:
+                store.record_request(1.0, 503, now=start + minute * 60)
+                store.record_error("TimeoutError", now=start + minute * 60)
+        now = start + 2 * 24 * 3600 - 1
+
+        day = store.query(24 * 3600, now=now)
+        week = store.query(7 * 24 * 3600, now=now)
+
+        assert day.requests == 24 * 60 + 24
+        assert day.server_errors == 24 and day.error_types["TimeoutError"] == 24
+        assert week.requests == 2 * (24 * 60 + 24)
+        assert all(len(ring.slots) in (1440, 168) for ring in store.rings)
+
+    def test_history_survives_restart_via_sqlite(self, tmp_path):
+        """Test flushed rollups are merged on disk and reloaded by a new store"""
+        from app.core.rollups import RollupStore
+
+        path = str(tmp_path / "rollups.db")
+        now = time.time()
+        for _ in range(2):
+            worker = RollupStore(db_path=path)
+            worker.record_request(0.1, 200, now=now)
+            worker.record_error("ValueError", now=now)
+            worker.flush()
+
+        restarted = RollupStore(db_path=path)
+        assert restarted.load(now=now) == 2
+        summary = restarted.query(3600, now=now)
+        assert (summary.requests, summary.errors) == (2, 2)
+
+
+class TestLoggingPipeline:
+    def test_json_lines_written_by_listener(self):
+        """Test records are formatted as JSON lines in the listener thread"""
+        import io
+        import json
+        import logging
+        from app.core.logging import setup_logging, shutdown_logging, log_user_activity
+
+        stream = io.StringIO()
+        setup_logging(stream=stream, fmt="json")
+        try:
+            logging.getLogger("test.pipeline").info("hello %s", "world")
+            log_user_activity("u1", "login")
+        finally:
+            shutdown_logging()
+
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        assert lines[0]["msg"] == "hello world"
+        assert lines[1]["logger"] == "audit" and lines[1]["fields"]["user_id"] == "u1"
+
+    def test_records_keep_call_time_values(self):
+        """Test mutating arguments after the log call does not change what is written"""
+        import io
+        import json
+        import logging
+        from app.core.logging import setup_logging, shutdown_logging, log_user_activity
+
+        stream = io.StringIO()
+        setup_logging(stream=stream, fmt="json")
+        try:
+            details = {"step": "before"}
+            state = ["before"]
+            log_user_activity("u1", "update", details)
+            logging.getLogger("test.pipeline").info("state %r", state)
+            details["step"] = "after"
+            state[0] = "after"
+        finally:
+            shutdown_logging()
+
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        assert lines[0]["fields"]["details"] == {"step": "before"}
+        assert lines[1]["msg"] == "state ['before']"
+
+    def test_api_category_is_sampled_below_warning(self):
+        """Test a zero sample rate drops api records but keeps 5xx warnings"""
+        import io
+        from app.core.logging import setup_logging, shutdown_logging, log_api_request
+
+        stream = io.StringIO()
+        setup_logging(stream=stream, sample_rates="api:0.0")
+        try:
+            for _ in range(50):
+                log_api_request("GET", "/ok", 200)
+            log_api_request("GET", "/fail", 503)
+        finally:
+            shutdown_logging()
+
+        lines = stream.getvalue().splitlines()
+        assert len(lines) == 1 and "/fail" in lines[0]
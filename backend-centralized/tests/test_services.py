@@ -144,3 +144,271 @@ class TestCameraIntegration:
         assert "720p" in qualities
         assert "1080p" in qualities
         assert len(qualities) == 5
+
+
+class _FakeWebSocket:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.frames = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        import asyncio
+
+        await asyncio.sleep(self.delay)
+        self.frames.append(text)
+
+    async def close(self, code=1000):
+        pass
+
+
+class TestWebSocketFanout:
+    def test_broadcast_is_not_blocked_by_slow_client(self):
+        """Test broadcast enqueues one encoded frame and a slow socket does not delay others"""
+        import asyncio
+        from app.core.pubsub import PubSubHub
+        from app.core.websocket import ConnectionManager
+
+        async def scenario():
+            manager = ConnectionManager(PubSubHub())
+            fast, slow = _FakeWebSocket(), _FakeWebSocket(delay=5)
+            ids = [await manager.connect(fast, "u1"), await manager.connect(slow, "u2")]
+            try:
+                assert await manager.broadcast({"type": "alert", "n": 1}) == 2
+                await asyncio.sleep(0.05)
+                return fast.frames, slow.frames
+            finally:
+                for connection_id in ids:
+                    manager.disconnect(connection_id)
+
+        fast_frames, slow_frames = asyncio.run(scenario())
+        assert len(fast_frames) == 2 and '"alert"' in fast_frames[1]
+        assert slow_frames == []
+
+    def test_slow_consumer_policies(self):
+        """Test drop keeps the newest frames, coalesce replaces by key, disconnect closes"""
+        import asyncio
+        from app.core.ws_outbound import OutboundConnection
+
+        async def scenario():
+            closed = []
+            drop = OutboundConnection(_FakeWebSocket(delay=5), "a", max_queue=2, policy="drop")
+            coalesce = OutboundConnection(_FakeWebSocket(delay=5), "b", max_queue=2, policy="coalesce")
+            disconnect = OutboundConnection(_FakeWebSocket(delay=5), "c", max_queue=2, policy="disconnect",
+                                            on_close=closed.append)
+            await asyncio.sleep(0)
+            for connection in (drop, coalesce, disconnect):
+                for i in range(3):
+                    connection.offer(f"frame-{i}", coalesce_key="status" if i else None)
+            results = (list(drop.queue), list(coalesce.queue), closed)
+            for connection in (drop, coalesce, disconnect):
+                connection.close()
+            return results
+
+        drop_queue, coalesce_queue, closed = asyncio.run(scenario())
+        assert [payload for _, payload in drop_queue] == ["frame-1", "frame-2"]
+        assert [payload for _, payload in coalesce_queue] == ["frame-0", "frame-2"]
+        assert closed == ["c"]
+
+
+class TestPubSubHub:
+    def test_topic_index_wildcards(self):
+        """Test exact, single-segment and trailing multi-segment patterns"""
+        from app.core.pubsub import TopicIndex
+
+        index = TopicIndex()
+        index.add("tenant/t1/camera/c1", "exact")
+        index.add("tenant/+/camera/c1", "any-tenant")
+        index.add("tenant/t1/#", "whole-tenant")
+        index.add("user/u1", "user")
+
+        assert index.match("tenant/t1/camera/c1") == {"exact", "any-tenant", "whole-tenant"}
+        assert index.match("tenant/t2/camera/c1") == {"any-tenant"}
+        assert index.match("tenant/t1") == {"whole-tenant"}
+        assert index.match("user/u2") == set()
+
+        index.remove("tenant/t1/camera/c1", "exact")
+        assert "camera" not in index.root.children["tenant"].children["t1"].children
+        assert index.patterns == 3
+
+    def test_publish_dedupes_recipients_and_cleans_up(self):
+        """Test a socket matching several topics gets one copy and disconnect drops its subscriptions"""
+        import asyncio
+        from app.core.pubsub import PubSubHub, camera_topic
+
+        async def scenario():
+            hub = PubSubHub()
+            watcher, sender = _FakeWebSocket(), _FakeWebSocket()
+            subscriber = await hub.connect(watcher, scope="test", topics=("surveillance/all",),
+                                           patterns=("tenant/+/camera/c1",))
+            other = await hub.connect(sender, scope="test", topics=("surveillance/all",))
+            reached = await hub.publish(["surveillance/all", camera_topic("c1")], {"type": "motion"},
+                                        exclude=other.connection_id)
+            await asyncio.sleep(0.01)
+            hub.disconnect(subscriber.connection_id)
+            return reached, watcher.frames, sender.frames, hub
+
+        reached, watcher_frames, sender_frames, hub = asyncio.run(scenario())
+        assert reached == 1 and len(watcher_frames) == 1 and sender_frames == []
+        assert hub.index.match(camera_topic("c1")) == set()
+        assert hub.count("test") == 1
+
+    def test_client_ids_cannot_act_as_wildcards(self):
+        """Test a `+` user id subscribes to a literal topic and does not receive other users' messages"""
+        import asyncio
+        import pytest
+        from app.core.pubsub import PubSubHub, user_topic
+
+        async def scenario():
+            hub = PubSubHub()
+            snoop = _FakeWebSocket()
+            subscriber = await hub.connect(snoop, scope="test")
+            hub.subscribe(subscriber.connection_id, f"{user_topic('+')}/messages")
+            with pytest.raises(ValueError):
+                hub.subscribe(subscriber.connection_id, "user/+/messages")
+            reached = [await hub.publish(f"{user_topic(user)}/messages", {"to": user})
+                       for user in ("alice", "bob", "+")]
+            await asyncio.sleep(0.01)
+            return reached, snoop.frames
+
+        reached, frames = asyncio.run(scenario())
+        assert user_topic("a/b") == "user/a%2Fb" and user_topic("#") == "user/%23"
+        assert reached == [0, 0, 1] and len(frames) == 1
+
+
+class TestEventBus:
+    def test_publish_reaches_other_workers_once_in_one_batch(self):
+        """Test events cross workers through a shared broker, batched and without echo"""
+        import asyncio
+        from app.core.event_bus import EventBus, LocalBroker
+        from app.core.pubsub import PubSubHub
+
+        async def scenario():
+            network = []
+            workers = [PubSubHub(), PubSubHub()]
+            buses = [EventBus(LocalBroker(network), pubsub=worker, batch_delay_ms=1) for worker in workers]
+            for bus in buses:
+                await bus.start()
+            sockets = [_FakeWebSocket(), _FakeWebSocket()]
+            for worker, websocket in zip(workers, sockets):
+                await worker.connect(websocket, scope="test", topics=("user/u1",))
+
+            for i in range(3):
+                await workers[0].publish("user/u1", {"n": i})
+            await asyncio.sleep(0.05)
+            for bus in buses:
+                await bus.stop()
+            return sockets, buses
+
+        sockets, buses = asyncio.run(scenario())
+        assert [len(websocket.frames) for websocket in sockets] == [3, 3]
+        assert buses[0].batches == 1 and buses[0].sent == 3
+        assert buses[1].received == 3 and buses[0].received == 0
+
+
+class TestWebSocketSubscriptions:
+    def test_broadcasts_are_filtered_by_type_tenant_and_role(self):
+        """Test subscribe narrows event types and admin/tenant broadcasts reach only matching sockets"""
+        import asyncio
+        from app.core.pubsub import PubSubHub
+        from app.core.websocket import ConnectionManager, WebSocketMessage, handle_websocket_message
+        import app.core.websocket as core_websocket
+
+        async def scenario():
+            manager = ConnectionManager(PubSubHub())
+            sockets = {name: _FakeWebSocket() for name in ("admin", "staff", "other_tenant")}
+            ids = {
+                "admin": await manager.connect(sockets["admin"], "a", tenant_id="t1", role="admin"),
+                "staff": await manager.connect(sockets["staff"], "s", tenant_id="t1", role="staff"),
+                "other_tenant": await manager.connect(sockets["other_tenant"], "o", tenant_id="t2", role="staff"),
+            }
+            original, core_websocket.manager = core_websocket.manager, manager
+            try:
+                await handle_websocket_message(
+                    ids["staff"], {"type": "subscribe", "subscription_type": "notifications"}, "s"
+                )
+            finally:
+                core_websocket.manager = original
+
+            reached = {
+                "admins": await manager.broadcast_to_admins(WebSocketMessage.notification("a", "b")),
+                "tenant": await manager.broadcast(WebSocketMessage.notification("t", "n"), tenant_id="t1"),
+                "status": await manager.broadcast(WebSocketMessage.system_status({"ok": True})),
+            }
+            await asyncio.sleep(0.01)
+            return reached, {name: len(socket.frames) for name, socket in sockets.items()}
+
+        reached, frames = asyncio.run(scenario())
+        # admin-only reaches one socket; t1 notification reaches both t1 sockets;
+        # status skips the staff socket, which subscribed to notifications only
+        assert reached == {"admins": 1, "tenant": 2, "status": 2}
+        # welcome + broadcasts (+ subscription ack for staff)
+        assert frames == {"admin": 4, "staff": 3, "other_tenant": 2}
+
+    def test_unlisted_types_are_delivered_through_the_other_bucket(self):
+        """Test custom broadcast types reach filtered sockets subscribed to "other" and keep one topic segment"""
+        import asyncio
+        from app.core.pubsub import PubSubHub
+        from app.core.websocket import ConnectionManager
+
+        async def scenario():
+            manager = ConnectionManager(PubSubHub())
+            everything, others, notifications = _FakeWebSocket(), _FakeWebSocket(), _FakeWebSocket()
+            await manager.connect(everything, "a")
+            manager.subscribe_events(await manager.connect(others, "b"), ["other"])
+            manager.subscribe_events(await manager.connect(notifications, "c"), ["notification"])
+            reached = await manager.broadcast({"type": "alert/camera/+", "data": {}})
+            await asyncio.sleep(0.01)
+            return reached, [len(socket.frames) for socket in (everything, others, notifications)]
+
+        reached, frames = asyncio.run(scenario())
+        assert reached == 2
+        assert frames == [2, 2, 1]
+
+
+class TestEventRing:
+    def test_since_returns_only_missed_events_and_flags_overwrites(self):
+        """Test sequence numbers survive wraparound and replay starts after the given seq"""
+        from app.core.event_history import EventRing
+
+        ring = EventRing(capacity=5)
+        for i in range(12):
+            assert ring.append({"n": i}) == i + 1
+
+        assert (ring.first_seq, ring.last_seq, len(ring)) == (8, 12, 5)
+        assert ring.since(10) == [{"n": 10}, {"n": 11}]
+        events, truncated = ring.entries(3)
+        assert [seq for seq, _ in events] == [8, 9, 10, 11, 12] and truncated
+        assert ring.entries(9, limit=2)[0] == [(10, {"n": 9}), (11, {"n": 10})]
+        assert ring.latest(2) == [{"n": 10}, {"n": 11}]
+
+    def test_position_from_another_history_is_flagged(self):
+        """Test a seq beyond the newest item or a foreign epoch returns everything as truncated"""
+        from app.core.event_history import EventRing
+
+        ring = EventRing(capacity=5)
+        for i in range(3):
+            ring.append({"n": i})
+
+        assert ring.entries(2, epoch=ring.epoch) == ([(3, {"n": 2})], False)
+        assert ring.entries(40) == ([(1, {"n": 0}), (2, {"n": 1}), (3, {"n": 2})], True)
+        assert ring.entries(2, epoch="other-worker")[1] is True
+        assert EventRing(capacity=5).entries(7) == ([], True)
+
+    def test_persisted_tail_keeps_sequence_across_restart(self, tmp_path):
+        """Test a reloaded ring resumes numbering after the saved tail"""
+        from app.core.event_history import EventRing
+
+        path = str(tmp_path / "events.jsonl")
+        ring = EventRing(capacity=3, path=path)
+        for i in range(4):
+            ring.append({"n": i})
+        ring.save()
+
+        restarted = EventRing(capacity=3, path=path)
+        assert restarted.load() == 3
+        assert restarted.epoch == ring.epoch
+        assert restarted.append({"n": 4}) == 5
+        assert restarted.since(3) == [{"n": 3}, {"n": 4}]